@@ -13,19 +13,42 @@ __email__       = 'patrick.michl@gmail.com'
 __maintainer__  = 'Patrick Michl'
 __credits__     = ['Rebecca Krauss', 'Sebastian Michl']
 
+import functools
+import sys
+
+# the import profiler has to be enabled before any other import
+if '--profile-startup' in sys.argv:
+    import qdeep.common.startup
+    qdeep.common.startup.enable()
+
 import qdeep.common
-import nemoa
+import qdeep.common.recovery
+import qdeep.common.runner
+import qdeep.common.saver
+import qdeep.common.startup
+import qdeep.common.tools
+import qdeep.common.trace
+import qdeep.common.worker
+import qdeep.objects
+import qdeep.objects.common
 from PySide import QtGui, QtCore
-import sys
-import pyqtgraph.console
+
+# nemoa is imported when the workspace is opened after startup
+nemoa = qdeep.common.LazyModule('nemoa')
 
 class MainWindow(QtGui.QMainWindow):
 
     settings = None
+    projectSave = None
+    recovery = None
+    toolRegistry = None
+    toolWorkers = None
 
     def __init__(self):
         super(MainWindow, self).__init__()
 
+        self.prefetchList = []
+        self.restoring = False
         self.readSettings()
 
         # setup MDI area
@@ -35,6 +58,7 @@ class MainWindow(QtGui.QMainWindow):
         self.mdiArea.setTabsMovable(True)
         #self.mdiArea.setObjectName("mdiArea")
         self.mdiArea.setAcceptDrops(True)
+        self.mdiArea.subWindowActivated.connect(self.subWindowActivated)
         self.setCentralWidget(self.mdiArea)
 
         self.createActions()
@@ -43,6 +67,11 @@ class MainWindow(QtGui.QMainWindow):
         self.createStatusBar()
         self.createDocks()
 
+        saver = qdeep.common.saver.getSaver()
+        saver.started.connect(self.saveStarted)
+        saver.finished.connect(self.saveFinished)
+        saver.failed.connect(self.saveFailed)
+
         self.setUnifiedTitleAndToolBarOnMac(True)
 
         self.applySettings()
@@ -110,8 +139,33 @@ class MainWindow(QtGui.QMainWindow):
 
     def closeEvent(self, event):
         event.accept()
+
+        # optimizations run on the global thread pool, which blocks the
+        # exit, so they are stopped at the end of their current epoch
+        training = [window.widget() for window in self.getEditorWindows()
+            if getattr(window.widget(), 'trainer', None)]
+        if training:
+            ret = QtGui.QMessageBox.question(self, "QDeep",
+                "The following models are being optimized:\n%s"
+                "\n\nDo you want to stop the optimizations?" % '\n'.join(
+                child.getTitle() for child in training),
+                QtGui.QMessageBox.Yes | QtGui.QMessageBox.No)
+            if ret != QtGui.QMessageBox.Yes: return event.ignore()
+            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            for child in training: child.stopOptimize()
+            while any(child.trainer for child in training):
+                QtGui.QApplication.processEvents(
+                    QtCore.QEventLoop.WaitForMoreEvents)
+            QtGui.QApplication.restoreOverrideCursor()
+
+        # editors of failed background saves remain modified
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        qdeep.common.saver.getSaver().waitForDone()
+        QtGui.QApplication.restoreOverrideCursor()
+
         if self.maybeSave():
             self.writeSettings()
+            if self.recovery: self.recovery.clear()
             event.accept()
         else:
             event.ignore()
@@ -195,6 +249,9 @@ class MainWindow(QtGui.QMainWindow):
 
         self.createDockObjects()
         self.createDockTools()
+        self.createDockJobs()
+        self.createDockConsole()
+        if qdeep.common.trace.getTracer(): self.createDockPerformance()
 
     def createDockObjects(self):
 
@@ -203,18 +260,31 @@ class MainWindow(QtGui.QMainWindow):
         dock.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea \
             | QtCore.Qt.RightDockWidgetArea)
         widget = QtGui.QWidget(dock)
-        self.treeWidget = QtGui.QTreeWidget(widget)
-        self.treeWidget.setColumnCount( 1 )
-        self.treeWidget.setHeaderLabels( ('Objects', ) )
-        self.treeWidget.itemDoubleClicked.connect(
+        self.objIndex = qdeep.objects.Index(self)
+        self.objIndex.changed.connect(self.updateDockObjects)
+        self.objectsModel = qdeep.objects.ObjectsModel(
+            self.objIndex, self)
+        self.treeView = qdeep.objects.ObjectsView(widget)
+        self.treeView.setModel(self.objectsModel)
+        self.treeView.setUniformRowHeights(True)
+        self.treeView.setDragEnabled(True)
+        self.treeView.setAcceptDrops(True)
+        self.treeView.setDropIndicatorShown(True)
+        self.treeView.setDragDropMode(QtGui.QAbstractItemView.DragDrop)
+        self.treeView.setSelectionMode(
+            QtGui.QAbstractItemView.ExtendedSelection)
+        self.objectsModel.toolDropped.connect(self.runTool)
+        self.treeView.doubleClicked.connect(
             self.openObjectFromObjectsDock)
-        self.treeWidget.setIconSize(QtCore.QSize(22, 22))
+        self.treeView.setIconSize(QtCore.QSize(22, 22))
         self.btEdit = QtGui.QPushButton("Edit")
         self.btEdit.clicked.connect(self.openObjectFromObjectsDock)
         self.btNew = QtGui.QPushButton("New")
         self.btAdd = QtGui.QPushButton("Add")
         self.btExport = QtGui.QPushButton("Export")
         self.btDelete = QtGui.QPushButton("Delete")
+        self.btCompare = QtGui.QPushButton("Compare")
+        self.btCompare.clicked.connect(self.compareModels)
         grid = QtGui.QGridLayout()
         grid.setSpacing(0)
         grid.setContentsMargins(0, 0, 0, 0)
@@ -223,7 +293,8 @@ class MainWindow(QtGui.QMainWindow):
         grid.addWidget(self.btAdd, 1, 2)
         grid.addWidget(self.btExport, 1, 3)
         grid.addWidget(self.btDelete, 1, 4)
-        grid.addWidget(self.treeWidget, 0, 0, 1, -1)
+        grid.addWidget(self.btCompare, 1, 5)
+        grid.addWidget(self.treeView, 0, 0, 1, -1)
         self.setLayout(grid)
         widget.setLayout(grid)
         dock.setWidget(widget)
@@ -237,14 +308,92 @@ class MainWindow(QtGui.QMainWindow):
         dock.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea \
             | QtCore.Qt.RightDockWidgetArea)
 
-        #self.dockTools = pyqtgraph.console.ConsoleWidget(dock)
-        widget = QtGui.QListWidget(dock)
+        # tools are applied by dragging them onto objects or by a
+        # double click on the selected object
+        widget = qdeep.common.tools.ToolsWidget(dock)
         widget.setDragEnabled(True)
         widget.setAlternatingRowColors(True)
+        widget.itemDoubleClicked.connect(self.runToolFromDockTools)
         dock.setWidget(widget)
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, dock)
         self.mbarView.addAction(dock.toggleViewAction())
         self.dockTools = dock
+        self.toolsWidget = widget
+
+    def createDockJobs(self):
+
+        dock = QtGui.QDockWidget("Jobs", self)
+        dock.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea \
+            | QtCore.Qt.RightDockWidgetArea \
+            | QtCore.Qt.BottomDockWidgetArea)
+        widget = QtGui.QWidget(dock)
+        self.jobsWidget = QtGui.QTreeWidget(widget)
+        self.jobsWidget.setRootIsDecorated(False)
+        self.jobsWidget.setUniformRowHeights(True)
+        self.jobsWidget.setHeaderLabels(('Script', 'Status', 'Started',
+            'Duration', 'Memory'))
+        self.btJobAdd = QtGui.QPushButton("Add")
+        self.btJobAdd.clicked.connect(self.addJob)
+        self.btJobRequeue = QtGui.QPushButton("Requeue")
+        self.btJobRequeue.clicked.connect(self.requeueJob)
+        self.btJobCancel = QtGui.QPushButton("Cancel")
+        self.btJobCancel.clicked.connect(self.cancelJob)
+        self.btJobClear = QtGui.QPushButton("Clear")
+        self.btJobClear.clicked.connect(self.clearJobs)
+        grid = QtGui.QGridLayout()
+        grid.setSpacing(0)
+        grid.setContentsMargins(0, 0, 0, 0)
+        grid.addWidget(self.btJobAdd, 1, 0)
+        grid.addWidget(self.btJobRequeue, 1, 1)
+        grid.addWidget(self.btJobCancel, 1, 2)
+        grid.addWidget(self.btJobClear, 1, 3)
+        grid.addWidget(self.jobsWidget, 0, 0, 1, -1)
+        widget.setLayout(grid)
+        dock.setWidget(widget)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, dock)
+        self.tabifyDockWidget(self.dockTools, dock)
+        self.mbarView.addAction(dock.toggleViewAction())
+        self.dockJobs = dock
+
+        # refresh durations of running jobs
+        self.jobsTimer = QtCore.QTimer(self)
+        self.jobsTimer.setInterval(1000)
+        self.jobsTimer.timeout.connect(self.updateDockJobs)
+
+        runner = qdeep.common.runner.getRunner()
+        runner.changed.connect(self.updateDockJobs)
+
+    def createDockConsole(self):
+
+        dock = QtGui.QDockWidget("Console", self)
+        dock.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea \
+            | QtCore.Qt.RightDockWidgetArea \
+            | QtCore.Qt.BottomDockWidgetArea)
+        dock.visibilityChanged.connect(self.showDockConsole)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock)
+        self.mbarView.addAction(dock.toggleViewAction())
+        self.dockConsole = dock
+
+    def showDockConsole(self, visible):
+        if not visible or self.dockConsole.widget(): return
+
+        # the console imports nemoa and pyqtgraph, when it is first shown
+        import qdeep.common.console
+        self.dockConsole.setWidget(qdeep.common.console.Console(
+            watch = self.watchEditors, parent = self.dockConsole))
+
+    def createDockPerformance(self):
+
+        dock = QtGui.QDockWidget("Performance", self)
+        dock.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea \
+            | QtCore.Qt.RightDockWidgetArea \
+            | QtCore.Qt.BottomDockWidgetArea)
+        widget = qdeep.common.trace.Overlay(
+            qdeep.common.trace.getTracer(), dock)
+        dock.setWidget(widget)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock)
+        self.mbarView.addAction(dock.toggleViewAction())
+        self.dockPerformance = dock
 
     def createMenus(self):
 
@@ -276,6 +425,10 @@ class MainWindow(QtGui.QMainWindow):
 
     def createStatusBar(self):
         self.statusBar().showMessage("Ready")
+        self.projectProgress = QtGui.QProgressBar()
+        self.projectProgress.setMaximumWidth(160)
+        self.projectProgress.hide()
+        self.statusBar().addPermanentWidget(self.projectProgress)
 
     def createToolBars(self):
 
@@ -293,21 +446,31 @@ class MainWindow(QtGui.QMainWindow):
         #self.editToolBar.addAction(self.pasteAct)
 
     def documentWasModified(self):
-        modified = True
+
+        # editors keep their window modified flags up to date
+        windows = self.getEditorWindows()
+        modified = any(window.widget().isWindowModified()
+            for window in windows)
         self.setWindowModified(modified)
 
+    def getModifiedMdiChilds(self):
+        windows = self.getEditorWindows()
+        return [window.widget() for window in windows
+            if window.widget().getModified()]
+
     def maybeSave(self):
-        modified = True
+        modified = self.getModifiedMdiChilds()
 
         if modified:
             ret = QtGui.QMessageBox.warning(self, "QDeep",
-                "The document has been modified."
-                "\nDo you want to save "
-                "your changes?",
+                "The following documents have been modified:\n%s"
+                "\n\nDo you want to save "
+                "your changes?" % '\n'.join(
+                child.getTitle() for child in modified),
                 QtGui.QMessageBox.Save | QtGui.QMessageBox.Discard |
                 QtGui.QMessageBox.Cancel)
             if ret == QtGui.QMessageBox.Save:
-                return self.save()
+                return self.saveProject(wait = True)
             elif ret == QtGui.QMessageBox.Cancel:
                 return False
 
@@ -348,6 +511,10 @@ class MainWindow(QtGui.QMainWindow):
         childName = qsettings.value("name", None)
         self.settings['mdiarea']['active'] = (childType, childName)
         qsettings.endGroup()
+        self.settings['mdiarea']['lazy'] = \
+            qsettings.value("lazy", True) in ['true', 'True', True]
+        self.settings['mdiarea']['prefetch'] = \
+            qsettings.value("prefetch", False) in ['true', 'True', True]
         qsettings.endGroup()
 
         # section 'tbarprj'
@@ -364,6 +531,13 @@ class MainWindow(QtGui.QMainWindow):
             qsettings.value("visible", True) in ['true', 'True', True]
         qsettings.endGroup()
 
+        # section 'dockjobs'
+        self.settings['dockjobs'] = {}
+        qsettings.beginGroup('dockjobs')
+        self.settings['dockjobs']['visible'] = \
+            qsettings.value("visible", False) in ['true', 'True', True]
+        qsettings.endGroup()
+
         # section 'docktools'
         self.settings['docktools'] = {}
         qsettings.beginGroup('docktools')
@@ -371,50 +545,154 @@ class MainWindow(QtGui.QMainWindow):
             qsettings.value("visible", True) in ['true', 'True', True]
         qsettings.endGroup()
 
-        workspace = qsettings.value("workspace", None) or None
-        base = qsettings.value("base", None) or None
+        # section 'dockconsole'
+        self.settings['dockconsole'] = {}
+        qsettings.beginGroup('dockconsole')
+        self.settings['dockconsole']['visible'] = \
+            qsettings.value("visible", False) in ['true', 'True', True]
+        qsettings.endGroup()
 
-        if workspace and base:
-            nemoa.open(workspace, base = base)
+        # the workspace is opened after the window has been shown
+        self.settings['workspace'] = (
+            qsettings.value("workspace", None) or None,
+            qsettings.value("base", None) or None)
 
     def applySettings(self):
-        self.updateChangeWorkspace()
-
         self.resize(self.settings['mainwindow']['size'])
         self.move(self.settings['mainwindow']['pos'])
 
-        if 'child' in self.settings['mdiarea']:
-            childList = self.settings['mdiarea']['child']
-            for childType, childName in childList:
-                self.openObject(childType, childName)
-        if 'active' in self.settings['mdiarea']:
-            actType, actName = self.settings['mdiarea']['active']
-            self.openObject(actType, actName)
-
         self.tbarPrj.setVisible(
             self.settings['tbarprj']['visible'])
         self.dockObjects.setVisible(
             self.settings['dockobjects']['visible'])
         self.dockTools.setVisible(
             self.settings['docktools']['visible'])
+        self.dockJobs.setVisible(
+            self.settings['dockjobs']['visible'])
+        self.dockConsole.setVisible(
+            self.settings['dockconsole']['visible'])
+
+        # restore MDI session after the window has been shown
+        QtCore.QTimer.singleShot(0, self.restoreSession)
+
+    def restoreSession(self):
+        nemoa.set('mode', 'silent')
+        workspace, base = self.settings['workspace']
+        if workspace and base: nemoa.open(workspace, base = base)
+
+        # tools are listed from the cache and searched in background
+        if not self.toolRegistry:
+            self.toolRegistry = qdeep.common.tools.getRegistry()
+            self.toolRegistry.changed.connect(self.updateDockTools)
+            self.toolRegistry.refresh()
+        self.updateChangeWorkspace()
+
+        lazy = self.settings['mdiarea']['lazy']
+
+        # showing a sub window activates it, such that activations do
+        # not load stubs until the saved active window is activated
+        childList = self.settings['mdiarea'].get('child', [])
+        self.restoring = True
+        try:
+            for childType, childName in childList:
+                self.openObject(childType, childName, lazy = lazy)
+        finally:
+            self.restoring = False
+
+        actType, actName = self.settings['mdiarea'].get('active',
+            (None, None))
+        if actType and actName:
+            existing = self.findMdiChild(actType, actName)
+            if existing: self.mdiArea.setActiveSubWindow(existing)
+            else: self.openObject(actType, actName)
+
+        # the active window may not have emitted an activation
+        activeChild = self.getActiveMdiChild()
+        if activeChild: activeChild.load()
+
+        if lazy and self.settings['mdiarea']['prefetch']:
+            self.prefetchList = list(childList)
+            QtCore.QTimer.singleShot(0, self.prefetchNext)
+
+        # queue jobs, which were queued at last exit
+        qdeep.common.runner.getRunner().readHistory()
+
+        self.recoverSession()
+
+    def recoverSession(self):
+        qsettings = QtCore.QSettings()
+        interval = qsettings.value('autosave/interval', None)
+        maxSize = qsettings.value('autosave/maxsize', None)
+
+        # the journal of a previously restored session is replaced
+        if self.recovery:
+            self.recovery.stop()
+            self.recovery.deleteLater()
+        self.recovery = qdeep.common.recovery.Recovery(
+            interval = int(interval) if interval else None,
+            maxBytes = int(maxSize) * 1048576 if maxSize else None,
+            parent = self)
+
+        # snapshots of the last session remain after a crash
+        snapshots = self.recovery.read()
+        if snapshots:
+            ret = QtGui.QMessageBox.question(self, "QDeep",
+                "QDeep has not been closed properly. The following "
+                "documents have unsaved changes:\n%s\n\n"
+                "Do you want to recover them?" % '\n'.join(
+                "%s '%s'" % (data['type'], data['name'])
+                for data in snapshots),
+                QtGui.QMessageBox.Yes | QtGui.QMessageBox.No)
+            if ret == QtGui.QMessageBox.Yes:
+                for data in snapshots:
+                    self.openObject(data['type'], data['name'])
+                    window = self.findMdiChild(data['type'], data['name'])
+                    if not window: continue
+                    window.widget().setRecovery(data['state'])
+                    window.widget().load()
+            self.recovery.clear()
+
+        self.recovery.failed.connect(self.autosaveFailed)
+        self.recovery.start(self.autosave)
+
+    def autosave(self):
+        windows = self.getEditorWindows()
+        self.recovery.write([window.widget() for window in windows])
+
+    def autosaveFailed(self, title, message):
+        self.statusBar().showMessage("Cannot autosave %s: %s" % (
+            title, message), 5000)
+
+    def prefetchNext(self):
+        while self.prefetchList:
+            objType, objName = self.prefetchList.pop(0)
+            window = self.findMdiChild(objType, objName)
+            if not window or not window.widget().isStub: continue
+            window.widget().load()
+            QtCore.QTimer.singleShot(100, self.prefetchNext)
+            return
 
     def writeSettings(self):
         qsettings = QtCore.QSettings()
 
         qsettings.beginGroup('mdiarea')
         qsettings.beginWriteArray('child')
-        windows = self.mdiArea.subWindowList()
+        windows = self.getEditorWindows()
         for i, window in enumerate(windows):
             qsettings.setArrayIndex(i)
             child = window.widget()
             qsettings.setValue("name", child.getName())
             qsettings.setValue("type", child.getType())
         qsettings.endArray()
-        qsettings.beginGroup('active')
-        activeChild = self.mdiArea.activeSubWindow().widget()
-        qsettings.setValue("name", activeChild.getName())
-        qsettings.setValue("type", activeChild.getType())
-        qsettings.endGroup()
+        activeChild = self.getActiveMdiChild()
+        if activeChild:
+            qsettings.beginGroup('active')
+            qsettings.setValue("name", activeChild.getName())
+            qsettings.setValue("type", activeChild.getType())
+            qsettings.endGroup()
+        qsettings.setValue("lazy", self.settings['mdiarea']['lazy'])
+        qsettings.setValue("prefetch",
+            self.settings['mdiarea']['prefetch'])
         qsettings.endGroup()
 
         qsettings.beginGroup('mainwindow')
@@ -434,6 +712,16 @@ class MainWindow(QtGui.QMainWindow):
         qsettings.setValue("visible", self.dockObjects.isVisible())
         qsettings.endGroup()
 
+        qsettings.beginGroup('dockjobs')
+        qsettings.setValue("visible", self.dockJobs.isVisible())
+        qsettings.endGroup()
+
+        qsettings.beginGroup('dockconsole')
+        qsettings.setValue("visible", self.dockConsole.isVisible())
+        qsettings.endGroup()
+
+        qdeep.common.runner.getRunner().writeHistory()
+
         qsettings.setValue("workspace", nemoa.get('workspace'))
         qsettings.setValue("base", nemoa.get('base'))
 
@@ -447,6 +735,7 @@ class MainWindow(QtGui.QMainWindow):
     def updateChangeWorkspace(self):
         # 2Do: close all MDI windows
         self.mdiArea.closeAllSubWindows()
+        self.objIndex.open(nemoa.get('workspace'))
         self.updateDockWindows()
         self.updateWindowTitle()
 
@@ -455,28 +744,181 @@ class MainWindow(QtGui.QMainWindow):
         self.updateDockTools()
 
     def updateDockObjects(self):
-        self.treeWidget.clear()
-        self.treeWidget.setDragEnabled(True)
-        objTypes = [
-            ('model', ('mimetypes', 'application-x-designer.png')),
-            ('dataset', ('mimetypes', 'text-csv.png')),
-            ('network', ('mimetypes', 'text-rdf.png')),
-            ('system', ('mimetypes', 'text-mathml.png')),
-            ('script', ('mimetypes', 'text-x-python.png'))]
-        for objType, objIconPath in objTypes:
-            objList = nemoa.list(objType + 's')
-            if not objList: continue
-            objTypeItem = QtGui.QTreeWidgetItem(self.treeWidget,
-                [objType.title() + 's', None, None])
-            objTypeIcon = qdeep.common.getIcon(*objIconPath)
-            objTypeItem.setIcon(0, objTypeIcon)
-            for objName in objList:
-                objItem = QtGui.QTreeWidgetItem(objTypeItem,
-                    [objName, objName, objType])
-                objItem.setIcon(0, objTypeIcon)
+        self.objectsModel.update()
 
     def updateDockTools(self):
-        pass
+        if not self.toolRegistry: return
+        self.toolsWidget.clear()
+        icon = qdeep.common.getIcon('actions', 'system-run.png')
+        for tool in self.toolRegistry.list():
+            item = QtGui.QListWidgetItem(icon, tool.title)
+            item.setToolTip(tool.description)
+            item.setData(QtCore.Qt.UserRole, tool.name)
+            self.toolsWidget.addItem(item)
+
+    def runToolFromDockTools(self, item):
+        obj = self.objectsModel.getObject(self.treeView.currentIndex())
+        if not obj:
+            child = self.getActiveMdiChild()
+            if child and not child.isUntitled:
+                obj = (child.getType(), child.getName())
+        if not obj:
+            self.statusBar().showMessage(
+                "Select an object to apply the tool", 2000)
+            return False
+        return self.runTool(item.data(QtCore.Qt.UserRole), *obj)
+
+    def runTool(self, name, objType, objName):
+        tool = self.toolRegistry.get(name) if self.toolRegistry else None
+        if not tool: return False
+        if not tool.accepts(objType):
+            QtGui.QMessageBox.warning(self, "QDeep",
+                "Tool '%s' can not be applied to %ss." % (
+                tool.title, objType))
+            return False
+
+        # instances, which are saved or optimized, must not be changed
+        watch = self.watchEditors(objType, objName)
+        if not watch:
+            QtGui.QMessageBox.information(self, "QDeep",
+                "Tool '%s' can not be applied to '%s', while it is "
+                "saved or optimized." % (tool.title, objName))
+            return False
+
+        # tools, which use qt objects, run on the gui thread
+        if tool.guiThread:
+            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            try: result = watch.run(tool.run, objType, objName)
+            except Exception as error:
+                QtGui.QApplication.restoreOverrideCursor()
+                return self.toolFailed(None, watch, tool.title, objName,
+                    str(error))
+            QtGui.QApplication.restoreOverrideCursor()
+            return self.toolFinished(None, watch, tool.title, objName,
+                result)
+
+        # the tool module is imported on the worker thread
+        worker = qdeep.common.worker.Worker(watch.run, tool.run,
+            objType, objName)
+        worker.signals.finished.connect(functools.partial(
+            self.toolFinished, worker, watch, tool.title, objName))
+        worker.signals.failed.connect(functools.partial(
+            self.toolFailed, worker, watch, tool.title, objName))
+        if self.toolWorkers is None: self.toolWorkers = set()
+        self.toolWorkers.add(worker)
+        self.statusBar().showMessage("Running tool '%s' on '%s' ..." % (
+            tool.title, objName))
+        worker.start()
+
+        return True
+
+    def toolFinished(self, worker, watch, title, objName, result):
+        if worker: self.toolWorkers.discard(worker)
+        watch.finish()
+        self.statusBar().showMessage("Tool '%s' finished on '%s'" % (
+            title, objName), 2000)
+        if result is not None: self.showToolResult(title, objName, result)
+        return True
+
+    def toolFailed(self, worker, watch, title, objName, message):
+        if worker: self.toolWorkers.discard(worker)
+        watch.finish()
+        self.statusBar().clearMessage()
+        QtGui.QMessageBox.warning(self, "QDeep",
+            "Tool '%s' failed on '%s':\n%s." % (title, objName, message))
+        return False
+
+    def showToolResult(self, title, objName, result):
+
+        import pprint
+
+        # widgets, which are returned by gui tools, open as subwindows
+        if isinstance(result, QtGui.QWidget):
+            result.setWindowTitle("%s: %s" % (title, objName))
+            self.mdiArea.addSubWindow(result)
+            result.show()
+            return True
+
+        # long results are shown in the details of the message box
+        if isinstance(result, str): text = result
+        else: text = pprint.pformat(result)
+        lines = text.split('\n')
+        box = QtGui.QMessageBox(QtGui.QMessageBox.Information, title,
+            "Result of tool '%s' on '%s':" % (title, objName),
+            QtGui.QMessageBox.Ok, self)
+        if len(lines) > 20 or len(text) > 2000:
+            box.setInformativeText('\n'.join(lines[:5])[:500] + ' ...')
+            box.setDetailedText(text)
+        else: box.setInformativeText(text)
+        box.exec_()
+
+        return True
+
+    def watchEditors(self, objType = None, objName = None):
+
+        # instances of the editors of an object or of all editors are
+        # watched, unless one of them is locked
+        editors = [window.widget() for window in self.getEditorWindows()]
+        if objType: editors = [editor for editor in editors
+            if editor.getType() == objType and editor.getName() == objName]
+        if any(editor.isLocked() for editor in editors): return None
+        return qdeep.objects.common.Watch(editors)
+
+    def runToolOnChild(self, child, name):
+        if child.isUntitled: return False
+        return self.runTool(name, child.getType(), child.getName())
+
+    def updateDockJobs(self):
+        import time
+
+        jobs = qdeep.common.runner.getRunner().jobs
+        current = self.getSelectedJob()
+        self.jobsWidget.clear()
+        for job in reversed(jobs):
+            started = time.strftime('%H:%M:%S',
+                time.localtime(job.startTime)) if job.startTime else ''
+            duration = job.getDuration()
+            duration = '%.1f s' % duration if duration else ''
+            memory = '%.1f MB' % (job.peakMemory / 1048576.) \
+                if job.peakMemory else ''
+            item = QtGui.QTreeWidgetItem(self.jobsWidget, [job.script,
+                job.status, started, duration, memory])
+            item.setData(0, QtCore.Qt.UserRole, job)
+            if job is current: self.jobsWidget.setCurrentItem(item)
+
+        if any(job.status == 'running' for job in jobs):
+            if not self.jobsTimer.isActive(): self.jobsTimer.start()
+        else: self.jobsTimer.stop()
+
+    def getSelectedJob(self):
+        item = self.jobsWidget.currentItem()
+        if not item: return None
+        return item.data(0, QtCore.Qt.UserRole)
+
+    def addJob(self):
+        scripts = nemoa.list('scripts')
+        if not scripts: return False
+        script, ok = QtGui.QInputDialog.getItem(self, "Add Job",
+            "Script:", scripts, 0, False)
+        if not ok: return False
+        runner = qdeep.common.runner.getRunner()
+        runner.submit(qdeep.common.runner.Job(script))
+        return True
+
+    def requeueJob(self):
+        job = self.getSelectedJob()
+        if not job: return False
+        qdeep.common.runner.getRunner().requeue(job)
+        return True
+
+    def cancelJob(self):
+        job = self.getSelectedJob()
+        if not job: return False
+        job.cancel()
+        return True
+
+    def clearJobs(self):
+        qdeep.common.runner.getRunner().clear()
 
     def openWorkspace(self):
         path = nemoa.path('basepath', 'user')
@@ -493,15 +935,15 @@ class MainWindow(QtGui.QMainWindow):
     def openObjectFromObjectsDock(self):
 
         # get name and type of object
-        curItem = self.treeWidget.currentItem()
-        objTitle = curItem.text(0)
-        objName = curItem.text(1)
-        objType = curItem.text(2)
+        obj = self.objectsModel.getObject(self.treeView.currentIndex())
+        if not obj: return
+        objType, objName = obj
         objPath = nemoa.path(objType, objName)
 
-        if objPath: self.openObject(objType, objName, objTitle)
+        if objPath: self.openObject(objType, objName, objName)
 
-    def openObject(self, objType, objName, objTitle = None):
+    def openObject(self, objType, objName, objTitle = None,
+        lazy = False):
 
         # get name and type of object
         objPath = nemoa.path(objType, objName)
@@ -510,21 +952,94 @@ class MainWindow(QtGui.QMainWindow):
             if existing:
                 self.mdiArea.setActiveSubWindow(existing)
                 return
+            # editors load their objects on worker threads, such that
+            # several objects can be opened in parallel. lazy editors
+            # are stubs until their window is activated
             child = self.createMdiChild(type = (objType, 'editor'))
-            if child.openFromWorkspace(objName):
-                self.statusBar().showMessage("File loaded", 2000)
+            if lazy: retVal = child.setStub(objName)
+            else: retVal = child.openFromWorkspace(objName)
+            if retVal:
                 child.show()
             else:
                 child.close()
             return True
         return False
 
-    def saveProject(self):
-        return True
+    def compareModels(self):
+
+        # get names of the selected models
+        names = []
+        for index in self.treeView.selectionModel().selectedIndexes():
+            obj = self.objectsModel.getObject(index)
+            if not obj or obj[0] != 'model' or obj[1] in names: continue
+            names.append(obj[1])
+        if len(names) < 2:
+            self.statusBar().showMessage(
+                "Select at least two models to compare", 2000)
+            return False
+
+        # models, which are loaded in editors, are not opened again,
+        # unless they are changed by an optimization
+        instances = {}
+        for name in names:
+            window = self.findMdiChild('model', name)
+            if not window: continue
+            child = window.widget()
+            if child.isStub or child.isLoading() or child.isBusy():
+                continue
+            if child.objInstance: instances[name] = child.objInstance
+
+        from qdeep.objects.model import Comparison
+
+        widget = Comparison(names, instances)
+        self.mdiArea.addSubWindow(widget)
+        widget.show()
 
-    def saveProjectAs(self):
         return True
 
+    def objectLoaded(self):
+        self.statusBar().showMessage("File loaded", 2000)
+
+    def saveProject(self, wait = False):
+        if self.projectSave: return False
+
+        # only modified editors are written
+        windows = self.getEditorWindows()
+        children = [window.widget() for window in windows]
+        dirty = [child for child in children if not child.isStub
+            and not child.isUntitled and child.getModified()]
+        if not dirty:
+            self.statusBar().showMessage("Project is up to date", 2000)
+            return True
+
+        self.projectSave = {'pending': set(), 'errors': [],
+            'total': len(dirty), 'done': 0}
+        self.projectProgress.setRange(0, len(dirty))
+        self.projectProgress.setValue(0)
+        self.projectProgress.show()
+
+        saver = qdeep.common.saver.getSaver()
+        for child in dirty:
+            path = child.getPath()
+            retVal = child.save()
+            if retVal and saver.isSaving(path):
+                self.projectSave['pending'].add(path)
+                continue
+            if not retVal:
+                self.projectSave['errors'].append(
+                    (child.getTitle(), 'not saved'))
+            self.projectSave['done'] += 1
+        errors = self.projectSave['errors']
+        self.updateProjectSave()
+        if not wait: return True
+
+        # the project is saved, if all files have been written
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        saver.waitForDone()
+        QtGui.QApplication.restoreOverrideCursor()
+
+        return not errors
+
     #
     # MDI
     #
@@ -550,6 +1065,10 @@ class MainWindow(QtGui.QMainWindow):
             return None
 
         child.setAcceptDrops(True)
+        child.toolDropped.connect(
+            functools.partial(self.runToolOnChild, child))
+        child.hasLoaded.connect(self.objectLoaded)
+        child.hasChanged.connect(self.documentWasModified)
         self.mdiArea.addSubWindow(child)
 
         #child.copyAvailable.connect(self.cutAct.setEnabled)
@@ -558,8 +1077,14 @@ class MainWindow(QtGui.QMainWindow):
         return child
 
 
+    def getEditorWindows(self):
+
+        # comparison views and other widgets are no object editors
+        return [window for window in self.mdiArea.subWindowList()
+            if isinstance(window.widget(), qdeep.objects.common.Editor)]
+
     def findMdiChild(self, objType, objName):
-        windows = self.mdiArea.subWindowList()
+        windows = self.getEditorWindows()
         for window in windows:
             child = window.widget()
             if not child.getType() == objType: continue
@@ -567,9 +1092,14 @@ class MainWindow(QtGui.QMainWindow):
             return window
         return None
 
+    def subWindowActivated(self, window):
+        if self.restoring: return
+        if window and window in self.getEditorWindows():
+            window.widget().load()
+
     def getActiveMdiChild(self):
         activeSubWindow = self.mdiArea.activeSubWindow()
-        if activeSubWindow:
+        if activeSubWindow in self.getEditorWindows():
             return activeSubWindow.widget()
         return None
 
@@ -587,14 +1117,57 @@ class MainWindow(QtGui.QMainWindow):
 
     def save(self):
         if self.getActiveMdiChild() \
-            and self.getActiveMdiChild().save():
+            and self.getActiveMdiChild().save() \
+            and not qdeep.common.saver.getSaver().isSaving():
             self.statusBar().showMessage("File saved", 2000)
 
     def saveAs(self):
         if self.getActiveMdiChild() \
-            and self.mdiArea.activeMdiChild().saveAs():
+            and self.getActiveMdiChild().saveAs() \
+            and not qdeep.common.saver.getSaver().isSaving():
             self.statusBar().showMessage("File saved", 2000)
 
+    def saveStarted(self, path):
+        self.statusBar().showMessage("Saving '%s' ..." %
+            QtCore.QFileInfo(path).fileName())
+
+    def saveFinished(self, path):
+        if self.projectSave and path in self.projectSave['pending']:
+            self.projectSave['pending'].discard(path)
+            self.projectSave['done'] += 1
+            return self.updateProjectSave()
+        if qdeep.common.saver.getSaver().isSaving(): return
+        self.statusBar().showMessage("File saved", 2000)
+
+    def saveFailed(self, path, message):
+        if self.projectSave and path in self.projectSave['pending']:
+            self.projectSave['pending'].discard(path)
+            self.projectSave['errors'].append(
+                (QtCore.QFileInfo(path).fileName(), message))
+            self.projectSave['done'] += 1
+            return self.updateProjectSave()
+        self.statusBar().clearMessage()
+        QtGui.QMessageBox.warning(self, "QDeep",
+            "Cannot write file %s:\n%s." % (path, message))
+
+    def updateProjectSave(self):
+        self.projectProgress.setValue(self.projectSave['done'])
+        if self.projectSave['pending']: return
+
+        # report errors of all objects at once
+        errors = self.projectSave['errors']
+        total = self.projectSave['total']
+        self.projectSave = None
+        self.projectProgress.hide()
+        if not errors:
+            self.statusBar().showMessage(
+                "Project saved (%d files)" % total, 2000)
+            return
+        self.statusBar().clearMessage()
+        QtGui.QMessageBox.warning(self, "QDeep",
+            "Cannot save %d of %d files:\n\n%s" % (len(errors), total,
+            '\n'.join("%s: %s" % error for error in errors)))
+
     #def saveFile(self):
         #return True
 
@@ -602,10 +1175,37 @@ class MainWindow(QtGui.QMainWindow):
         ##return self.saveWorkspace()
 
 def main():
-    nemoa.set('mode', 'silent')
+    startup = qdeep.common.startup
+    startup.phase('imports')
     app = QtGui.QApplication(sys.argv)
+    startup.phase('application')
+
+    # show the logo, while the main window is created
+    splash = QtGui.QSplashScreen(qdeep.common.getLogo(
+        'nemoa-logo.png').pixmap(256, 256))
+    splash.show()
+    app.processEvents()
+    startup.phase('splash')
+
+    # hot paths are instrumented before signals are connected to them
+    qsettings = QtCore.QSettings("Froot", "QDeep")
+    if '--trace' in sys.argv or qsettings.value('trace/enabled',
+        False) in ['true', 'True', True]:
+        qdeep.common.trace.enable()
+
     Window = MainWindow()
+    startup.phase('mainwindow')
     Window.show()
+    splash.finish(Window)
+    startup.phase('shown')
+
+    # report timings after the deferred session restore and quit
+    if startup.isEnabled():
+        def report():
+            startup.phase('session')
+            app.exit(0 if startup.report() else 1)
+        QtCore.QTimer.singleShot(0, report)
+
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
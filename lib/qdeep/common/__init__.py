@@ -5,35 +5,195 @@ __email__   = 'patrick.michl@gmail.com'
 __license__ = 'GPLv3'
 
 CACHE = None
+ICONS = None
+ICONS_MAXSIZE = 256
+
+class LazyModule(object):
+    """Module proxy, which imports the module at first attribute access."""
+
+    def __init__(self, name):
+        self.__dict__['name'] = name
+        self.__dict__['module'] = None
+
+    def __getattr__(self, key):
+        if self.__dict__['module'] is None:
+            import importlib
+            self.__dict__['module'] = \
+                importlib.import_module(self.__dict__['name'])
+        return getattr(self.__dict__['module'], key)
 
 def getPath(key, *args):
 
-    import nemoa
     import os
 
     global CACHE
 
     if not CACHE: CACHE = {}
 
-    if key == 'icons':
-        if not CACHE.get('icons', None):
-            CACHE['icons'] = nemoa.path('expand',
-                ('%site_data_dir%', 'images', 'icons'))
-        base = CACHE['icons']
-    elif key == 'logo':
-        if not CACHE.get('logo', None):
-            CACHE['logo'] = nemoa.path('expand',
-                ('%site_data_dir%', 'images', 'logo'))
-        base = CACHE['logo']
+    # the site data directory is resolved without importing nemoa,
+    # such that icons are available before nemoa has been loaded
+    if key in ['icons', 'logo']:
+        if not CACHE.get(key, None):
+            import appdirs
+            CACHE[key] = os.path.join(appdirs.site_data_dir(
+                appname = 'nemoa', appauthor = 'Froot'), 'images', key)
+        base = CACHE[key]
+    elif key == 'data':
+        if not CACHE.get('data', None):
+            import nemoa
+            CACHE['data'] = nemoa.path('expand',
+                ('%user_data_dir%', 'qdeep'))
+        base = CACHE['data']
+    elif key == 'cache':
+        if not CACHE.get('cache', None):
+            import nemoa
+            CACHE['cache'] = nemoa.path('expand',
+                ('%user_cache_dir%', 'qdeep'))
+        base = CACHE['cache']
 
     return os.path.sep.join([base] + list(args))
 
+def getIconPath(*args):
+
+    if registerIconBundle(): return ':/icons/' + '/'.join(args)
+    return getPath('icons', *args)
+
+def registerIconBundle():
+
+    import os
+    from PySide import QtCore
+
+    global CACHE
+
+    if not CACHE: CACHE = {}
+
+    # register precompiled icon bundle, if it has been built
+    # by the postinstall script
+    if CACHE.get('iconbundle', None) is None:
+        path = getPath('icons', 'icons.rcc')
+        CACHE['iconbundle'] = os.path.isfile(path) \
+            and QtCore.QResource.registerResource(path)
+
+    return CACHE['iconbundle']
+
 def getIcon(*args):
 
+    import collections
     from PySide import QtGui
-    return QtGui.QIcon(getPath('icons', *args))
+
+    global ICONS
+
+    if ICONS is None: ICONS = collections.OrderedDict()
+
+    # process wide least recently used icon cache
+    path = getIconPath(*args)
+    icon = ICONS.pop(path, None)
+    if icon is None:
+        icon = QtGui.QIcon(path)
+        if len(ICONS) >= ICONS_MAXSIZE: ICONS.popitem(last = False)
+    ICONS[path] = icon
+
+    return icon
 
 def getLogo(*args):
 
     from PySide import QtGui
     return QtGui.QIcon(getPath('logo', *args))
+
+def getHash(obj, hasher = None):
+    """Get hex digest of the content of an object.
+
+    Containers and the attributes of instances are traversed
+    recursively. Numpy arrays are fed to the hash function by their
+    buffers, such that no serialization of large parameter arrays is
+    required. Other objects are hashed by their pickled state. The hash
+    traverses the whole object and therefore has to be computed on a
+    worker thread for large objects.
+
+    """
+
+    import hashlib
+    import numbers
+    import pickle
+
+    def getSlots(obj):
+        names = []
+        for cls in type(obj).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            if isinstance(slots, (type(u''), type(b''))): slots = [slots]
+            names += [name for name in slots if name not in names
+                and name not in ['__dict__', '__weakref__']]
+        return dict((name, getattr(obj, name)) for name in names
+            if hasattr(obj, name))
+
+    def update(obj, hasher, visited):
+        if obj is None or isinstance(obj, numbers.Number) \
+            or isinstance(obj, (type(u''), type(b''))):
+            hasher.update(repr(obj).encode('utf-8'))
+            return
+        if id(obj) in visited:
+            hasher.update(b'@')
+            return
+        visited.add(id(obj))
+        hasher.update(type(obj).__name__.encode('utf-8'))
+        if hasattr(obj, '__array_interface__') and hasattr(obj, 'dtype'):
+            import numpy
+            hasher.update(repr((obj.dtype.str, obj.shape)).encode('utf-8'))
+            if obj.dtype.hasobject:
+                for item in obj.flat: update(item, hasher, visited)
+            else: hasher.update(numpy.ascontiguousarray(obj).view('uint8'))
+        elif isinstance(obj, dict):
+            for key in sorted(obj.keys(), key = repr):
+                update(key, hasher, visited)
+                update(obj[key], hasher, visited)
+        elif isinstance(obj, (list, tuple)):
+            for item in obj: update(item, hasher, visited)
+        elif isinstance(obj, (set, frozenset)):
+            for item in sorted(obj, key = repr): update(item, hasher, visited)
+        elif callable(obj):
+            hasher.update(repr(getattr(obj, '__name__', None)).encode(
+                'utf-8'))
+        elif hasattr(obj, '__dict__') or hasattr(obj, '__slots__'):
+            update(getattr(obj, '__dict__', {}), hasher, visited)
+            update(getSlots(obj), hasher, visited)
+        else:
+            try: hasher.update(pickle.dumps(obj, 2))
+            except Exception: hasher.update(repr(obj).encode('utf-8'))
+
+    hasher = hasher or hashlib.sha1()
+    update(obj, hasher, set())
+
+    return hasher.hexdigest()
+
+def pruneCache(path, maxBytes, keep = None):
+    """Delete least recently used files of a cache directory.
+
+    Files are removed by ascending modification time until the total size
+    of the directory does not exceed maxBytes. Caches therefore touch
+    files, when they are used. Files in keep and files, which can not be
+    removed, for example because they are mapped, are skipped.
+
+    """
+
+    import os
+
+    keep = set(keep or [])
+    try: names = os.listdir(path)
+    except OSError: return 0
+    entries = []
+    for name in names:
+        filepath = os.path.join(path, name)
+        try: stat = os.stat(filepath)
+        except OSError: continue
+        entries.append((stat.st_mtime, stat.st_size, filepath))
+    total = sum(size for mtime, size, filepath in entries)
+    removed = 0
+    for mtime, size, filepath in sorted(entries):
+        if total <= maxBytes: break
+        if filepath in keep: continue
+        try: os.remove(filepath)
+        except OSError: continue
+        total -= size
+        removed += 1
+
+    return removed
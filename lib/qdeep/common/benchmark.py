@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import os
+import sys
+import time
+import qdeep
+import qdeep.common
+import qdeep.common.runner
+import qdeep.common.saver
+from PySide import QtGui, QtCore
+
+nemoa = qdeep.common.LazyModule('nemoa')
+
+OBJECTS = {
+    'dataset': ('datasets', 'csv'),
+    'model': ('models', 'npz'),
+    'network': ('networks', 'ini'),
+    'script': ('scripts', 'py'),
+    'system': ('systems', 'ini')}
+
+SCRIPT = [
+    '# -*- coding: utf-8 -*-',
+    '',
+    'import nemoa',
+    '',
+    'def optimize{i}(workspace, *args, **kwargs):',
+    '    """Optimize all models of the workspace.',
+    '',
+    '    The function has been generated by the qdeep benchmark.',
+    '',
+    '    """',
+    '',
+    "    for name in nemoa.list('models'): # loop {i}",
+    "        model = nemoa.open('model', name)",
+    '        model.optimize(steps = {i}, rate = 0.01)',
+    '        print("optimized model \'%s\'" % name)',
+    '',
+    '    return True',
+    '']
+
+def getScript(lines):
+    text = []
+    while len(text) < lines:
+        text += [line.replace('{i}', str(len(text))) for line in SCRIPT]
+    return '\n'.join(text[:lines]) + '\n'
+
+def createWorkspace(base, name, count = 0, scripts = None):
+    """Create a synthetic workspace in a base directory.
+
+    The objects are named by their type and a running number and are
+    distributed evenly over all object types. Additional scripts are
+    given by a dictionary of their names and their number of lines.
+    Existing workspaces are never overwritten.
+
+    """
+
+    path = os.path.join(base, name)
+    if os.path.exists(path):
+        raise IOError("workspace '%s' already exists" % path)
+    os.makedirs(path)
+    with open(os.path.join(path, 'workspace.ini'), 'w') as file_handler:
+        file_handler.write('[workspace]\nname = %s\n'
+            'description = synthetic benchmark workspace\n' % name)
+    for folder, ext in OBJECTS.values():
+        os.makedirs(os.path.join(path, folder))
+
+    def write(objType, objName, content):
+        folder, ext = OBJECTS[objType]
+        with open(os.path.join(path, folder,
+            '%s.%s' % (objName, ext)), 'w') as file_handler:
+            file_handler.write(content)
+
+    objTypes = sorted(OBJECTS.keys())
+    for i in range(count):
+        objType = objTypes[i % len(objTypes)]
+        objName = '%s%06d' % (objType, i)
+        if objType == 'dataset':
+            content = 'label,x1,x2,x3\nr1,0.1,0.2,0.3\nr2,0.4,0.5,0.6\n'
+        elif objType in ['network', 'system']:
+            content = '[%s]\nname = %s\n' % (objType, objName)
+        elif objType == 'script': content = getScript(len(SCRIPT))
+        else: content = ''
+        write(objType, objName, content)
+    for objName, lines in (scripts or {}).items():
+        write('script', objName, getScript(lines))
+
+    return path
+
+def wait(condition, timeout = 600.):
+
+    # process events until the condition holds
+    app = QtCore.QCoreApplication.instance()
+    stop = time.time() + timeout
+    while not condition():
+        if time.time() > stop:
+            raise RuntimeError('benchmark timed out')
+        app.processEvents(QtCore.QEventLoop.AllEvents, 50)
+        time.sleep(.001)
+
+    return True
+
+def isLoading(child):
+
+    # scripts are loaded in chunks by the event loop
+    return child.isLoading() or bool(getattr(child, 'loader', None))
+
+def idle():
+
+    # zero timers, which are queued before, are processed first
+    done = []
+    QtCore.QTimer.singleShot(0, lambda: done.append(True))
+    return wait(lambda: done)
+
+class Benchmark(object):
+    """Benchmark of startup and interaction of the main window.
+
+    The benchmark uses temporary settings and data directories and
+    creates its synthetic workspaces in a temporary directory, which is
+    used as the 'cwd' base of nemoa. Qt4 has no offscreen platform, such
+    that headless machines need a virtual display. Each case is repeated
+    and the minimum and mean times are collected as JSON, such that the
+    results of releases can be compared.
+
+    Usage: xvfb-run python -m qdeep.common.benchmark [--output FILE]
+
+    """
+
+    def __init__(self, counts = None, lines = None, repeat = 3,
+        prefix = 'qdeep-benchmark'):
+
+        import tempfile
+
+        self.counts = counts or [10, 100, 1000, 10000, 100000]
+        self.lines = lines or [10000, 100000]
+        self.repeat = repeat
+        self.prefix = prefix
+        self.results = []
+        self.workspaces = []
+        self.window = None
+        self.cwd = os.getcwd()
+
+        # settings, index and caches do not touch the user directories
+        self.tmpdir = tempfile.mkdtemp(prefix = prefix)
+        QtCore.QSettings.setDefaultFormat(QtCore.QSettings.IniFormat)
+        QtCore.QSettings.setPath(QtCore.QSettings.IniFormat,
+            QtCore.QSettings.UserScope,
+            os.path.join(self.tmpdir, 'settings'))
+        qdeep.common.CACHE = {
+            'data': os.path.join(self.tmpdir, 'data'),
+            'cache': os.path.join(self.tmpdir, 'cache')}
+
+        # workspaces are searched in the working directory of nemoa
+        self.base = os.path.join(self.tmpdir, 'workspaces')
+        os.makedirs(self.base)
+        os.chdir(self.base)
+
+    def measure(self, name, function, setup = None, **params):
+        timings = []
+        for i in range(self.repeat):
+            args = setup() if setup else ()
+            start = time.time()
+            function(*(args or ()))
+            timings.append(time.time() - start)
+        return self.record(name, timings, **params)
+
+    def record(self, name, timings, **params):
+        result = {'name': name, 'params': params, 'timings': timings,
+            'min': min(timings), 'mean': sum(timings) / len(timings)}
+        self.results.append(result)
+        sys.stderr.write('%-20s %-32s %10.1f ms\n' % (name,
+            ' '.join('%s=%s' % item for item in sorted(params.items())),
+            1000. * result['min']))
+
+        return result
+
+    def getWorkspace(self, key, count = 0, scripts = None):
+        name = '%s-%s' % (self.prefix, key)
+        if name not in self.workspaces:
+            createWorkspace(self.base, name, count, scripts)
+            self.workspaces.append(name)
+        return name
+
+    def setSession(self, workspace = None, children = None,
+        lazy = True):
+        qsettings = QtCore.QSettings("Froot", "QDeep")
+        qsettings.clear()
+        qsettings.setValue('workspace', workspace or '')
+        qsettings.setValue('base', 'cwd' if workspace else '')
+        qsettings.beginGroup('mdiarea')
+        qsettings.beginWriteArray('child')
+        for i, (childType, childName) in enumerate(children or []):
+            qsettings.setArrayIndex(i)
+            qsettings.setValue('type', childType)
+            qsettings.setValue('name', childName)
+        qsettings.endArray()
+        if children:
+            qsettings.beginGroup('active')
+            qsettings.setValue('type', children[-1][0])
+            qsettings.setValue('name', children[-1][1])
+            qsettings.endGroup()
+        qsettings.setValue('lazy', lazy)
+        qsettings.endGroup()
+        qsettings.sync()
+
+    def closeChildren(self):
+        for window in self.window.mdiArea.subWindowList():
+            window.widget().setModified(False)
+        self.window.mdiArea.closeAllSubWindows()
+        idle()
+
+    def run(self):
+        self.runImport()
+        self.runStartup()
+        self.runDockObjects()
+        self.runSession()
+        self.runScripts()
+        self.runSave()
+        self.runAutosave()
+
+        return self.results
+
+    def runImport(self):
+
+        import subprocess
+
+        # imports are measured in a fresh interpreter
+        code = 'import time; start = time.time(); import qdeep; ' \
+            'print(time.time() - start)'
+        timings = []
+        for i in range(self.repeat):
+            output = subprocess.check_output([sys.executable, '-c', code])
+            timings.append(float(output.strip()))
+
+        return self.record('import', timings)
+
+    def runStartup(self):
+        workspace = self.getWorkspace(self.counts[0], self.counts[0])
+
+        def setup():
+            self.setSession(workspace)
+
+        def start():
+            window = qdeep.MainWindow()
+            window.show()
+            idle()
+            window.hide()
+            window.deleteLater()
+
+        return self.measure('startup', start, setup,
+            objects = self.counts[0])
+
+    def getWindow(self):
+        if not self.window:
+            self.setSession()
+            self.window = qdeep.MainWindow()
+            self.window.show()
+            idle()
+        return self.window
+
+    def runDockObjects(self):
+        window = self.getWindow()
+
+        for count in self.counts:
+            workspace = self.getWorkspace(count, count)
+            nemoa.open(workspace, base = 'cwd')
+
+            # the index of the workspace is rebuilt from the folders
+            def setupCold():
+                connection = window.objIndex.getConnection()
+                with connection:
+                    for table in ['objects', 'folders']:
+                        connection.execute("DELETE FROM %s "
+                            "WHERE workspace = ?" % table,
+                            (window.objIndex.workspace,))
+
+            def setupReset():
+                window.objectsModel.workspace = None
+
+            self.measure('workspace.open', window.updateChangeWorkspace,
+                setupCold, objects = count)
+            self.measure('dock.reset', window.updateDockObjects,
+                setupReset, objects = count)
+            self.measure('dock.update', window.updateDockObjects,
+                objects = count)
+
+    def runSession(self, count = 20):
+        scripts = dict(('session%03d' % i, 1000) for i in range(count))
+        workspace = self.getWorkspace('session', 0, scripts)
+        children = [('script', name) for name in sorted(scripts)]
+        window = self.getWindow()
+
+        for lazy in [True, False]:
+            def setup():
+                self.closeChildren()
+                self.setSession(workspace, children, lazy)
+
+                # restored sessions read the job history again
+                runner = qdeep.common.runner.getRunner()
+                runner.remove([job for job in runner.jobs
+                    if not job.isActive()])
+
+            def restore():
+                window.readSettings()
+                window.applySettings()
+                idle()
+                wait(lambda: not any(isLoading(child.widget())
+                    for child in window.mdiArea.subWindowList()))
+
+            self.measure('session.restore', restore, setup,
+                children = count, lazy = lazy)
+
+        self.closeChildren()
+
+    def getScriptEditor(self, name):
+        window = self.getWindow()
+        window.openObject('script', name)
+        child = window.findMdiChild('script', name).widget()
+        wait(lambda: not isLoading(child))
+        idle()
+
+        return child
+
+    def runScripts(self):
+        scripts = dict(('large%d' % lines, lines) for lines in self.lines)
+        workspace = self.getWorkspace('scripts', 0, scripts)
+        window = self.getWindow()
+        nemoa.open(workspace, base = 'cwd')
+        window.updateChangeWorkspace()
+
+        for lines in self.lines:
+            name = 'large%d' % lines
+
+            def openScript():
+                self.getScriptEditor(name)
+
+            self.measure('script.open', openScript, self.closeChildren,
+                lines = lines)
+
+            editor = self.getScriptEditor(name)
+            self.measure('script.highlight',
+                editor.highlighter.rehighlight, lines = lines)
+
+            def setup():
+                cursor = QtGui.QTextCursor(editor.textArea.document())
+                cursor.insertText('# modified\n')
+
+            self.measure('script.save', editor.save, setup, lines = lines)
+            self.closeChildren()
+
+    def runSave(self, count = 20):
+        scripts = dict(('save%03d' % i, 1000) for i in range(count))
+        workspace = self.getWorkspace('save', 0, scripts)
+        window = self.getWindow()
+        nemoa.open(workspace, base = 'cwd')
+        window.updateChangeWorkspace()
+        editors = [self.getScriptEditor(name) for name in sorted(scripts)]
+
+        def setup():
+            for editor in editors:
+                cursor = QtGui.QTextCursor(editor.textArea.document())
+                cursor.insertText('# modified\n')
+
+        def save():
+            window.saveProject()
+            qdeep.common.saver.getSaver().waitForDone()
+            idle()
+
+        self.measure('project.save', save, setup, editors = count)
+        self.closeChildren()
+
+    def runAutosave(self, count = 20):
+        scripts = dict(('autosave%03d' % i, 1000) for i in range(count))
+        workspace = self.getWorkspace('autosave', 0, scripts)
+        window = self.getWindow()
+        nemoa.open(workspace, base = 'cwd')
+        window.updateChangeWorkspace()
+        editors = [self.getScriptEditor(name) for name in sorted(scripts)]
+
+        def setup():
+            for editor in editors:
+                cursor = QtGui.QTextCursor(editor.textArea.document())
+                cursor.insertText('# modified\n')
+
+        # snapshots of all modified editors are written to the journal
+        def autosave():
+            window.autosave()
+            window.recovery.pool.waitForDone()
+            idle()
+
+        self.measure('recovery.write', autosave, setup, editors = count)
+        self.closeChildren()
+
+    def getInfo(self):
+
+        import platform
+
+        return {
+            'qdeep': qdeep.__version__,
+            'nemoa': getattr(nemoa, '__version__', None),
+            'python': platform.python_version(),
+            'qt': QtCore.qVersion(),
+            'platform': platform.platform(),
+            'display': os.environ.get('DISPLAY', None),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': self.repeat}
+
+    def cleanup(self):
+
+        import shutil
+
+        # only the temporary directory of the benchmark is removed
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir, True)
+
+def main():
+
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark of the qdeep main window.')
+    parser.add_argument('--output', default = None,
+        help = 'JSON file for the results, default is stdout')
+    parser.add_argument('--counts', type = int, nargs = '+',
+        help = 'numbers of objects in the workspaces')
+    parser.add_argument('--lines', type = int, nargs = '+',
+        help = 'numbers of lines of the large scripts')
+    parser.add_argument('--repeat', type = int, default = 3,
+        help = 'number of repetitions of each case')
+    args = parser.parse_args()
+
+    app = QtGui.QApplication(sys.argv[:1])
+    nemoa.set('mode', 'silent')
+    benchmark = Benchmark(counts = args.counts, lines = args.lines,
+        repeat = args.repeat)
+    try:
+        results = {'info': benchmark.getInfo(), 'results': benchmark.run()}
+    finally:
+        benchmark.cleanup()
+
+    text = json.dumps(results, indent = 2, sort_keys = True)
+    if args.output:
+        with open(args.output, 'w') as file_handler:
+            file_handler.write(text + '\n')
+    else: sys.stdout.write(text + '\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import collections
+import sys
+import threading
+import qdeep.common.worker
+import pyqtgraph.console
+from PySide import QtGui, QtCore
+
+class Stream(object):
+    """Thread safe buffer for the output of console commands.
+
+    Written text is collected in a queue of chunks, which is read in
+    parts of limited size, when the console is updated. If more than
+    maxChars are pending, the older half of the text is dropped and
+    counted as skipped characters.
+
+    """
+
+    maxChars = 4194304
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chunks = collections.deque()
+        self.size = 0
+        self.skipped = 0
+
+    def write(self, text):
+        with self.lock:
+            self.chunks.append(text)
+            self.size += len(text)
+            if self.size <= self.maxChars: return
+            while len(self.chunks) > 1 and self.size > self.maxChars // 2:
+                dropped = len(self.chunks.popleft())
+                self.size -= dropped
+                self.skipped += dropped
+
+    def flush(self):
+        pass
+
+    def read(self, maxChars = None):
+        parts, size = [], 0
+        with self.lock:
+            while self.chunks and (maxChars is None or size < maxChars):
+                chunk = self.chunks.popleft()
+                if maxChars is not None and size + len(chunk) > maxChars:
+                    self.chunks.appendleft(chunk[maxChars - size:])
+                    chunk = chunk[:maxChars - size]
+                parts.append(chunk)
+                size += len(chunk)
+            self.size -= size
+            skipped, self.skipped = self.skipped, 0
+        return ''.join(parts), skipped
+
+    def isEmpty(self):
+        return not self.size and not self.skipped
+
+class Redirect(object):
+    """Standard stream, which writes to the target of the current thread.
+
+    Threads, which have no target, write to the original stream, such
+    that only the output of console commands is captured.
+
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def setTarget(self, target):
+        self.local.target = target
+
+    def write(self, text):
+        target = getattr(self.local, 'target', None)
+        return (target or self.stream).write(text)
+
+    def flush(self):
+        target = getattr(self.local, 'target', None)
+        return (target or self.stream).flush()
+
+def getRedirects():
+
+    # the standard streams are wrapped once and never restored
+    if not isinstance(sys.stdout, Redirect):
+        sys.stdout = Redirect(sys.stdout)
+    if not isinstance(sys.stderr, Redirect):
+        sys.stderr = Redirect(sys.stderr)
+    return sys.stdout, sys.stderr
+
+class Invoker(QtCore.QObject):
+    """Call functions of worker threads on the GUI thread.
+
+    Qt widgets may only be used by the GUI thread. The worker thread is
+    blocked, until the function has returned on the GUI thread.
+
+    """
+
+    called = QtCore.Signal(object)
+
+    def __init__(self, parent = None):
+        super(Invoker, self).__init__(parent)
+        self.called.connect(self.invoke,
+            QtCore.Qt.BlockingQueuedConnection)
+
+    def __call__(self, func, *args, **kwds):
+        if QtCore.QThread.currentThread() is self.thread():
+            return func(*args, **kwds)
+        call = {'func': func, 'args': args, 'kwds': kwds}
+        self.called.emit(call)
+        if 'error' in call: raise call['error']
+        return call.get('result')
+
+    def invoke(self, call):
+        try: call['result'] = call['func'](*call['args'], **call['kwds'])
+        except Exception as error: call['error'] = error
+
+class Console(pyqtgraph.console.ConsoleWidget):
+    """Python console, which runs commands on a worker thread.
+
+    Commands run on a worker thread and must not use Qt objects directly.
+    The namespace provides the function gui(func, *args), which calls
+    func on the GUI thread and returns its result. Output of commands is
+    written to a buffer and appended to the widget at most maxFps times
+    per second in parts of at most maxChars characters, such that
+    commands, which print millions of lines, do not block the event loop.
+    Running commands can be interrupted by the stop button, Ctrl+Break or
+    Ctrl+Shift+C, when they next execute python code. The optional
+    function watch returns a watch of the instances of the open editors,
+    which marks the editors of instances, which are changed by a command,
+    as modified.
+
+    """
+
+    maxFps = 20
+    maxChars = 65536
+    maxBlocks = 20000
+
+    def __init__(self, namespace = None, watch = None, parent = None):
+
+        import nemoa
+
+        # the console shares the workspace of nemoa with the gui
+        self.invoker = Invoker()
+        namespace = dict(namespace or {})
+        namespace.setdefault('nemoa', nemoa)
+        namespace.setdefault('gui', self.invoker)
+        super(Console, self).__init__(parent = parent,
+            namespace = namespace,
+            text = "Python console of the nemoa workspace. Commands run "
+            "in background, Ctrl+Shift+C interrupts them.\n")
+
+        self.stream = Stream()
+        self.getWatch = watch
+        self.watch = None
+        self.worker = None
+        self.lock = threading.Lock()
+        self.threadId = None
+        self.interrupted = False
+        self.source = ''
+        if hasattr(self.output, 'setMaximumBlockCount'):
+            self.output.setMaximumBlockCount(self.maxBlocks)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000 // self.maxFps)
+        self.timer.timeout.connect(self.flushOutput)
+
+        # ctrl+break is missing on most laptop keyboards
+        self.shortcuts = [QtGui.QShortcut(QtGui.QKeySequence(key), self,
+            self.interrupt) for key in ["Ctrl+Break", "Ctrl+Shift+C"]]
+        self.stopBtn = QtGui.QPushButton("Stop", self)
+        self.stopBtn.setToolTip("Interrupt the running command")
+        self.stopBtn.setEnabled(False)
+        self.stopBtn.clicked.connect(self.interrupt)
+        self.ui.horizontalLayout.insertWidget(1, self.stopBtn)
+
+    def runCmd(self, cmd):
+
+        import codeop
+
+        if self.worker:
+            self.stream.write("a command is still running\n")
+            return self.flushOutput()
+
+        # complete statements are collected over several lines
+        source = self.source + cmd if self.source else cmd
+        if hasattr(self, 'historyList'): self.historyList.addItem(cmd)
+        self.writeText(('... ' if self.source else '>>> ') + cmd + '\n')
+        try: code = codeop.compile_command(source, '<console>', 'single')
+        except (SyntaxError, OverflowError, ValueError):
+            self.source = ''
+            self.writeException()
+            return
+        if code is None:
+            self.source = source + '\n'
+            return
+        self.source = ''
+
+        self.interrupted = False
+        # instances, which are saved or optimized, must not be changed
+        self.watch = self.getWatch() if self.getWatch else None
+        if self.getWatch and not self.watch:
+            self.stream.write("documents are being saved or optimized, "
+                "please try again later\n")
+            return self.flushOutput()
+        if self.watch: self.worker = qdeep.common.worker.Worker(
+            self.watch.run, self.execute, code)
+        else: self.worker = qdeep.common.worker.Worker(self.execute, code)
+        self.worker.signals.finished.connect(self.commandFinished)
+        self.worker.signals.failed.connect(self.commandFinished)
+        self.stopBtn.setEnabled(True)
+        self.timer.start()
+        self.worker.start()
+
+    def execute(self, code):
+
+        import traceback
+
+        # runs on a worker thread. the output of this thread is buffered
+        # and interrupts are only delivered, while the command runs
+        redirects = getRedirects()
+        for redirect in redirects: redirect.setTarget(self.stream)
+        self.setThread(threading.current_thread().ident)
+        try:
+            try: exec(code, self.localNamespace)
+            finally: self.setThread(None)
+        except SystemExit: pass
+        except BaseException:
+            self.stream.write(traceback.format_exc())
+        finally:
+            self.setThread(None)
+            for redirect in redirects: redirect.setTarget(None)
+
+        return True
+
+    def setThread(self, threadId):
+
+        import ctypes
+
+        # an interrupt, which has not been raised yet, is discarded
+        with self.lock:
+            if self.threadId and self.interrupted:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_long(self.threadId), None)
+            self.threadId = threadId
+
+    def interrupt(self):
+
+        import ctypes
+
+        # KeyboardInterrupt is raised in the thread of the command, when
+        # it next executes python code, such that commands are not slowed
+        # down by a trace function
+        with self.lock:
+            if not self.threadId or self.interrupted: return False
+            self.interrupted = True
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_long(self.threadId),
+                ctypes.py_object(KeyboardInterrupt))
+        return True
+
+    def commandFinished(self, *args):
+        if self.watch: self.watch.finish()
+        self.watch = None
+        self.worker = None
+        self.stopBtn.setEnabled(False)
+        self.flushOutput()
+
+    def flushOutput(self):
+
+        # pending output is written over the following updates
+        text, skipped = self.stream.read(self.maxChars)
+        if not self.worker and self.stream.isEmpty(): self.timer.stop()
+        elif not self.timer.isActive(): self.timer.start()
+        if skipped:
+            text = "[%d characters skipped]\n" % skipped + text
+        if text: self.writeText(text)
+
+    def writeText(self, text):
+        self.output.moveCursor(QtGui.QTextCursor.End)
+        self.output.insertPlainText(text)
+        scrollBar = self.output.verticalScrollBar()
+        scrollBar.setValue(scrollBar.maximum())
+
+    def writeException(self):
+
+        import traceback
+
+        self.writeText(''.join(traceback.format_exception_only(
+            *sys.exc_info()[:2])))
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import functools
+import os
+import qdeep.common
+import qdeep.common.saver
+import qdeep.common.worker
+from PySide import QtCore
+
+class Recovery(QtCore.QObject):
+    """Autosave of modified editors to a crash recovery journal.
+
+    Snapshots of modified editors are pickled, compressed and written to
+    the recovery directory by a background thread. Instances are split
+    into their attributes, which are pickled separately, such that only
+    changed attributes are written again. An editor is only written
+    again if its generation changed since its last written snapshot
+    and the total size of the journal is limited by maxBytes. The journal
+    is cleared on a clean exit, such that remaining snapshots indicate a
+    crash.
+
+    """
+
+    suffix = '.snapshot'
+    failed = QtCore.Signal(str, str)
+
+    def __init__(self, interval = None, maxBytes = None, parent = None):
+        super(Recovery, self).__init__(parent)
+
+        self.path = qdeep.common.getPath('data', 'recovery')
+        self.maxBytes = maxBytes or 256 * 1048576
+        self.generations = {}
+        self.writing = set()
+
+        # a single thread writes the journal
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000 * (interval or 120))
+
+    def start(self, callback):
+        self.timer.timeout.connect(callback)
+        self.timer.start()
+
+    def getFile(self, objType, objName):
+
+        import hashlib
+
+        key = '%s:%s' % (objType, objName)
+        return os.path.join(self.path, '%s-%s%s' % (objType,
+            hashlib.sha1(key.encode('utf-8')).hexdigest(), self.suffix))
+
+    def write(self, editors):
+        for editor in editors:
+            if editor.isStub or editor.isLoading() or editor.isUntitled:
+                continue
+            objType, objName = editor.getType(), editor.getName()
+            path = self.getFile(objType, objName)
+            if path in self.writing: continue
+
+            # saved editors need no snapshot
+            if not editor.getModified():
+                if self.generations.pop(path, None) is not None:
+                    self.remove(path)
+                continue
+
+            generation = editor.getGeneration()
+            if self.generations.get(path, None) == generation: continue
+            snapshot = editor.getSnapshot()
+            if snapshot is None: continue
+
+            # the generation is recorded, when the snapshot is written
+            self.writing.add(path)
+            header = {'type': objType, 'name': objName}
+            worker = qdeep.common.worker.Worker(self.writeSnapshot, path,
+                header, snapshot, editor, editor.generation)
+            worker.signals.finished.connect(functools.partial(
+                self.writeFinished, path, generation))
+            worker.signals.failed.connect(functools.partial(
+                self.writeFailed, path, objType, objName))
+            worker.start(self.pool)
+
+    def writeFinished(self, path, generation, written):
+        self.writing.discard(path)
+
+        # skipped snapshots are written again with the next autosave
+        if written: self.generations[path] = generation
+
+    def writeFailed(self, path, objType, objName, message):
+        self.writing.discard(path)
+        self.failed.emit("%s '%s'" % (objType, objName), message)
+
+    def getParts(self, state):
+
+        # instances, which do not define their own pickle protocol, are
+        # split into their attributes
+        cls = type(state)
+        if not isinstance(getattr(state, '__dict__', None), dict) \
+            or hasattr(cls, '__slots__') \
+            or getattr(cls, '__getstate__', None) is not getattr(
+            object, '__getstate__', None):
+            return None, {'': state}
+        return cls, dict(state.__dict__)
+
+    def writeSnapshot(self, path, header, state, editor, generation):
+
+        import hashlib
+        import pickle
+        import zlib
+
+        # runs on the journal thread. parts are named by their content,
+        # such that unchanged parts are not written again
+        cls, parts = self.getParts(state)
+        blobs = {}
+        header = dict(header, parts = {}, cls = cls)
+        for key, value in parts.items():
+            blob = pickle.dumps(value, 2)
+            name = '%s-%s.part' % (
+                hashlib.sha1(key.encode('utf-8')).hexdigest()[:16],
+                hashlib.sha1(blob).hexdigest()[:16])
+            header['parts'][key] = name
+            if not os.path.exists(os.path.join(path, name)):
+                blobs[name] = zlib.compress(blob)
+        headerBlob = pickle.dumps(header, 2)
+
+        # the live instance may have been changed while it was pickled
+        if editor.isBusy() or editor.generation != generation:
+            return False
+
+        current = set(header['parts'].values())
+        used = sum(os.path.getsize(os.path.join(root, name))
+            for root, dirs, names in os.walk(self.path) for name in names
+            if root != path or name in current)
+        used += sum(len(blob) for blob in blobs.values())
+        if used > self.maxBytes:
+            raise IOError("the recovery journal exceeds %d MB"
+                % (self.maxBytes // 1048576))
+
+        def write(blob, tmppath):
+            with open(tmppath, 'wb') as file_handler:
+                file_handler.write(blob)
+
+        # the header is written last and replaces the previous snapshot
+        if not os.path.isdir(path): os.makedirs(path)
+        for name, blob in blobs.items():
+            qdeep.common.saver.writeAtomic(write, blob,
+                os.path.join(path, name))
+        qdeep.common.saver.writeAtomic(write, headerBlob,
+            os.path.join(path, 'header'))
+        for name in os.listdir(path):
+            if name.endswith('.part') and name not in current:
+                os.remove(os.path.join(path, name))
+
+        return True
+
+    def remove(self, path):
+        qdeep.common.worker.Worker(self.removeSnapshot, path).start(
+            self.pool)
+
+    def removeSnapshot(self, path):
+
+        import shutil
+
+        # runs on the journal thread
+        if os.path.isdir(path): shutil.rmtree(path, ignore_errors = True)
+        elif os.path.exists(path): os.remove(path)
+
+    def readSnapshot(self, path):
+
+        import pickle
+        import zlib
+
+        with open(os.path.join(path, 'header'), 'rb') as file_handler:
+            header = pickle.load(file_handler)
+        parts = {}
+        for key, name in header.pop('parts').items():
+            with open(os.path.join(path, name), 'rb') as file_handler:
+                parts[key] = pickle.loads(zlib.decompress(
+                    file_handler.read()))
+        cls = header.pop('cls')
+        if cls is None: header['state'] = parts['']
+        else:
+            header['state'] = cls.__new__(cls)
+            header['state'].__dict__.update(parts)
+
+        return header
+
+    def read(self):
+        if not os.path.isdir(self.path): return []
+        snapshots = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(self.suffix): continue
+            try: data = self.readSnapshot(os.path.join(self.path, name))
+            except Exception: continue
+            snapshots.append(data)
+
+        return snapshots
+
+    def stop(self):
+        self.timer.stop()
+        self.pool.waitForDone()
+
+    def clear(self):
+        self.stop()
+        self.generations = {}
+        if not os.path.isdir(self.path): return True
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix): continue
+            try: self.removeSnapshot(os.path.join(self.path, name))
+            except OSError: pass
+        return True
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import os
+import sys
+import time
+from PySide import QtCore
+
+RUNNER = None
+
+# python code, which is executed by the worker process
+BOOTSTRAP = """
+import logging
+import sys
+import nemoa
+logging.basicConfig(stream = sys.stderr, level = logging.INFO)
+script, workspace, base, statfile = sys.argv[1:5]
+try:
+    if workspace: nemoa.open(workspace, base = base or None)
+    retval = nemoa.run(script)
+finally:
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin': rss *= 1024
+        with open(statfile, 'w') as file_handler:
+            file_handler.write(str(rss))
+    except (ImportError, IOError, OSError):
+        pass
+sys.exit(0 if retval is not False else 1)
+"""
+
+class Job(QtCore.QObject):
+    """Script run in a separate python process.
+
+    Standard output, standard error and log records of the process are
+    emitted line buffered by the output signal. The process is deleted,
+    when it has finished.
+
+    """
+
+    started = QtCore.Signal()
+    output = QtCore.Signal(str)
+    finished = QtCore.Signal()
+
+    killTimeout = 3000
+
+    def __init__(self, script, workspace = None, base = None,
+        parent = None):
+        super(Job, self).__init__(parent)
+
+        import nemoa
+
+        self.script = script
+        self.workspace = workspace or nemoa.get('workspace')
+        self.base = base or nemoa.get('base')
+        self.status = 'queued'
+        self.process = None
+        self.exitCode = None
+        self.queueTime = time.time()
+        self.startTime = None
+        self.stopTime = None
+        self.peakMemory = None
+        self.statfile = None
+        self.buffer = ''
+
+    def start(self):
+        if self.status != 'queued': return False
+
+        import tempfile
+
+        # the worker process writes its peak memory usage to a file
+        handle, self.statfile = tempfile.mkstemp(prefix = 'qdeep-job-')
+        os.close(handle)
+
+        self.process = QtCore.QProcess(self)
+        self.process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+        self.process.readyReadStandardOutput.connect(self.readOutput)
+        self.process.finished.connect(self.processFinished)
+        self.process.error.connect(self.processError)
+        self.status = 'running'
+        self.startTime = time.time()
+        self.process.start(sys.executable, ['-u', '-c', BOOTSTRAP,
+            self.script, self.workspace or '', self.base or '',
+            self.statfile])
+        self.started.emit()
+
+        return True
+
+    def cancel(self):
+        if self.status == 'queued':
+            self.status = 'cancelled'
+            self.stopTime = time.time()
+            self.finished.emit()
+        elif self.status == 'running':
+            self.status = 'cancelled'
+            self.process.terminate()
+            QtCore.QTimer.singleShot(self.killTimeout, self.kill)
+
+    def kill(self):
+        if not self.process: return
+        if self.process.state() != QtCore.QProcess.NotRunning:
+            self.process.kill()
+
+    def isActive(self):
+        return self.status in ['queued', 'running']
+
+    def getDuration(self):
+        if not self.startTime: return None
+        return (self.stopTime or time.time()) - self.startTime
+
+    def readStatfile(self):
+        if not self.statfile: return None
+        try:
+            with open(self.statfile) as file_handler:
+                self.peakMemory = int(file_handler.read() or 0) or None
+        except (IOError, OSError, ValueError):
+            pass
+        try: os.remove(self.statfile)
+        except OSError: pass
+        self.statfile = None
+
+    def get(self):
+        return {
+            'script': self.script, 'workspace': self.workspace,
+            'base': self.base, 'status': self.status,
+            'exitcode': self.exitCode, 'queuetime': self.queueTime,
+            'starttime': self.startTime, 'stoptime': self.stopTime,
+            'peakmemory': self.peakMemory}
+
+    @classmethod
+    def fromDict(cls, data):
+        job = cls(data['script'], data.get('workspace', None),
+            data.get('base', None))
+        job.status = data.get('status', 'queued')
+        job.exitCode = data.get('exitcode', None)
+        job.queueTime = data.get('queuetime', None)
+        job.startTime = data.get('starttime', None)
+        job.stopTime = data.get('stoptime', None)
+        job.peakMemory = data.get('peakmemory', None)
+        return job
+
+    def readOutput(self):
+        if not self.process: return
+        data = self.process.readAllStandardOutput().data()
+        if not isinstance(data, str): data = data.decode('utf-8', 'replace')
+
+        # incomplete lines are kept until their line break is read
+        lines, sep, self.buffer = (self.buffer + data).rpartition('\n')
+        if sep: self.output.emit(lines + sep)
+
+    def releaseProcess(self):
+        if self.buffer: self.output.emit(self.buffer)
+        self.buffer = ''
+        self.process.deleteLater()
+        self.process = None
+
+    def processFinished(self, exitCode, exitStatus):
+        self.readOutput()
+        self.exitCode = exitCode
+        self.stopTime = time.time()
+        self.readStatfile()
+        if self.status == 'running':
+            if exitStatus == QtCore.QProcess.NormalExit and exitCode == 0:
+                self.status = 'finished'
+            else: self.status = 'failed'
+        self.releaseProcess()
+        self.finished.emit()
+
+    def processError(self, error):
+
+        # a process, which failed to start, emits no finished signal
+        if error != QtCore.QProcess.FailedToStart: return
+        self.output.emit(self.process.errorString())
+        if self.status == 'running': self.status = 'failed'
+        self.stopTime = time.time()
+        self.readStatfile()
+        self.releaseProcess()
+        self.finished.emit()
+
+class Runner(QtCore.QObject):
+    """Queue of script jobs with a limited number of running processes.
+
+    Submitted jobs are kept in the job history, which is stored in the
+    application settings and holds at most maxHistory inactive jobs.
+    Jobs, which were queued when the history was written, are queued
+    again, when it is restored.
+
+    """
+
+    changed = QtCore.Signal()
+    maxHistory = 100
+
+    def __init__(self, maxCount = None, parent = None):
+        super(Runner, self).__init__(parent)
+
+        self.maxCount = maxCount or QtCore.QThread.idealThreadCount()
+        self.queue = []
+        self.running = []
+        self.jobs = []
+
+    def submit(self, job):
+        job.setParent(self)
+        job.started.connect(self.changed)
+        job.finished.connect(self.schedule)
+        self.queue.append(job)
+        self.jobs.append(job)
+        self.prune()
+        self.schedule()
+        return job
+
+    def requeue(self, job):
+        return self.submit(Job(job.script, job.workspace, job.base))
+
+    def clear(self):
+        self.remove([job for job in self.jobs if not job.isActive()])
+        self.changed.emit()
+
+    def prune(self):
+        inactive = [job for job in self.jobs if not job.isActive()]
+        if len(inactive) <= self.maxHistory: return
+        self.remove(inactive[:len(inactive) - self.maxHistory])
+
+    def remove(self, jobs):
+        for job in jobs:
+            self.jobs.remove(job)
+            job.deleteLater()
+
+    def readHistory(self):
+        qsettings = QtCore.QSettings()
+        size = qsettings.beginReadArray('jobs')
+        jobs = []
+        for i in range(size):
+            qsettings.setArrayIndex(i)
+            data = {}
+            for key in qsettings.childKeys():
+                data[key] = qsettings.value(key, None)
+            for key in ['exitcode']:
+                if data.get(key, None) is not None:
+                    data[key] = int(data[key])
+            for key in ['queuetime', 'starttime', 'stoptime',
+                'peakmemory']:
+                if data.get(key, None) is not None:
+                    data[key] = float(data[key])
+            if data.get('script', None): jobs.append(data)
+        qsettings.endArray()
+
+        for data in jobs:
+            if data.get('status', None) == 'queued':
+                self.submit(Job(data['script'], data.get('workspace'),
+                    data.get('base')))
+                continue
+            job = Job.fromDict(data)
+            if job.status == 'running': job.status = 'interrupted'
+            job.setParent(self)
+            self.jobs.append(job)
+        self.prune()
+        self.changed.emit()
+
+    def writeHistory(self):
+        qsettings = QtCore.QSettings()
+
+        # queued and running jobs are kept like in prune
+        inactive = [job for job in self.jobs if not job.isActive()]
+        dropped = set(inactive[:max(0, len(inactive) - self.maxHistory)])
+        jobs = [job for job in self.jobs if job not in dropped]
+
+        qsettings.beginWriteArray('jobs')
+        for i, job in enumerate(jobs):
+            qsettings.setArrayIndex(i)
+            for key, val in job.get().items():
+                if val is None: qsettings.remove(key)
+                else: qsettings.setValue(key, val)
+        qsettings.endArray()
+
+    def setMaxCount(self, maxCount):
+        self.maxCount = max(1, int(maxCount))
+        self.schedule()
+
+    def schedule(self):
+        self.running = [job for job in self.running
+            if job.status == 'running']
+        while self.queue and len(self.running) < self.maxCount:
+            job = self.queue.pop(0)
+            if not job.start(): continue
+            self.running.append(job)
+        self.changed.emit()
+
+def getRunner():
+
+    global RUNNER
+
+    if not RUNNER:
+        qsettings = QtCore.QSettings()
+        maxCount = qsettings.value('scripts/maxprocesses', None)
+        RUNNER = Runner(int(maxCount) if maxCount else None)
+
+    return RUNNER
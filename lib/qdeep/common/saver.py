@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import functools
+import os
+import qdeep.common.worker
+from PySide import QtCore
+
+SAVER = None
+
+def writeAtomic(write, snapshot, path):
+    """Write snapshot to a temporary file and move it to path.
+
+    The temporary file is flushed to disk before it atomically replaces
+    the target, such that an interrupted save never leaves a torn file.
+
+    """
+
+    dirname, basename = os.path.split(os.path.abspath(path))
+    stem, ext = os.path.splitext(basename)
+    tmppath = os.path.join(dirname, '.%s.part%s' % (stem, ext))
+
+    try:
+        if write(snapshot, tmppath) is False or \
+            not os.path.isfile(tmppath):
+            raise IOError("could not write '%s'" % tmppath)
+        with open(tmppath, 'ab') as file_handler:
+            os.fsync(file_handler.fileno())
+
+        # python 2 has no os.replace
+        if hasattr(os, 'replace'): os.replace(tmppath, path)
+        else:
+            if os.name == 'nt' and os.path.exists(path): os.remove(path)
+            os.rename(tmppath, path)
+
+        # persist the rename in the directory entry
+        if hasattr(os, 'O_DIRECTORY'):
+            handle = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+            try: os.fsync(handle)
+            finally: os.close(handle)
+    finally:
+        if os.path.exists(tmppath): os.remove(tmppath)
+
+    return path
+
+class Saver(QtCore.QObject):
+    """Background save pipeline with coalescing of concurrent saves.
+
+    While a path is written, further saves of the same path replace each
+    other and only the latest snapshot is written, when the running
+    save has finished.
+
+    """
+
+    started = QtCore.Signal(str)
+    finished = QtCore.Signal(str)
+    failed = QtCore.Signal(str, str)
+
+    def __init__(self, maxCount = None, parent = None):
+        super(Saver, self).__init__(parent)
+
+        self.pool = QtCore.QThreadPool(self)
+        if maxCount: self.pool.setMaxThreadCount(maxCount)
+        self.active = {}
+        self.pending = {}
+
+    def save(self, path, snapshot, write):
+        if path in self.active:
+            self.pending[path] = (snapshot, write)
+            return True
+
+        worker = qdeep.common.worker.Worker(
+            writeAtomic, write, snapshot, path)
+        worker.signals.finished.connect(self.saveFinished)
+        worker.signals.failed.connect(
+            functools.partial(self.saveFailed, path))
+        self.active[path] = worker
+        worker.start(self.pool)
+        self.started.emit(path)
+
+        return True
+
+    def isSaving(self, path = None):
+        if path is None: return bool(self.active or self.pending)
+        return path in self.active or path in self.pending
+
+    def waitForDone(self):
+
+        # deliver queued signals, such that pending saves are started
+        while self.active or self.pending:
+            self.pool.waitForDone()
+            QtCore.QCoreApplication.processEvents()
+
+    def saveFinished(self, path):
+        self.active.pop(path, None)
+        self.finished.emit(path)
+        self.saveNext(path)
+
+    def saveFailed(self, path, message):
+        self.active.pop(path, None)
+        self.failed.emit(path, message)
+        self.saveNext(path)
+
+    def saveNext(self, path):
+        if path not in self.pending: return
+        snapshot, write = self.pending.pop(path)
+        self.save(path, snapshot, write)
+
+def getSaver():
+
+    global SAVER
+
+    if not SAVER:
+        qsettings = QtCore.QSettings()
+        maxCount = qsettings.value('project/maxwrites', None)
+        SAVER = Saver(int(maxCount) if maxCount else 4)
+
+    return SAVER
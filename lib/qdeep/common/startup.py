@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import sys
+import time
+
+# time in seconds until the main window has to be shown
+BUDGET = 1.0
+
+PROFILER = None
+
+class Profiler(object):
+    """Timing of imports and startup phases.
+
+    The builtin import function is wrapped, such that the time of each
+    import is measured. Nested imports are counted by the importing
+    module and also reported by their own, such that the self time of
+    each module is given by its cumulative time minus the cumulative
+    time of its nested imports.
+
+    """
+
+    def __init__(self):
+        self.origin = time.time()
+        self.imports = []
+        self.phases = []
+        self.depth = 0
+        self.builtins = None
+        self.loader = None
+
+    def enable(self):
+        try: import builtins
+        except ImportError: import __builtin__ as builtins
+
+        self.builtins = builtins
+        self.loader = builtins.__import__
+        builtins.__import__ = self.load
+
+    def disable(self):
+        if self.loader: self.builtins.__import__ = self.loader
+        self.loader = None
+
+    def load(self, name, *args, **kwargs):
+
+        # only imports, which load new modules, are recorded
+        count = len(sys.modules)
+        self.depth += 1
+        start = time.time()
+        try: return self.loader(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            self.depth -= 1
+            if len(sys.modules) > count:
+                level = kwargs.get('level', args[3] if len(args) > 3 else 0)
+                self.imports.append(('.' * (level or 0) + name,
+                    self.depth, elapsed))
+
+    def phase(self, name):
+        self.phases.append((name, time.time() - self.origin))
+
+    def report(self, stream = None, limit = 30):
+        stream = stream or sys.stderr
+        lines = ['', 'startup phases:']
+        last = 0.
+        for name, elapsed in self.phases:
+            lines.append('  %-24s %8.1f ms %8.1f ms' % (name,
+                1000. * (elapsed - last), 1000. * elapsed))
+            last = elapsed
+
+        # report the slowest top level imports and their children
+        lines += ['', 'imports (cumulative):']
+        ranked = sorted(self.imports, key = lambda entry: -entry[2])
+        for name, depth, elapsed in ranked[:limit]:
+            lines.append('  %-40s %8.1f ms  depth %d' % (name,
+                1000. * elapsed, depth))
+
+        shown = dict(self.phases).get('shown', None)
+        if shown is not None:
+            status = 'ok' if shown <= BUDGET else 'exceeded'
+            lines += ['', 'main window shown after %.1f ms '
+                '(budget %.1f ms): %s' % (1000. * shown,
+                1000. * BUDGET, status)]
+        stream.write('\n'.join(lines) + '\n')
+
+        return shown is None or shown <= BUDGET
+
+def enable():
+
+    global PROFILER
+
+    if not PROFILER:
+        PROFILER = Profiler()
+        PROFILER.enable()
+
+    return PROFILER
+
+def isEnabled():
+    return PROFILER is not None
+
+def phase(name):
+    if PROFILER: PROFILER.phase(name)
+
+def report():
+    if not PROFILER: return True
+    PROFILER.disable()
+    return PROFILER.report()
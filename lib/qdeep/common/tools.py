@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import collections
+import qdeep.common
+import qdeep.common.worker
+from PySide import QtGui, QtCore
+
+MIMETYPE = 'application/x-qdeep-tool'
+
+REGISTRY = None
+
+class Tool(object):
+    """Analysis tool, which is imported when it is first used.
+
+    A tool is registered by an entry point of the group 'qdeep.tools',
+    which refers to a callable. The callable is called with the type
+    and the name of an object of the current workspace and its return
+    value is shown to the user. Title, description and the accepted
+    object types are taken from the module docstring and the module
+    attributes TITLE and OBJTYPES.
+
+    Tools are called on a worker thread and must not use Qt objects.
+    Modules, which set GUITHREAD = True, are imported and called on the
+    GUI thread instead and may return a widget, which is shown in a
+    subwindow. Other results are shown as text.
+
+    """
+
+    def __init__(self, name, module, attrs, title = None,
+        description = None, objTypes = None, key = None,
+        guiThread = False):
+        self.name = name
+        self.module = module
+        self.attrs = list(attrs)
+        self.title = title or name
+        self.description = description or ''
+        self.objTypes = list(objTypes) if objTypes else None
+        self.key = key
+        self.guiThread = bool(guiThread)
+        self.function = None
+
+    def accepts(self, objType):
+        return not self.objTypes or objType in self.objTypes
+
+    def load(self):
+        if self.function: return self.function
+
+        import importlib
+
+        function = importlib.import_module(self.module)
+        for attr in self.attrs: function = getattr(function, attr)
+        self.function = function
+
+        return function
+
+    def run(self, objType, objName):
+        return self.load()(objType, objName)
+
+    def getDict(self):
+        return {'name': self.name, 'module': self.module,
+            'attrs': self.attrs, 'title': self.title,
+            'description': self.description, 'objTypes': self.objTypes,
+            'key': self.key, 'guiThread': self.guiThread}
+
+    @classmethod
+    def fromDict(cls, data):
+        return cls(data['name'], data['module'], data['attrs'],
+            data.get('title', None), data.get('description', None),
+            data.get('objTypes', None), data.get('key', None),
+            data.get('guiThread', False))
+
+class Registry(QtCore.QObject):
+    """Registry of the tools, which are installed as entry points.
+
+    The metadata of the tools is cached in the cache directory, such
+    that the tools can be listed at startup without importing
+    pkg_resources or any tool. The entry points are searched on a worker
+    thread and the metadata of new or updated distributions is read
+    from the sources of the tool modules without importing them.
+
+    """
+
+    changed = QtCore.Signal()
+    group = 'qdeep.tools'
+
+    def __init__(self, parent = None):
+        super(Registry, self).__init__(parent)
+
+        self.tools = collections.OrderedDict()
+        self.worker = None
+        self.readCache()
+
+    def getCachePath(self):
+        return qdeep.common.getPath('cache', 'tools.json')
+
+    def readCache(self):
+
+        import json
+
+        try:
+            with open(self.getCachePath(), 'r') as file_handler:
+                data = json.load(file_handler)
+        except (IOError, OSError, ValueError):
+            return False
+        self.setTools([Tool.fromDict(item) for item in data])
+
+        return True
+
+    def writeCache(self):
+
+        import json
+        import os
+
+        path = self.getCachePath()
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as file_handler:
+            json.dump([tool.getDict() for tool in self.tools.values()],
+                file_handler)
+
+        return True
+
+    def setTools(self, tools):
+        self.tools = collections.OrderedDict((tool.name, tool)
+            for tool in sorted(tools, key = lambda tool: tool.title))
+
+    def refresh(self):
+        if self.worker: return False
+        cached = dict((tool.key, tool.getDict())
+            for tool in self.tools.values())
+        self.worker = qdeep.common.worker.Worker(self.discover, cached)
+        self.worker.signals.finished.connect(self.refreshFinished)
+        self.worker.signals.failed.connect(self.refreshFailed)
+        self.worker.start()
+
+        return True
+
+    def discover(self, cached):
+
+        import pkg_resources
+
+        # runs on a worker thread
+        tools = []
+        for entry in pkg_resources.iter_entry_points(self.group):
+            dist = entry.dist
+            key = '%s==%s:%s' % (getattr(dist, 'project_name', None),
+                getattr(dist, 'version', None), entry)
+            if key in cached and 'guiThread' in cached[key]:
+                tools.append(cached[key])
+                continue
+            meta = self.inspect(entry.module_name,
+                getattr(dist, 'location', None))
+            tools.append(Tool(entry.name, entry.module_name, entry.attrs,
+                meta.get('TITLE', None), meta.get('__doc__', None),
+                meta.get('OBJTYPES', None), key,
+                meta.get('GUITHREAD', False)).getDict())
+
+        return tools
+
+    def inspect(self, module, location):
+
+        import ast
+        import os
+
+        # find the source of the module without importing it
+        if not location: return {}
+        base = os.path.join(location, *module.split('.'))
+        for path in [base + '.py', os.path.join(base, '__init__.py')]:
+            if os.path.isfile(path): break
+        else: return {}
+        try:
+            with open(path, 'rb') as file_handler:
+                tree = ast.parse(file_handler.read(), path)
+        except (IOError, OSError, SyntaxError, ValueError):
+            return {}
+
+        meta = {}
+        doc = ast.get_docstring(tree)
+        if doc: meta['__doc__'] = doc.strip().split('\n')[0]
+        for node in tree.body:
+            if not isinstance(node, ast.Assign): continue
+            for target in node.targets:
+                if not isinstance(target, ast.Name): continue
+                if target.id not in ['TITLE', 'OBJTYPES', 'GUITHREAD']:
+                    continue
+                try: meta[target.id] = ast.literal_eval(node.value)
+                except ValueError: pass
+
+        return meta
+
+    def refreshFinished(self, tools):
+        self.worker = None
+        self.setTools([Tool.fromDict(data) for data in tools])
+        try: self.writeCache()
+        except (IOError, OSError): pass
+        self.changed.emit()
+
+    def refreshFailed(self, message):
+        self.worker = None
+
+    def get(self, name):
+        return self.tools.get(name, None)
+
+    def list(self):
+        return list(self.tools.values())
+
+class ToolsWidget(QtGui.QListWidget):
+    """List of tools, which can be dragged onto objects."""
+
+    def mimeTypes(self):
+        return [MIMETYPE]
+
+    def mimeData(self, items):
+        data = QtCore.QMimeData()
+        names = [item.data(QtCore.Qt.UserRole) for item in items]
+        data.setData(MIMETYPE, QtCore.QByteArray(
+            '\n'.join(names).encode('utf-8')))
+        return data
+
+def getToolNames(data):
+    if not data.hasFormat(MIMETYPE): return []
+    names = bytes(data.data(MIMETYPE)).decode('utf-8')
+    return [name for name in names.split('\n') if name]
+
+def getRegistry():
+
+    global REGISTRY
+
+    if not REGISTRY: REGISTRY = Registry()
+
+    return REGISTRY
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+import collections
+import functools
+import threading
+import timeit
+from PySide import QtGui, QtCore
+
+TRACER = None
+
+def getPercentile(values, percent):
+    if not values: return None
+    values = sorted(values)
+    return values[int(round(percent / 100. * (len(values) - 1)))]
+
+class Tracer(QtCore.QObject):
+    """Timing of hot paths and sampling of the event loop latency.
+
+    Methods are instrumented by replacing them in their classes, such
+    that disabled tracing has no overhead. The latency of the event loop
+    is sampled by a timer, which measures the delay of its own timeouts.
+    Recent events are kept in bounded queues and can be exported in the
+    trace event format of chrome://tracing.
+
+    """
+
+    maxEvents = 50000
+    maxSamples = 1000
+    interval = 50
+    threshold = .05
+
+    def __init__(self, parent = None):
+        super(Tracer, self).__init__(parent)
+
+        self.origin = timeit.default_timer()
+        self.events = collections.deque(maxlen = self.maxEvents)
+        self.durations = {}
+        self.slow = collections.deque(maxlen = 100)
+        self.lags = collections.deque(maxlen = self.maxSamples)
+        self.patched = []
+        self.lastSample = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.interval)
+        self.timer.timeout.connect(self.sample)
+
+    def instrument(self, cls, name, category):
+        function = cls.__dict__.get(name, None)
+        if function is None: return False
+        label = '%s.%s.%s' % (cls.__module__.split('.')[-1],
+            cls.__name__, name)
+
+        add = self.add
+        clock = timeit.default_timer
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try: return function(*args, **kwargs)
+            finally: add(label, category, start, clock() - start)
+
+        setattr(cls, name, wrapper)
+        self.patched.append((cls, name, function))
+
+        return True
+
+    def add(self, name, category, start, duration):
+
+        # deques are thread safe, such that workers may add events
+        self.events.append((name, category, start - self.origin,
+            duration, threading.current_thread().ident))
+        durations = self.durations.get(name, None)
+        if durations is None:
+            durations = self.durations.setdefault(name,
+                collections.deque(maxlen = self.maxSamples))
+        durations.append(duration)
+        if duration >= self.threshold:
+            self.slow.append((start - self.origin, name, duration))
+
+    def start(self):
+        self.lastSample = timeit.default_timer()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        for cls, name, function in reversed(self.patched):
+            setattr(cls, name, function)
+        self.patched = []
+
+    def sample(self):
+        now = timeit.default_timer()
+        lag = now - self.lastSample - self.interval / 1000.
+        self.lags.append((now - self.origin, max(lag, 0.)))
+        self.lastSample = now
+
+    def getStats(self):
+        stats = []
+        for name, durations in sorted(self.durations.items()):
+            durations = list(durations)
+            stats.append((name, len(durations),
+                getPercentile(durations, 50),
+                getPercentile(durations, 95),
+                getPercentile(durations, 99), max(durations)))
+        return stats
+
+    def getLag(self):
+        lags = [lag for start, lag in self.lags]
+        return (getPercentile(lags, 50), getPercentile(lags, 95),
+            max(lags) if lags else None)
+
+    def getTrace(self):
+
+        import os
+
+        pid = os.getpid()
+        events = [{'name': name, 'cat': category, 'ph': 'X',
+            'ts': 1e6 * start, 'dur': 1e6 * duration, 'pid': pid,
+            'tid': tid} for name, category, start, duration, tid
+            in list(self.events)]
+        events += [{'name': 'event loop lag', 'ph': 'C',
+            'ts': 1e6 * start, 'pid': pid, 'args': {'ms': 1e3 * lag}}
+            for start, lag in list(self.lags)]
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def writeTrace(self, path):
+
+        import json
+
+        with open(path, 'w') as file_handler:
+            json.dump(self.getTrace(), file_handler)
+
+        return True
+
+class Overlay(QtGui.QWidget):
+    """Performance overlay with percentiles and recent slow operations."""
+
+    interval = 1000
+
+    def __init__(self, tracer, parent = None):
+        super(Overlay, self).__init__(parent)
+
+        self.tracer = tracer
+
+        self.lagLabel = QtGui.QLabel()
+        self.statsWidget = QtGui.QTreeWidget()
+        self.statsWidget.setRootIsDecorated(False)
+        self.statsWidget.setUniformRowHeights(True)
+        self.statsWidget.setHeaderLabels(('Operation', 'Count',
+            'p50', 'p95', 'p99', 'Max'))
+        self.slowWidget = QtGui.QTreeWidget()
+        self.slowWidget.setRootIsDecorated(False)
+        self.slowWidget.setUniformRowHeights(True)
+        self.slowWidget.setHeaderLabels(('Slow operation', 'Time',
+            'Duration'))
+        self.btExport = QtGui.QPushButton("Export trace")
+        self.btExport.clicked.connect(self.exportTrace)
+
+        layout = QtGui.QVBoxLayout()
+        layout.setSpacing(0)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.lagLabel)
+        layout.addWidget(self.statsWidget)
+        layout.addWidget(self.slowWidget)
+        layout.addWidget(self.btExport)
+        self.setLayout(layout)
+
+        # refresh only while the overlay is visible
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.interval)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super(Overlay, self).showEvent(event)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(Overlay, self).hideEvent(event)
+
+    def refresh(self):
+
+        def ms(value):
+            if value is None: return '-'
+            return '%.1f ms' % (1000. * value)
+
+        p50, p95, lagMax = self.tracer.getLag()
+        self.lagLabel.setText("Event loop lag: %s (p50), %s (p95), "
+            "%s (max)" % (ms(p50), ms(p95), ms(lagMax)))
+
+        self.statsWidget.clear()
+        for name, count, p50, p95, p99, maximum in self.tracer.getStats():
+            self.statsWidget.addTopLevelItem(QtGui.QTreeWidgetItem(
+                [name, str(count), ms(p50), ms(p95), ms(p99), ms(maximum)]))
+
+        self.slowWidget.clear()
+        for start, name, duration in reversed(list(self.tracer.slow)):
+            self.slowWidget.addTopLevelItem(QtGui.QTreeWidgetItem(
+                [name, '%.1f s' % start, ms(duration)]))
+
+    def exportTrace(self):
+        path, filtr = QtGui.QFileDialog.getSaveFileName(self,
+            "Export trace", 'qdeep-trace.json', "Trace (*.json)")
+        if not path: return False
+        try: return self.tracer.writeTrace(path)
+        except (IOError, OSError) as error:
+            QtGui.QMessageBox.warning(self, "QDeep",
+                "Cannot write trace %s:\n%s." % (path, error))
+            return False
+
+def enable():
+    """Instrument the hot paths of the GUI and start the tracer.
+
+    The tracer has to be enabled before the main window is created,
+    because signals are connected to the methods at creation.
+
+    """
+
+    global TRACER
+
+    if TRACER: return TRACER
+
+    import importlib
+    import qdeep
+    import qdeep.objects.common
+    import qdeep.objects.script
+
+    TRACER = Tracer()
+    TRACER.instrument(qdeep.MainWindow, 'openObject', 'gui')
+    TRACER.instrument(qdeep.MainWindow, 'updateDockObjects', 'gui')
+    editor = qdeep.objects.common.Editor
+    TRACER.instrument(editor, 'openFromWorkspace', 'io')
+    TRACER.instrument(editor, 'loadInstance', 'nemoa')
+    TRACER.instrument(editor, 'saveFile', 'io')
+
+    # editors, which override the loading, do their work after the base
+    # method has returned and build their widgets from the instance
+    for objType in ['dataset', 'model', 'network', 'system']:
+        module = importlib.import_module('qdeep.objects.%s' % objType)
+        TRACER.instrument(module.Editor, 'loadInstance', 'nemoa')
+        TRACER.instrument(module.Editor, 'createCentralWidget', 'gui')
+    script = qdeep.objects.script
+    TRACER.instrument(script.Editor, 'saveFile', 'io')
+    TRACER.instrument(script.Editor, 'runScript', 'script')
+    TRACER.instrument(script.Highlighter, 'highlightBlock', 'highlight')
+    TRACER.start()
+
+    return TRACER
+
+def getTracer():
+    return TRACER
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+__author__  = 'Patrick Michl'
+__email__   = 'patrick.michl@gmail.com'
+__license__ = 'GPLv3'
+
+from PySide import QtCore
+
+# started workers, which are referenced until their run has returned
+RUNNING = set()
+
+class Signals(QtCore.QObject):
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    done = QtCore.Signal(object)
+
+    def __init__(self):
+        super(Signals, self).__init__()
+
+        self.done.connect(self.release, QtCore.Qt.QueuedConnection)
+
+    def release(self, worker):
+        RUNNING.discard(worker)
+
+class Worker(QtCore.QRunnable):
+    """Run a callable on a thread pool and report the result by signals.
+
+    The signals object lives in the thread that created the worker, such
+    that connected slots of GUI objects are invoked by queued connections
+    in the GUI thread. A cancelled worker can not interrupt the callable
+    but discards its result. Started workers are kept by the module until
+    their run has returned, such that callers may drop their references
+    at any time.
+
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        super(Worker, self).__init__()
+
+        # the module keeps the reference, do not let the pool delete it
+        self.setAutoDelete(False)
+
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = Signals()
+        self.cancelled = False
+
+    def run(self):
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            if not self.cancelled: self.signals.failed.emit(str(e))
+            return
+        else:
+            if not self.cancelled: self.signals.finished.emit(result)
+        finally:
+            self.signals.done.emit(self)
+
+    def start(self, pool = None):
+        pool = pool or QtCore.QThreadPool.globalInstance()
+        RUNNING.add(self)
+        pool.start(self)
+        return self
+
+    def cancel(self):
+        self.cancelled = True
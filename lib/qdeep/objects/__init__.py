@@ -3,3 +3,416 @@
 __author__  = 'Patrick Michl'
 __email__   = 'patrick.michl@gmail.com'
 __license__ = 'GPLv3'
+
+import qdeep.common
+import qdeep.common.tools
+from PySide import QtGui, QtCore
+
+nemoa = qdeep.common.LazyModule('nemoa')
+
+OBJTYPES = ['model', 'dataset', 'network', 'system', 'script']
+
+class Index(QtCore.QObject):
+    """Persistent index of the objects of workspaces.
+
+    The index is stored as an SQLite database in the user data directory
+    and holds name, type, path, mtime and size of all objects. When a
+    workspace is opened, the entries of the folders of all object types
+    are stated and compared with the index, such that files, which were
+    changed in place, are detected. A file system watcher rescans the
+    folders of the open workspace, when files are added or removed.
+    Rescans only write the objects, which differ from the index.
+
+    """
+
+    changed = QtCore.Signal()
+    delay = 250
+
+    def __init__(self, parent = None):
+        super(Index, self).__init__(parent)
+
+        self.connection = None
+        self.workspace = None
+        self.folders = {}
+        self.pending = set()
+        self.filetypes = {}
+
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.folderChanged)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.rescanPending)
+
+    def getConnection(self):
+
+        import os
+        import sqlite3
+
+        if self.connection: return self.connection
+
+        path = qdeep.common.getPath('data', 'index.db')
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                workspace TEXT, type TEXT, name TEXT, path TEXT,
+                mtime REAL, size INTEGER,
+                PRIMARY KEY (workspace, type, name));
+            CREATE TABLE IF NOT EXISTS folders (
+                workspace TEXT, type TEXT, path TEXT, mtime REAL,
+                PRIMARY KEY (workspace, type));""")
+
+        return self.connection
+
+    def open(self, workspace):
+
+        import os
+
+        # stop watching folders of previous workspace
+        if self.folders:
+            self.watcher.removePaths(list(self.folders.keys()))
+        self.folders = {}
+        self.pending = set()
+        self.workspace = None
+        if not workspace: return True
+
+        self.workspace = '%s/%s' % (nemoa.get('base'), workspace)
+
+        # entries of all folders are compared with the last indexing
+        for objType in OBJTYPES:
+            path = nemoa.path(objType + 's')
+            if path and os.path.isdir(path): self.folders[path] = objType
+            self.rescan(objType)
+
+        if self.folders:
+            self.watcher.addPaths(list(self.folders.keys()))
+
+        return True
+
+    def list(self, objType):
+        if not self.workspace: return None
+        cursor = self.getConnection().execute("SELECT name FROM objects "
+            "WHERE workspace = ? AND type = ? ORDER BY name",
+            (self.workspace, objType))
+        return [row[0] for row in cursor]
+
+    def get(self, objType, objName):
+        if not self.workspace: return None
+        row = self.getConnection().execute("SELECT path, mtime, size "
+            "FROM objects WHERE workspace = ? AND type = ? AND name = ?",
+            (self.workspace, objType, objName)).fetchone()
+        if not row: return None
+        return {'path': row[0], 'mtime': row[1], 'size': row[2]}
+
+    def getFiletypes(self, objType):
+
+        import importlib
+
+        # nemoa registers files of the file types of its importers
+        if objType not in self.filetypes:
+            if objType == 'script': filetypes = ['py']
+            else: filetypes = list(importlib.import_module(
+                'nemoa.%s.imports' % objType).filetypes())
+            self.filetypes[objType] = set(filetypes)
+
+        return self.filetypes[objType]
+
+    def rescan(self, objType):
+
+        import os
+        import stat
+
+        # the entries of the folder are stated and compared with the
+        # index, such that only new, changed and removed objects are
+        # written
+        folder = nemoa.path(objType + 's')
+        try: names = os.listdir(folder) if folder else []
+        except OSError: names = []
+        filetypes = self.getFiletypes(objType)
+        entries = {}
+        for filename in sorted(names):
+            objName, ext = os.path.splitext(filename)
+            if objName in entries or ext[1:] not in filetypes: continue
+            objPath = os.path.join(folder, filename)
+            try: info = os.stat(objPath)
+            except OSError: continue
+            if not stat.S_ISREG(info.st_mode): continue
+            entries[objName] = (objPath, info.st_mtime, info.st_size)
+
+        connection = self.getConnection()
+        indexed = dict((row[0], tuple(row[1:])) for row in
+            connection.execute("SELECT name, path, mtime, size "
+            "FROM objects WHERE workspace = ? AND type = ?",
+            (self.workspace, objType)))
+        removed = [(self.workspace, objType, objName)
+            for objName in indexed if objName not in entries]
+        changed = [(self.workspace, objType, objName) + entry
+            for objName, entry in entries.items()
+            if indexed.get(objName, None) != entry]
+
+        try: mtime = os.stat(folder).st_mtime
+        except (OSError, TypeError): mtime = None
+        with connection:
+            connection.executemany("DELETE FROM objects "
+                "WHERE workspace = ? AND type = ? AND name = ?", removed)
+            connection.executemany("INSERT OR REPLACE INTO objects "
+                "VALUES (?, ?, ?, ?, ?, ?)", changed)
+            connection.execute("INSERT OR REPLACE INTO folders "
+                "VALUES (?, ?, ?, ?)",
+                (self.workspace, objType, folder, mtime))
+
+        return bool(removed or changed)
+
+    def folderChanged(self, path):
+
+        # collect changes of folders and rescan them after a short delay
+        objType = self.folders.get(path, None)
+        if not objType: return
+        self.pending.add(objType)
+        self.timer.start(self.delay)
+
+    def rescanPending(self):
+        if not self.workspace or not self.pending: return
+        changed = [objType for objType in self.pending
+            if self.rescan(objType)]
+        self.pending = set()
+        if changed: self.changed.emit()
+
+class Group(object):
+
+    def __init__(self, objType, icon, names):
+        self.objType = objType
+        self.icon = icon
+        self.names = list(names)
+        self.fetched = 0
+
+class ObjectsModel(QtCore.QAbstractItemModel):
+    """Item model of workspace objects grouped by their type.
+
+    The object items of a group are exposed in batches by fetchMore and
+    update() applies the differences to the current workspace instead of
+    rebuilding the tree.
+
+    """
+
+    toolDropped = QtCore.Signal(str, str, str)
+
+    objTypes = [
+        ('model', ('mimetypes', 'application-x-designer.png')),
+        ('dataset', ('mimetypes', 'text-csv.png')),
+        ('network', ('mimetypes', 'text-rdf.png')),
+        ('system', ('mimetypes', 'text-mathml.png')),
+        ('script', ('mimetypes', 'text-x-python.png'))]
+    batchSize = 256
+
+    def __init__(self, objIndex = None, parent = None):
+        super(ObjectsModel, self).__init__(parent)
+
+        self.objIndex = objIndex
+        self.root = Group(None, None, [])
+        self.groups = []
+        self.workspace = None
+
+    def getGroup(self, index):
+        if not index.isValid(): return None
+        if index.internalPointer() is self.root:
+            return self.groups[index.row()]
+        return None
+
+    def getObject(self, index):
+        if not index.isValid(): return None
+        group = index.internalPointer()
+        if group is self.root: return None
+        return (group.objType, group.names[index.row()])
+
+    def index(self, row, column, parent = QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, self.root)
+        group = self.getGroup(parent)
+        if not group: return QtCore.QModelIndex()
+        return self.createIndex(row, column, group)
+
+    def parent(self, index):
+        if not index.isValid(): return QtCore.QModelIndex()
+        group = index.internalPointer()
+        if group is self.root: return QtCore.QModelIndex()
+        return self.createIndex(self.groups.index(group), 0, self.root)
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if not parent.isValid(): return len(self.groups)
+        group = self.getGroup(parent)
+        if not group: return 0
+        return group.fetched
+
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent = QtCore.QModelIndex()):
+        if not parent.isValid(): return bool(self.groups)
+        group = self.getGroup(parent)
+        if not group: return False
+        return bool(group.names)
+
+    def canFetchMore(self, parent):
+        group = self.getGroup(parent)
+        if not group: return False
+        return group.fetched < len(group.names)
+
+    def fetchMore(self, parent):
+        group = self.getGroup(parent)
+        if not group: return
+        count = min(self.batchSize, len(group.names) - group.fetched)
+        if count <= 0: return
+        self.beginInsertRows(parent, group.fetched,
+            group.fetched + count - 1)
+        group.fetched += count
+        self.endInsertRows()
+
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if not index.isValid(): return None
+        group = self.getGroup(index)
+        if group:
+            if role == QtCore.Qt.DisplayRole:
+                return group.objType.title() + 's'
+            if role == QtCore.Qt.DecorationRole:
+                return group.icon
+            return None
+        group = index.internalPointer()
+        if role == QtCore.Qt.DisplayRole:
+            return group.names[index.row()]
+        if role == QtCore.Qt.DecorationRole:
+            return group.icon
+        if role == QtCore.Qt.UserRole:
+            return (group.objType, group.names[index.row()])
+        return None
+
+    def flags(self, index):
+        if not index.isValid(): return QtCore.Qt.NoItemFlags
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if self.getGroup(index): return flags
+        return flags | QtCore.Qt.ItemIsDragEnabled \
+            | QtCore.Qt.ItemIsDropEnabled
+
+    def mimeTypes(self):
+
+        # objects are dragged in the default format and accept tools
+        return ['application/x-qabstractitemmodeldatalist',
+            qdeep.common.tools.MIMETYPE]
+
+    def supportedDropActions(self):
+        return QtCore.Qt.CopyAction
+
+    def dropMimeData(self, data, action, row, column, parent):
+        names = qdeep.common.tools.getToolNames(data)
+        obj = self.getObject(parent)
+        if not names or not obj: return False
+        for name in names: self.toolDropped.emit(name, obj[0], obj[1])
+        return True
+
+    def headerData(self, section, orientation,
+        role = QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal \
+            and role == QtCore.Qt.DisplayRole:
+            return 'Objects'
+        return None
+
+    def update(self):
+
+        # a new workspace replaces all groups
+        workspace = nemoa.get('workspace')
+        if workspace != self.workspace:
+            self.beginResetModel()
+            self.workspace = workspace
+            self.groups = []
+            for objType, objIconPath in self.objTypes:
+                names = self.list(objType) if workspace else None
+                if not names: continue
+                self.groups.append(Group(objType,
+                    qdeep.common.getIcon(*objIconPath), names))
+            self.endResetModel()
+            return True
+
+        # the same workspace is updated by differences
+        for objType, objIconPath in self.objTypes:
+            names = self.list(objType) or []
+            self.updateGroup(objType, objIconPath, names)
+
+        return True
+
+    def list(self, objType):
+        if self.objIndex:
+            names = self.objIndex.list(objType)
+            if names is not None: return names
+        return nemoa.list(objType + 's')
+
+    def updateGroup(self, objType, objIconPath, names):
+
+        order = [key for key, val in self.objTypes]
+        rows = [row for row, group in enumerate(self.groups)
+            if group.objType == objType]
+
+        # insert or remove whole group
+        if not rows:
+            if not names: return
+            row = len([group for group in self.groups
+                if order.index(group.objType) < order.index(objType)])
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+            self.groups.insert(row, Group(objType,
+                qdeep.common.getIcon(*objIconPath), names))
+            self.endInsertRows()
+            return
+        if not names:
+            self.beginRemoveRows(QtCore.QModelIndex(), rows[0], rows[0])
+            del self.groups[rows[0]]
+            self.endRemoveRows()
+            return
+
+        group = self.groups[rows[0]]
+        parent = self.createIndex(rows[0], 0, self.root)
+
+        # remove objects, which do not exist anymore
+        current = set(names)
+        for row in reversed(range(len(group.names))):
+            if group.names[row] in current: continue
+            if row >= group.fetched:
+                del group.names[row]
+                continue
+            self.beginRemoveRows(parent, row, row)
+            del group.names[row]
+            group.fetched -= 1
+            self.endRemoveRows()
+
+        # append new objects
+        known = set(group.names)
+        added = [name for name in names if name not in known]
+        if not added: return
+        if group.fetched < len(group.names):
+            group.names.extend(added)
+            return
+        first = len(group.names)
+        self.beginInsertRows(parent, first, first + len(added) - 1)
+        group.names.extend(added)
+        group.fetched += len(added)
+        self.endInsertRows()
+
+class ObjectsView(QtGui.QTreeView):
+    """Tree view of the objects, which only accepts tools as drops.
+
+    Objects are dragged in the default format of the model, which the
+    view would otherwise accept as drops onto other objects.
+
+    """
+
+    def dragEnterEvent(self, event):
+        if event.mimeData().hasFormat(qdeep.common.tools.MIMETYPE):
+            super(ObjectsView, self).dragEnterEvent(event)
+        else: event.ignore()
+
+    def dragMoveEvent(self, event):
+        if event.mimeData().hasFormat(qdeep.common.tools.MIMETYPE):
+            super(ObjectsView, self).dragMoveEvent(event)
+        else: event.ignore()
@@ -4,15 +4,119 @@ __author__  = 'Patrick Michl'
 __email__   = 'patrick.michl@gmail.com'
 __license__ = 'GPLv3'
 
-import nemoa
 import qdeep
+import qdeep.common.saver
+import qdeep.common.tools
+import qdeep.common.worker
 from PySide import QtGui, QtCore
 
+nemoa = qdeep.common.LazyModule('nemoa')
+
+class Placeholder(QtGui.QWidget):
+
+    def __init__(self, editor, text):
+        super(Placeholder, self).__init__(editor)
+
+        self.label = QtGui.QLabel(text)
+        self.label.setAlignment(QtCore.Qt.AlignCenter)
+        self.progress = QtGui.QProgressBar()
+        self.progress.setRange(0, 0)
+        self.btCancel = QtGui.QPushButton("Cancel")
+        self.btCancel.clicked.connect(editor.cancelLoading)
+
+        grid = QtGui.QGridLayout()
+        grid.setRowStretch(0, 1)
+        grid.setRowStretch(4, 1)
+        grid.setColumnStretch(0, 1)
+        grid.setColumnStretch(2, 1)
+        grid.addWidget(self.label, 1, 1)
+        grid.addWidget(self.progress, 2, 1)
+        grid.addWidget(self.btCancel, 3, 1, QtCore.Qt.AlignCenter)
+        self.setLayout(grid)
+
+class Watch(object):
+    """Detection of changes of instances by background tasks.
+
+    Console commands and tools may change the instances of editors. The
+    instances are hashed on the worker thread of the task before and
+    after it runs and editors of changed instances are marked modified,
+    when the task has finished. Editors keep the hash of their current
+    generation, such that an instance is usually hashed once per task.
+    The editors are busy, while the task runs.
+
+    """
+
+    def __init__(self, editors):
+        self.editors = [editor for editor in editors
+            if editor.isWatched()]
+        self.hashes = [None] * len(self.editors)
+        self.changed = [False] * len(self.editors)
+        for editor in self.editors: editor.tasks += 1
+
+    def getHash(self, editor):
+        return qdeep.common.getHash(editor.objInstance)
+
+    def run(self, func, *args):
+
+        # runs on the worker thread of the task
+        for i, editor in enumerate(self.editors):
+            generation, digest = editor.instanceHash or (None, None)
+            if generation != editor.generation:
+                digest = self.getHash(editor)
+            self.hashes[i] = digest
+        try: return func(*args)
+        finally:
+            for i, editor in enumerate(self.editors):
+                digest = self.getHash(editor)
+                self.changed[i] = digest != self.hashes[i]
+                self.hashes[i] = digest
+
+    def finish(self):
+        for i, editor in enumerate(self.editors):
+            editor.tasks -= 1
+            if self.changed[i]:
+                editor.setModified(True)
+                editor.documentWasModified()
+            if self.hashes[i] is not None:
+                editor.instanceHash = (editor.generation, self.hashes[i])
+            editor.applyRecovery()
+        self.editors = []
+
+        return True
+
 class Editor(QtGui.QMainWindow):
     sequenceNumber = 1
     settings = None
     isUntitled = True
     hasChanged = QtCore.Signal()
+    hasLoaded = QtCore.Signal()
+    toolDropped = QtCore.Signal(str)
+
+    # open workspace objects with nemoa on a worker thread and create
+    # the central widget when the instance arrives
+    loadInBackground = True
+    worker = None
+
+    # restored sessions create stubs, which are loaded on activation
+    isStub = False
+
+    # mutations of the instance increase its generation, such that it
+    # is modified, while its generation differs from the saved one
+    generation = 0
+    savedGeneration = 0
+
+    # background tasks, which use the instance, and the hash of the
+    # instance with its generation, which is computed by the tasks
+    watchInstance = True
+    tasks = 0
+    instanceHash = None
+
+    # path and generation of the instance, while it is written
+    savePath = None
+    saveGeneration = None
+
+    # recovered content, which is applied when the object is loaded
+    recoveryState = None
 
     objInstance = None
     objName = None
@@ -31,11 +135,17 @@ class Editor(QtGui.QMainWindow):
 
         self.createActions()
         self.createToolBars()
-        self.createCentralWidget()
+        if not self.loadInBackground: self.createCentralWidget()
+
+        saver = qdeep.common.saver.getSaver()
+        saver.finished.connect(self.saveFinished)
+        saver.failed.connect(self.saveFailed)
 
     def createActions(self): pass
     def createToolBars(self): pass
-    def createCentralWidget(self): pass
+
+    def createCentralWidget(self):
+        self.setCentralWidget(QtGui.QWidget())
 
     def newFile(self):
         self.isUntitled = True
@@ -47,31 +157,123 @@ class Editor(QtGui.QMainWindow):
 
         objPath = nemoa.path(self.objType, objName)
         if not objPath: return False
-        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-        if self.objType == 'script':
-            instance = None
+
+        self.objName = objName
+        self.objPath = objPath
+
+        if not self.loadInBackground:
+            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
             retVal = self.loadFile(objPath)
-        else:
-            instance = nemoa.open(self.objType, objName)
-            retVal = bool(instance)
-        QtGui.QApplication.restoreOverrideCursor()
+            QtGui.QApplication.restoreOverrideCursor()
+            if not retVal:
+                self.warnOpenFailed('could not read file')
+                return False
+            self.setLoaded(None)
+            return True
 
-        if not retVal:
-            QtGui.QMessageBox.warning(self, "MDI",
-                "Cannot open %s '%s':\n%s." % (
-                self.getType(), objName, '2Do: nemoa error message'))
-            return False
+        self.setCentralWidget(Placeholder(self,
+            "Loading %s '%s' ..." % (self.getType(), objName)))
+        self.worker = qdeep.common.worker.Worker(
+            self.loadInstance, objName)
+        self.worker.signals.finished.connect(self.loadFinished)
+        self.worker.signals.failed.connect(self.loadFailed)
+        self.worker.start()
+
+        return True
+
+    def setStub(self, objName):
+
+        objPath = nemoa.path(self.objType, objName)
+        if not objPath: return False
 
         self.objName = objName
         self.objPath = objPath
-        self.objInstance = instance
+        self.isStub = True
+
+        if self.loadInBackground:
+            label = QtGui.QLabel("%s '%s' is loaded when activated." % (
+                self.getType().title(), objName))
+            label.setAlignment(QtCore.Qt.AlignCenter)
+            self.setCentralWidget(label)
 
         self.isUntitled = False
-        self.setModified(False)
         self.updateWindowTitle()
 
         return True
 
+    def load(self):
+        if not self.isStub: return True
+        self.isStub = False
+        if self.openFromWorkspace(self.objName): return True
+        self.closeWindow()
+        return False
+
+    def loadInstance(self, objName):
+
+        # runs on a worker thread
+        return nemoa.open(self.objType, objName)
+
+    def loadFinished(self, instance):
+        if not self.worker: return
+        self.worker = None
+        if not instance:
+            self.warnOpenFailed('nemoa returned no instance')
+            return self.closeWindow()
+        self.setLoaded(instance)
+
+    def loadFailed(self, message):
+        if not self.worker: return
+        self.worker = None
+        self.warnOpenFailed(message)
+        self.closeWindow()
+
+    def cancelLoading(self):
+        if not self.worker: return
+        self.worker.cancel()
+        self.worker = None
+        self.closeWindow()
+
+    def setLoaded(self, instance):
+        self.objInstance = instance
+        if self.loadInBackground: self.createCentralWidget()
+
+        self.isUntitled = False
+        if not self.loadInBackground: self.setModified(False)
+        self.updateWindowTitle()
+        self.hasLoaded.emit()
+        self.applyRecovery()
+
+    def isLoading(self):
+        return self.worker is not None
+
+    def isBusy(self):
+
+        # the instance is used by a background task
+        return self.tasks > 0
+
+    def isLocked(self):
+
+        # the instance must not be changed, while it is used by a
+        # background task or written by the saver
+        return self.isBusy() or self.isSaving()
+
+    def isWatched(self):
+
+        # instances are watched for changes by background tasks
+        return self.watchInstance and self.objInstance is not None \
+            and not self.isStub and not self.isLoading() \
+            and not self.isBusy()
+
+    def warnOpenFailed(self, message):
+        QtGui.QMessageBox.warning(self, "MDI",
+            "Cannot open %s '%s':\n%s." % (
+            self.getType(), self.objName, message))
+
+    def closeWindow(self):
+        window = self.parentWidget()
+        if isinstance(window, QtGui.QMdiSubWindow): window.close()
+        else: self.close()
+
     def getType(self):
         return self.objType
 
@@ -99,26 +301,128 @@ class Editor(QtGui.QMainWindow):
         #2do: change name of object
         return self.saveFile(fileName)
 
-    def saveFile(self, *args, **kwargs):
-        if self.objInstance.save(*args, **kwargs):
-            self.isUntitled = False
-            self.updateWindowTitle()
-            return True
-        return False
+    def saveFile(self, path = None):
+        if not self.objInstance: return False
+        if self.isBusy():
+            QtGui.QMessageBox.warning(self, "MDI",
+                "Cannot save %s '%s' while it is changed in background."
+                % (self.getType(), self.getName()))
+            return False
+
+        # the instance is written in background and is not changed by
+        # background tasks, until the write has finished. the editor
+        # stays modified, until the write has succeeded
+        path = path or self.getPath()
+        self.savePath = path
+        self.saveGeneration = self.generation
+        qdeep.common.saver.getSaver().save(path, self.objInstance,
+            self.writeSnapshot)
+
+        self.isUntitled = False
+        self.documentWasModified()
+
+        return True
+
+    def writeSnapshot(self, instance, path):
+
+        # runs on a worker thread
+        return instance.save(path)
+
+    def isSaving(self):
+        return self.savePath is not None
+
+    def saveFinished(self, path):
+        if path != self.savePath: return
+
+        # coalesced saves of the same path are written afterwards
+        if qdeep.common.saver.getSaver().isSaving(path): return
+        self.savedGeneration = self.saveGeneration
+        self.savePath = None
+        self.updateWindowTitle()
+        self.documentWasModified()
+        self.applyRecovery()
+
+    def saveFailed(self, path, message):
+        if path != self.savePath: return
+        if qdeep.common.saver.getSaver().isSaving(path): return
+        self.savePath = None
+        self.documentWasModified()
+        self.applyRecovery()
 
     def closeEvent(self, event):
-        if self.maybeSave(): event.accept()
-        else: event.ignore()
+
+        # instances, which are used by background tasks, are kept
+        if self.tasks:
+            QtGui.QMessageBox.information(self, "MDI",
+                "'%s' is used by a console command or a tool." %
+                self.getTitle())
+            return event.ignore()
+        if not self.maybeSave(): return event.ignore()
+
+        # the editor is kept open, if its instance could not be written
+        if self.isSaving():
+            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            qdeep.common.saver.getSaver().waitForDone()
+            QtGui.QApplication.restoreOverrideCursor()
+            if self.getModified(): return event.ignore()
+        if self.worker: self.worker.cancel()
+        event.accept()
+
+    def dragEnterEvent(self, event):
+        if event.mimeData().hasFormat(qdeep.common.tools.MIMETYPE):
+            event.acceptProposedAction()
+        else: super(Editor, self).dragEnterEvent(event)
+
+    def dropEvent(self, event):
+        names = qdeep.common.tools.getToolNames(event.mimeData())
+        if not names: return super(Editor, self).dropEvent(event)
+        for name in names: self.toolDropped.emit(name)
+        event.acceptProposedAction()
 
     def documentWasModified(self):
         self.setWindowModified(self.getModified())
         self.hasChanged.emit()
 
     def getModified(self):
-        return False
+        if not self.objInstance or self.isLoading(): return False
+        if self.isBusy(): return True
+        return self.generation != self.savedGeneration
 
-    def setModified(self, value):
-        pass
+    def setModified(self, value = True):
+
+        # the current generation is the clean state of the object
+        if value: self.generation += 1
+        else: self.savedGeneration = self.generation
+
+    def getGeneration(self):
+        return self.generation
+
+    def getSnapshot(self):
+
+        # the instance is pickled by the journal thread, which discards
+        # the snapshot if the instance was changed meanwhile
+        if not self.objInstance or self.isBusy(): return None
+        return self.objInstance
+
+    def setRecovery(self, state):
+        self.recoveryState = state
+        if self.objInstance and not self.isLoading():
+            self.applyRecovery()
+        return True
+
+    def applyRecovery(self):
+
+        # recovered content is applied, when the instance is unlocked
+        if self.recoveryState is None or self.isLocked(): return False
+        state, self.recoveryState = self.recoveryState, None
+        return self.applySnapshot(state)
+
+    def applySnapshot(self, state):
+        self.objInstance = state
+        self.createCentralWidget()
+        self.setModified(True)
+        self.documentWasModified()
+        return True
 
     def maybeSave(self):
         if self.getModified():
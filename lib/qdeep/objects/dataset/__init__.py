@@ -4,8 +4,618 @@ __author__  = 'Patrick Michl'
 __email__   = 'patrick.michl@gmail.com'
 __license__ = 'GPLv3'
 
+import collections
+import qdeep.common
+import qdeep.common.worker
 import qdeep.objects.common
+from PySide import QtGui, QtCore
+
+class Store(object):
+    """Memory mapped, two dimensional float copy of the data of a dataset.
+
+    The store is built from the dataset file in chunks of rows, without
+    opening the dataset with nemoa, such that the data is never held in
+    memory as a whole. The labels of the rows and columns, which are not
+    numeric, are skipped. The store is written once to the cache
+    directory and keyed by path, modification time and size of the
+    dataset file, such that reopening an unchanged dataset maps the
+    existing file. Stores of previous versions of a dataset are removed
+    and the least recently used stores are evicted, if the cache exceeds
+    maxBytes.
+
+    """
+
+    blockSize = 4096
+    chunkSize = 65536
+    headerSize = 4096
+    maxBytes = 2147483648
+
+    def __init__(self, path, columns = None):
+
+        import numpy
+        import os
+
+        self.path = path
+        self.key = os.path.splitext(os.path.basename(path))[0]
+        self.array = numpy.load(path, mmap_mode = 'r')
+        self.rows = self.array.shape[0]
+        if columns is None:
+            columns = ['%d' % i for i in range(self.array.shape[1])]
+        self.columns = list(columns)
+
+    @classmethod
+    def getKey(cls, path):
+
+        import hashlib
+        import os
+
+        # the key starts with the hash of the path, such that stores of
+        # previous versions of the same file can be found
+        try: stat = os.stat(path)
+        except (OSError, TypeError): mtime, size = None, None
+        else: mtime, size = stat.st_mtime, stat.st_size
+        state = '%s:%s:%s' % (path, mtime, size)
+
+        return '%s-%s' % (
+            hashlib.sha1(str(path).encode('utf-8')).hexdigest()[:16],
+            hashlib.sha1(state.encode('utf-8')).hexdigest()[:16])
+
+    @classmethod
+    def open(cls, key):
+
+        import json
+        import os
+
+        path = qdeep.common.getPath('cache', 'datasets', '%s.npy' % key)
+        try:
+            with open(path[:-4] + '.json', 'r') as file_handler:
+                columns = json.load(file_handler)
+            store = cls(path, columns)
+        except (IOError, OSError, ValueError):
+            return None
+        for filepath in [path, path[:-4] + '.json']: os.utime(filepath, None)
+
+        return store
+
+    @classmethod
+    def create(cls, path):
+
+        import json
+        import os
+
+        key = cls.getKey(path)
+        store = cls.open(key)
+        if store: return store
+        storePath = qdeep.common.getPath('cache', 'datasets',
+            '%s.npy' % key)
+        if not os.path.isdir(os.path.dirname(storePath)):
+            os.makedirs(os.path.dirname(storePath))
+        cls.prune(key)
+
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.npz': chunks = cls.readArchive(path)
+        elif ext in ['.tsv', '.tab']: chunks = cls.readText(path, '\t')
+        else: chunks = cls.readText(path, ',')
+
+        # chunks are appended behind a reserved header, which is written,
+        # when the number of rows is known. the store is moved into place,
+        # such that an interrupted write leaves no partial store
+        tmppath = storePath + '.part'
+        columns, rows = [], 0
+        with open(tmppath, 'wb') as file_handler:
+            file_handler.write(b'\0' * cls.headerSize)
+            for columns, chunk in chunks:
+                file_handler.write(chunk.astype('<f8').tobytes())
+                rows += chunk.shape[0]
+            file_handler.seek(0)
+            file_handler.write(cls.getHeader((rows, len(columns))))
+        with open(storePath[:-4] + '.json', 'w') as file_handler:
+            json.dump([str(column) for column in columns], file_handler)
+        if os.path.isfile(storePath): os.remove(storePath)
+        os.rename(tmppath, storePath)
+
+        return cls(storePath, columns)
+
+    @classmethod
+    def getHeader(cls, shape):
+
+        import numpy.lib.format
+        import struct
+
+        # the header of the npy format is padded to the reserved size
+        magic = numpy.lib.format.magic(1, 0)
+        header = "{'descr': '<f8', 'fortran_order': False, " \
+            "'shape': (%d, %d), }" % shape
+        header += ' ' * (cls.headerSize - len(magic) - 3 - len(header))
+        header = (header + '\n').encode('latin1')
+
+        return magic + struct.pack('<H', len(header)) + header
+
+    @classmethod
+    def readText(cls, path, delimiter):
+
+        import csv
+
+        # comment lines hold the configuration of the dataset and the
+        # first column holds the labels of the rows
+        with open(path, 'r') as file_handler:
+            lines = (line for line in file_handler if line.strip()
+                and not line.lstrip().startswith('#'))
+            reader = csv.reader(lines, delimiter = delimiter)
+            header = next(reader, None)
+            if not header: return
+            fields, rows, count = None, [], 0
+            for row in reader:
+                rows.append(row)
+                if len(rows) < cls.chunkSize: continue
+                if fields is None: fields = cls.getFields(rows, header)
+                yield [header[i] for i in fields], cls.parse(rows, fields)
+                rows, count = [], count + 1
+            if fields is None: fields = cls.getFields(rows, header)
+            if rows or not count:
+                yield [header[i] for i in fields], cls.parse(rows, fields)
+
+    @staticmethod
+    def getFields(rows, header):
+
+        # columns are numeric, if all values of the first chunk are
+        def isNumeric(value):
+            if not value.strip(): return True
+            try: float(value)
+            except ValueError: return False
+            return True
+
+        return [i for i in range(1, len(header)) if all(
+            isNumeric(row[i]) for row in rows if len(row) > i)]
+
+    @staticmethod
+    def parse(rows, fields):
+
+        import numpy
+
+        # values, which can not be converted, are missing
+        array = numpy.empty((len(rows), len(fields)))
+        for j, i in enumerate(fields):
+            values = [row[i] if len(row) > i else '' for row in rows]
+            try: array[:, j] = numpy.array(values, dtype = 'float64')
+            except ValueError:
+                for k, value in enumerate(values):
+                    try: array[k, j] = float(value)
+                    except ValueError: array[k, j] = numpy.nan
+
+        return array
+
+    @classmethod
+    def readArchive(cls, path):
+
+        import numpy
+
+        # archives hold pickled tables, which can not be read in parts.
+        # numeric fields of the tables are copied in chunks of rows and
+        # each table is released, when it has been copied
+        with numpy.load(path, allow_pickle = True) as archive:
+            tables = archive['tables'].item()
+        columns = None
+        for name in sorted(tables):
+            table = tables.pop(name)
+            names = [field for field in table.dtype.names or []
+                if table.dtype[field].kind in 'biuf']
+            if columns is None: columns = names
+            if not set(columns) <= set(names): continue
+            for start in range(0, table.shape[0], cls.chunkSize):
+                stop = start + cls.chunkSize
+                chunk = numpy.empty((len(table[start:stop]), len(columns)))
+                for i, column in enumerate(columns):
+                    chunk[:, i] = table[column][start:stop]
+                yield columns, chunk
+            del table
+        if columns is None: yield [], numpy.empty((0, 0))
+
+    @classmethod
+    def prune(cls, key):
+
+        import os
+
+        # stores of other versions of the same file are superseded
+        directory = qdeep.common.getPath('cache', 'datasets')
+        prefix = key.split('-')[0] + '-'
+        for name in os.listdir(directory):
+            if not name.startswith(prefix): continue
+            try: os.remove(os.path.join(directory, name))
+            except OSError: pass
+
+        return qdeep.common.pruneCache(directory, cls.maxBytes)
+
+class Statistics(object):
+    """Column statistics of a store, which are computed in one pass.
+
+    Counts of values and missing values, mean, variance, minimum and
+    maximum are merged chunk by chunk. Quantiles are interpolated from
+    histograms, which double their range whenever a chunk exceeds it,
+    such that the data is read only once. Results are cached in the
+    cache directory by the content hash of the dataset.
+
+    """
+
+    bins = 256
+    chunkSize = 65536
+    quantiles = [.25, .5, .75]
+
+    def __init__(self, columns):
+
+        import numpy
+
+        size = len(columns)
+        self.columns = list(columns)
+        self.count = numpy.zeros(size, dtype = 'int64')
+        self.missing = numpy.zeros(size, dtype = 'int64')
+        self.mean = numpy.zeros(size)
+        self.m2 = numpy.zeros(size)
+        self.min = numpy.empty(size)
+        self.min.fill(numpy.inf)
+        self.max = numpy.empty(size)
+        self.max.fill(-numpy.inf)
+        self.lower = numpy.empty(size)
+        self.lower.fill(numpy.nan)
+        self.upper = numpy.empty(size)
+        self.upper.fill(numpy.nan)
+        self.hist = numpy.zeros((size, self.bins), dtype = 'int64')
+
+    @classmethod
+    def getPath(cls, key):
+        return qdeep.common.getPath('cache', 'statistics', '%s.npz' % key)
+
+    @classmethod
+    def create(cls, store, key = None, cancelled = None):
+
+        import numpy
+
+        if key:
+            statistics = cls.read(key)
+            if statistics: return statistics
+
+        statistics = cls(store.columns)
+        for start in range(0, store.rows, cls.chunkSize):
+            if cancelled and cancelled(): return None
+            statistics.update(numpy.asarray(
+                store.array[start:start + cls.chunkSize]))
+        if key: statistics.write(key)
+
+        return statistics
+
+    @classmethod
+    def read(cls, key):
+
+        import numpy
+        import os
+
+        if not key: return None
+        path = cls.getPath(key)
+        if not os.path.isfile(path): return None
+        try:
+            with numpy.load(path) as data:
+                statistics = cls(data['columns'].tolist())
+                for name in ['count', 'missing', 'mean', 'm2', 'min',
+                    'max', 'lower', 'upper', 'hist']:
+                    setattr(statistics, name, data[name])
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+        return statistics
+
+    def write(self, key):
+
+        import numpy
+        import os
+
+        path = self.getPath(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.part', 'wb') as file_handler:
+            numpy.savez(file_handler,
+                columns = numpy.array([str(col) for col in self.columns]),
+                count = self.count, missing = self.missing,
+                mean = self.mean, m2 = self.m2, min = self.min,
+                max = self.max, lower = self.lower, upper = self.upper,
+                hist = self.hist)
+        if os.path.isfile(path): os.remove(path)
+        os.rename(path + '.part', path)
+
+        return True
+
+    def update(self, chunk):
+
+        import numpy
+
+        valid = numpy.isfinite(chunk)
+        count = valid.sum(axis = 0)
+        self.missing += chunk.shape[0] - count
+        if not count.any(): return
+
+        # merge mean and sum of squared deviations of the chunk
+        mean = numpy.where(valid, chunk, 0.).sum(axis = 0) \
+            / numpy.maximum(count, 1)
+        m2 = (numpy.where(valid, chunk - mean, 0.) ** 2).sum(axis = 0)
+        total = self.count + count
+        delta = mean - self.mean
+        ratio = count / numpy.maximum(total, 1).astype('float64')
+        self.mean += delta * ratio
+        self.m2 += m2 + delta ** 2 * self.count * ratio
+        self.count = total
+
+        lo = numpy.where(valid, chunk, numpy.inf).min(axis = 0)
+        hi = numpy.where(valid, chunk, -numpy.inf).max(axis = 0)
+        self.min = numpy.minimum(self.min, lo)
+        self.max = numpy.maximum(self.max, hi)
+
+        # histogram ranges are initialized by the first values
+        new = numpy.isnan(self.lower) & (count > 0)
+        self.lower[new] = lo[new]
+        self.upper[new] = numpy.where(hi[new] > lo[new], hi[new],
+            lo[new] + 1.)
+        with numpy.errstate(invalid = 'ignore'):
+            exceeded = (lo < self.lower) | (hi > self.upper)
+        for i in numpy.flatnonzero(exceeded): self.expand(i, lo[i], hi[i])
+
+        size = len(self.columns)
+        width = (self.upper - self.lower) / self.bins
+        with numpy.errstate(invalid = 'ignore'):
+            index = numpy.clip(numpy.floor((chunk - self.lower) / width),
+                0, self.bins - 1)
+        index = numpy.where(valid, index, 0).astype('int64') \
+            + numpy.arange(size) * self.bins
+        self.hist += numpy.bincount(index[valid],
+            minlength = size * self.bins).reshape(size, self.bins)
+
+    def expand(self, i, lo, hi):
+
+        # double the range and merge pairs of neighbouring bins
+        half = self.bins // 2
+        while lo < self.lower[i] or hi > self.upper[i]:
+            width = self.upper[i] - self.lower[i]
+            merged = self.hist[i, 0::2] + self.hist[i, 1::2]
+            self.hist[i] = 0
+            if hi > self.upper[i]:
+                self.hist[i, :half] = merged
+                self.upper[i] += width
+            else:
+                self.hist[i, half:] = merged
+                self.lower[i] -= width
+
+    def getVariance(self):
+
+        import numpy
+
+        return numpy.where(self.count > 1,
+            self.m2 / numpy.maximum(self.count - 1, 1), numpy.nan)
+
+    def getQuantiles(self, i):
+
+        import numpy
+
+        if not self.count[i]: return [numpy.nan] * len(self.quantiles)
+        cumsum = numpy.concatenate([[0], numpy.cumsum(self.hist[i])])
+        edges = numpy.linspace(self.lower[i], self.upper[i],
+            self.bins + 1)
+        values = numpy.interp(numpy.array(self.quantiles) * cumsum[-1],
+            cumsum, edges)
+
+        return numpy.clip(values, self.min[i], self.max[i]).tolist()
+
+    def getHistogram(self, i, bins = 16):
+
+        import numpy
+
+        # rebin the histogram to the range of the values
+        if not self.count[i]: return numpy.zeros(bins)
+        cumsum = numpy.concatenate([[0], numpy.cumsum(self.hist[i])])
+        edges = numpy.linspace(self.lower[i], self.upper[i],
+            self.bins + 1)
+        if self.max[i] > self.min[i]:
+            points = numpy.linspace(self.min[i], self.max[i], bins + 1)
+        else: points = numpy.linspace(self.lower[i], self.upper[i],
+            bins + 1)
+
+        return numpy.diff(numpy.interp(points, edges, cumsum))
+
+class TableModel(QtCore.QAbstractTableModel):
+    """Table model, which reads row blocks of a store on demand.
+
+    Only the blocks of the visible rows are copied from the memory map
+    and at most maxBlocks of them are kept in a least recently used
+    cache.
+
+    """
+
+    maxBlocks = 64
+
+    def __init__(self, store, parent = None):
+        super(TableModel, self).__init__(parent)
+
+        self.store = store
+        self.blocks = collections.OrderedDict()
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid(): return 0
+        return self.store.rows
+
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid(): return 0
+        return len(self.store.columns)
+
+    def getBlock(self, blockId):
+        block = self.blocks.pop(blockId, None)
+        if block is None:
+            start = blockId * self.store.blockSize
+            block = self.store.array[start:start + self.store.blockSize]
+            block = block.copy()
+            if len(self.blocks) >= self.maxBlocks:
+                self.blocks.popitem(last = False)
+        self.blocks[blockId] = block
+        return block
+
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if not index.isValid(): return None
+        if role == QtCore.Qt.DisplayRole:
+            blockId, row = divmod(index.row(), self.store.blockSize)
+            return '%g' % self.getBlock(blockId)[row, index.column()]
+        if role == QtCore.Qt.TextAlignmentRole:
+            return QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation,
+        role = QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole: return None
+        if orientation == QtCore.Qt.Horizontal:
+            return str(self.store.columns[section])
+        return str(section + 1)
+
+class Summary(QtGui.QTableWidget):
+    """Table of the column statistics of a dataset."""
+
+    labels = ('Column', 'Count', 'Missing', 'Mean', 'Std', 'Min', '25%',
+        'Median', '75%', 'Max', 'Histogram')
+    bars = u' \u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+
+    def __init__(self, parent = None):
+        super(Summary, self).__init__(0, len(self.labels), parent)
+
+        self.setHorizontalHeaderLabels(self.labels)
+        self.verticalHeader().hide()
+        self.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.setAlternatingRowColors(True)
+
+    def setMessage(self, text):
+        self.clearSpans()
+        self.setRowCount(1)
+        self.setItem(0, 0, QtGui.QTableWidgetItem(text))
+        self.setSpan(0, 0, 1, len(self.labels))
+
+    def setStatistics(self, statistics):
+
+        import math
+
+        def getText(value):
+            if isinstance(value, float):
+                if math.isnan(value) or math.isinf(value): return '-'
+                return '%.6g' % value
+            return str(value)
+
+        variance = statistics.getVariance()
+        self.clearSpans()
+        self.setRowCount(len(statistics.columns))
+        for i, column in enumerate(statistics.columns):
+            hist = statistics.getHistogram(i)
+            scale = (len(self.bars) - 1) / (hist.max() or 1.)
+            values = [int(statistics.count[i]),
+                int(statistics.missing[i]), float(statistics.mean[i]),
+                math.sqrt(variance[i]) if variance[i] >= 0 \
+                else float('nan'), float(statistics.min[i])] \
+                + statistics.getQuantiles(i) + [float(statistics.max[i])]
+            if not statistics.count[i]: values[2] = float('nan')
+            self.setItem(i, 0, QtGui.QTableWidgetItem(str(column)))
+            for j, value in enumerate(values):
+                item = QtGui.QTableWidgetItem(getText(value))
+                item.setTextAlignment(
+                    QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+                self.setItem(i, j + 1, item)
+            self.setItem(i, len(values) + 1, QtGui.QTableWidgetItem(
+                u''.join(self.bars[int(math.ceil(count * scale))]
+                for count in hist)))
+        self.resizeColumnsToContents()
 
 class Editor(qdeep.objects.common.Editor):
     objType = 'dataset'
+    watchInstance = False
+    store = None
+    statistics = None
+    analyzer = None
+
+    def loadInstance(self, objName):
+
+        # runs on a worker thread. the store replaces the instance of
+        # nemoa, which would hold all data in memory, and the viewer
+        # shows cached statistics together with the data
+        store = Store.create(self.objPath)
+        self.store = store
+        self.statistics = Statistics.read(store.key)
+        return store
+
+    def getName(self):
+        return self.objName
+
+    def getPath(self):
+        return self.objPath
+
+    def saveFile(self, path = None):
+
+        # the viewer does not change the data, such that only copies of
+        # the file are written
+        path = path or self.getPath()
+        if path == self.objPath and not self.getModified(): return True
+        return super(Editor, self).saveFile(path)
+
+    def writeSnapshot(self, store, path):
+
+        import shutil
+
+        # runs on a worker thread
+        shutil.copyfile(self.objPath, path)
+        return True
+
+    def createCentralWidget(self):
+        if not self.store:
+            return super(Editor, self).createCentralWidget()
+
+        self.tableView = QtGui.QTableView()
+        self.tableModel = TableModel(self.store, self.tableView)
+        self.tableView.setModel(self.tableModel)
+
+        # fixed row heights keep the view from measuring all rows
+        header = self.tableView.verticalHeader()
+        header.setResizeMode(QtGui.QHeaderView.Fixed)
+        header.setDefaultSectionSize(
+            self.tableView.fontMetrics().height() + 4)
+        self.tableView.horizontalHeader().setResizeMode(
+            QtGui.QHeaderView.Interactive)
+
+        self.setCentralWidget(self.tableView)
+        self.createSummary()
+
+    def createSummary(self):
+        dock = QtGui.QDockWidget("Summary", self)
+        dock.setAllowedAreas(QtCore.Qt.BottomDockWidgetArea \
+            | QtCore.Qt.TopDockWidgetArea)
+        self.summary = Summary(dock)
+        dock.setWidget(self.summary)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock)
+        self.dockSummary = dock
+
+        if self.statistics: self.summary.setStatistics(self.statistics)
+        else: self.analyze()
+
+    def analyze(self):
+        if not self.store or self.analyzer: return False
+
+        self.summary.setMessage("Computing statistics ...")
+        analyzer = qdeep.common.worker.Worker(Statistics.create,
+            self.store, self.store.key)
+        analyzer.kwargs['cancelled'] = lambda: analyzer.cancelled
+        analyzer.signals.finished.connect(self.analyzeFinished)
+        analyzer.signals.failed.connect(self.analyzeFailed)
+        self.analyzer = analyzer.start()
+
+        return True
+
+    def analyzeFinished(self, statistics):
+        self.analyzer = None
+        self.statistics = statistics
+        if statistics: self.summary.setStatistics(statistics)
+
+    def analyzeFailed(self, message):
+        self.analyzer = None
+        self.summary.setMessage("Cannot compute statistics: %s" % message)
 
+    def closeEvent(self, event):
+        super(Editor, self).closeEvent(event)
+        if event.isAccepted() and self.analyzer: self.analyzer.cancel()
@@ -4,7 +4,823 @@ __author__  = 'Patrick Michl'
 __email__   = 'patrick.michl@gmail.com'
 __license__ = 'GPLv3'
 
+import collections
+import functools
+import threading
+import qdeep.common
+import qdeep.common.worker
 import qdeep.objects.common
+from PySide import QtGui, QtCore
+
+nemoa = qdeep.common.LazyModule('nemoa')
+
+LOADERS = None
+
+def getLoaders():
+
+    global LOADERS
+
+    # models of comparisons are opened by few threads, such that only
+    # few datasets are held twice, before they are shared
+    if not LOADERS:
+        LOADERS = QtCore.QThreadPool()
+        LOADERS.setMaxThreadCount(2)
+
+    return LOADERS
+
+def getWeights(instance):
+
+    # weight matrices of the links between the layers of the system. the
+    # system returns a copy of its parameters, such that the matrices are
+    # not changed by a later optimization
+    try: links = instance.system.get('params', 'links')
+    except (AttributeError, KeyError, TypeError, ValueError): return {}
+    if not isinstance(links, dict): return {}
+    return dict((key, link['W']) for key, link in links.items()
+        if isinstance(link, dict) and 'W' in link)
+
+class Buffer(object):
+    """Fixed capacity buffer of a curve with automatic downsampling.
+
+    If the buffer is full, pairs of neighbouring points are merged and
+    the number of samples, which are averaged to a new point, doubles.
+    Memory therefore stays constant for arbitrary long curves.
+
+    """
+
+    def __init__(self, capacity = 4096):
+
+        import numpy
+
+        self.capacity = capacity - capacity % 2
+        self.x = numpy.empty(self.capacity)
+        self.y = numpy.empty(self.capacity)
+        self.size = 0
+        self.stride = 1
+        self.pending = []
+
+    def append(self, x, y):
+
+        # compress before a new point is accumulated, such that all
+        # points of the new stride average the same number of samples
+        if self.size == self.capacity: self.compress()
+        self.pending.append((x, y))
+        if len(self.pending) < self.stride: return
+        xs, ys = zip(*self.pending)
+        self.pending = []
+        self.x[self.size] = xs[0]
+        self.y[self.size] = sum(ys) / float(len(ys))
+        self.size += 1
+
+    def compress(self):
+        half = self.size // 2
+        self.x[:half] = self.x[:self.size:2]
+        self.y[:half] = (self.y[:self.size:2] + self.y[1:self.size:2]) / 2.
+        self.size = half
+        self.stride *= 2
+
+    def getData(self):
+        return self.x[:self.size], self.y[:self.size]
+
+class Tracker(object):
+    """Iteration state of a nemoa optimizer.
+
+    The update method of the optimizer, which is called once per epoch,
+    is wrapped, such that new values of the objective and evaluation
+    functions, which the optimizer tracks, are put into a thread safe
+    queue together with their epoch. A stopped tracker ends the
+    optimization at the next update.
+
+    """
+
+    series = [('obj_values', 'objective'), ('eval_values', 'evaluation')]
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.counts = {}
+        self.stopped = False
+
+    def attach(self, optimizer):
+        update = optimizer.update
+
+        def tracked():
+            retVal = update()
+            self.collect(optimizer)
+            if not self.stopped: return retVal
+            optimizer.set('buffer', 'continue', False)
+            return False
+
+        optimizer.update = tracked
+
+        return optimizer
+
+    def collect(self, optimizer):
+        epoch = optimizer.get('epoch')
+        for key, name in self.series:
+            values = optimizer.get(key)
+            if getattr(values, 'shape', None) is None: continue
+            for progress, value in values[self.counts.get(key, 0):]:
+                self.queue.append((name, epoch, float(value)))
+            self.counts[key] = len(values)
+
+    def stop(self):
+        self.stopped = True
+
+class Dashboard(QtGui.QWidget):
+    """Training progress plot, which is redrawn at most maxFps per second."""
+
+    maxFps = 10
+    colors = [(200, 30, 30), (30, 90, 200), (30, 160, 30),
+        (200, 120, 0), (120, 30, 160)]
+
+    def __init__(self, parent = None):
+        super(Dashboard, self).__init__(parent)
+
+        import pyqtgraph
+
+        self.plot = pyqtgraph.PlotWidget()
+        self.plot.addLegend()
+        self.plot.showGrid(x = True, y = True, alpha = .3)
+        self.plot.setLabel('bottom', 'epoch')
+        self.buffers = {}
+        self.curves = {}
+        self.tracker = None
+
+        layout = QtGui.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.plot)
+        self.setLayout(layout)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000 // self.maxFps)
+        self.timer.timeout.connect(self.redraw)
+
+    def subscribe(self, tracker):
+        self.tracker = tracker
+        self.timer.start()
+
+    def unsubscribe(self):
+        self.redraw()
+        self.tracker = None
+        self.timer.stop()
+
+    def redraw(self):
+
+        import pyqtgraph
+
+        if not self.tracker: return
+        queue = self.tracker.queue
+        changed = set()
+        while queue:
+            key, epoch, value = queue.popleft()
+            if key not in self.buffers:
+                self.buffers[key] = Buffer()
+                color = self.colors[len(self.curves) % len(self.colors)]
+                self.curves[key] = self.plot.plot(name = key,
+                    pen = pyqtgraph.mkPen(color))
+            self.buffers[key].append(epoch, value)
+            changed.add(key)
+        for key in changed:
+            x, y = self.buffers[key].getData()
+            self.curves[key].setData(x = x, y = y)
+
+class Pyramid(object):
+    """Multiresolution pyramid of a matrix by means of blocks.
+
+    Level 0 is the matrix itself and each further level halves both
+    dimensions by the means of 2x2 blocks, until the level fits into
+    minSize. The levels are computed in row strips as float32, such that
+    they need less than half the memory of a float64 matrix. Pyramids of
+    large matrices are cached in the cache directory by the hash of the
+    matrix.
+
+    """
+
+    minSize = 256
+    stripSize = 512
+    minCached = 1048576
+
+    def __init__(self, matrix, levels = None, absMax = None):
+
+        import numpy
+
+        self.shape = matrix.shape
+        self.levels = [matrix] + list(levels or [])
+        if not levels:
+            level = matrix
+            while max(level.shape) > self.minSize:
+                level = self.downsample(level)
+                self.levels.append(level)
+        if absMax is None:
+            absMax = 0.
+            for start in range(0, matrix.shape[0], self.stripSize):
+                strip = matrix[start:start + self.stripSize]
+                if not strip.size: continue
+                absMax = max(absMax, float(numpy.abs(strip).max()))
+        self.absMax = absMax or 1.
+
+    @classmethod
+    def create(cls, matrix):
+
+        import numpy
+        import os
+
+        if matrix.size < cls.minCached: return cls(matrix)
+
+        key = qdeep.common.getHash(matrix)
+        path = qdeep.common.getPath('cache', 'pyramids', '%s.npz' % key)
+        if os.path.isfile(path):
+            try:
+                with numpy.load(path) as data:
+                    levels = [data['level%d' % i]
+                        for i in range(int(data['count']))]
+                    return cls(matrix, levels, float(data['absmax']))
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+
+        pyramid = cls(matrix)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        arrays = dict(('level%d' % i, level)
+            for i, level in enumerate(pyramid.levels[1:]))
+        with open(path + '.part', 'wb') as file_handler:
+            numpy.savez(file_handler, count = len(arrays),
+                absmax = pyramid.absMax, **arrays)
+        if os.path.isfile(path): os.remove(path)
+        os.rename(path + '.part', path)
+
+        return pyramid
+
+    def downsample(self, array):
+
+        import numpy
+
+        rows, cols = array.shape
+        result = numpy.empty(((rows + 1) // 2, (cols + 1) // 2),
+            dtype = 'float32')
+        for start in range(0, rows, 2 * self.stripSize):
+            strip = numpy.asarray(array[start:start + 2 * self.stripSize],
+                dtype = 'float64')
+
+            # odd dimensions are padded by their last row or column
+            if strip.shape[0] % 2:
+                strip = numpy.concatenate([strip, strip[-1:]], axis = 0)
+            if cols % 2:
+                strip = numpy.concatenate([strip, strip[:, -1:]],
+                    axis = 1)
+            blocks = strip.reshape(strip.shape[0] // 2, 2, -1, 2)
+            result[start // 2:start // 2 + blocks.shape[0]] = \
+                blocks.mean(axis = 3).mean(axis = 1)
+
+        return result
+
+    def getLevel(self, scale):
+
+        import math
+
+        # the level with about one entry per screen pixel
+        level = int(math.floor(math.log(max(scale, 1.), 2)))
+        level = min(level, len(self.levels) - 1)
+        return self.levels[level], 2 ** level
+
+class Heatmap(QtGui.QWidget):
+    """Heatmap of a matrix, which renders the pyramid level of the zoom.
+
+    Only the visible part of the level with about one entry per screen
+    pixel is passed to the image item, such that pan and zoom do not
+    depend on the size of the matrix.
+
+    """
+
+    delay = 50
+
+    def __init__(self, parent = None):
+        super(Heatmap, self).__init__(parent)
+
+        import numpy
+        import pyqtgraph
+
+        self.pyramid = None
+
+        self.canvas = pyqtgraph.GraphicsLayoutWidget()
+        self.view = self.canvas.addViewBox()
+        self.view.invertY(True)
+        self.image = pyqtgraph.ImageItem()
+        colormap = pyqtgraph.ColorMap([0., .5, 1.], numpy.array([
+            [30, 90, 200, 255], [255, 255, 255, 255],
+            [200, 30, 30, 255]], dtype = 'ubyte'))
+        self.image.setLookupTable(colormap.getLookupTable(0., 1., 256))
+        self.view.addItem(self.image)
+
+        layout = QtGui.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas)
+        self.setLayout(layout)
+
+        # collect range changes and redraw after a short delay
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.updateImage)
+        self.view.sigRangeChanged.connect(self.rangeChanged)
+
+    def setPyramid(self, pyramid):
+        self.pyramid = pyramid
+        if not pyramid: return self.image.clear()
+        rows, cols = pyramid.shape
+        self.view.setRange(xRange = (0, cols), yRange = (0, rows),
+            padding = 0)
+        self.updateImage()
+
+    def rangeChanged(self, *args):
+        self.timer.start(self.delay)
+
+    def updateImage(self):
+
+        import math
+        import numpy
+
+        if not self.pyramid: return
+        rows, cols = self.pyramid.shape
+        (xmin, xmax), (ymin, ymax) = self.view.viewRange()
+        x0, x1 = max(int(xmin), 0), min(int(math.ceil(xmax)), cols)
+        y0, y1 = max(int(ymin), 0), min(int(math.ceil(ymax)), rows)
+        if x1 <= x0 or y1 <= y0: return self.image.clear()
+
+        scale = max(float(x1 - x0) / max(self.view.width(), 1),
+            float(y1 - y0) / max(self.view.height(), 1))
+        level, factor = self.pyramid.getLevel(scale)
+        i0, i1 = y0 // factor, -(-y1 // factor)
+        j0, j1 = x0 // factor, -(-x1 // factor)
+        block = numpy.asarray(level[i0:i1, j0:j1], dtype = 'float32')
+
+        # the image is indexed by x and y, which are columns and rows
+        absMax = self.pyramid.absMax
+        self.image.setImage(block.T, autoLevels = False,
+            levels = (-absMax, absMax))
+        self.image.setTransform(QtGui.QTransform(factor, 0., 0., factor,
+            j0 * factor, i0 * factor))
 
 class Editor(qdeep.objects.common.Editor):
     objType = 'model'
+    trainer = None
+    tracker = None
+    builder = None
+    maxPyramids = 4
+
+    def createActions(self):
+        self.actOptimize = QtGui.QAction(
+            qdeep.common.getIcon('actions', 'system-run.png'),
+            "Optimize model", self,
+            shortcut = "F5",
+            statusTip = "Optimize model in background",
+            triggered = self.optimize)
+        self.actStopOptimize = QtGui.QAction(
+            qdeep.common.getIcon('actions', 'process-stop.png'),
+            "Stop optimization", self,
+            shortcut = "Shift+F5",
+            statusTip = "Stop optimization after the current epoch",
+            triggered = self.stopOptimize,
+            enabled = False)
+
+    def createToolBars(self):
+        self.tbar = self.addToolBar("Model")
+        self.tbar.addAction(self.actOptimize)
+        self.tbar.addAction(self.actStopOptimize)
+
+    def createCentralWidget(self):
+        self.tabs = QtGui.QTabWidget()
+        self.tabs.setDocumentMode(True)
+        self.dashboard = Dashboard()
+        self.tabs.addTab(self.dashboard, "Training")
+        self.createWeights()
+        self.setCentralWidget(self.tabs)
+
+    def createWeights(self):
+        widget = QtGui.QWidget()
+        self.linkBox = QtGui.QComboBox()
+        self.heatmap = Heatmap()
+        self.weightsLabel = QtGui.QLabel()
+        layout = QtGui.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.linkBox)
+        layout.addWidget(self.heatmap)
+        layout.addWidget(self.weightsLabel)
+        widget.setLayout(layout)
+        self.tabs.addTab(widget, "Weights")
+
+        self.pyramids = collections.OrderedDict()
+        self.links = self.getLinks()
+        for key in sorted(self.links.keys(), key = str):
+            self.linkBox.addItem(str(key), key)
+        self.linkBox.currentIndexChanged.connect(self.showWeights)
+        self.showWeights()
+
+    def getLinks(self):
+        return getWeights(self.objInstance)
+
+    def showWeights(self, *args):
+        if self.isBusy():
+            self.heatmap.setPyramid(None)
+            self.weightsLabel.setText(
+                "Weights are shown when the optimization has finished.")
+            return False
+        key = self.linkBox.itemData(self.linkBox.currentIndex())
+        if key not in self.links:
+            self.heatmap.setPyramid(None)
+            self.weightsLabel.setText("Model has no weight matrices.")
+            return False
+
+        # pyramids of the recently shown links are kept in memory
+        pyramid = self.pyramids.pop(key, None)
+        if pyramid:
+            self.pyramids[key] = pyramid
+            self.heatmap.setPyramid(pyramid)
+            self.weightsLabel.setText("%d x %d weights" % pyramid.shape)
+            return True
+
+        self.weightsLabel.setText("Computing weight pyramid ...")
+        if self.builder: self.builder.cancel()
+        self.builder = qdeep.common.worker.Worker(Pyramid.create,
+            self.links[key])
+        self.builder.signals.finished.connect(
+            functools.partial(self.pyramidFinished, key))
+        self.builder.signals.failed.connect(self.pyramidFailed)
+        self.builder.start()
+
+        return True
+
+    def pyramidFinished(self, key, pyramid):
+        self.builder = None
+        self.pyramids[key] = pyramid
+        while len(self.pyramids) > self.maxPyramids:
+            self.pyramids.popitem(last = False)
+        self.showWeights()
+
+    def pyramidFailed(self, message):
+        self.builder = None
+        self.weightsLabel.setText("Cannot show weights: %s" % message)
+
+    def updateWeights(self):
+
+        # weights have been replaced or changed in place by optimization
+        self.pyramids = collections.OrderedDict()
+        self.links = self.getLinks()
+        self.showWeights()
+
+    def isBusy(self):
+        if self.trainer is not None: return True
+        return super(Editor, self).isBusy()
+
+    def optimize(self):
+        if not self.objInstance or self.trainer: return False
+
+        # the model is not changed, while it is written or used by a
+        # console command or a tool
+        if self.isLocked():
+            QtGui.QMessageBox.information(self, "MDI",
+                "Cannot optimize model '%s':\nThe model is being saved "
+                "or used in background." % self.getName())
+            return False
+
+        # progress is taken from the iteration state of the optimizer
+        self.tracker = Tracker()
+        self.dashboard.subscribe(self.tracker)
+        self.tabs.setCurrentWidget(self.dashboard)
+
+        self.trainer = qdeep.common.worker.Worker(self.train,
+            self.objInstance, self.tracker)
+        self.trainer.signals.finished.connect(self.optimizeFinished)
+        self.trainer.signals.failed.connect(self.optimizeFailed)
+        self.actOptimize.setEnabled(False)
+        self.actStopOptimize.setEnabled(True)
+        self.trainer.start()
+        self.showWeights()
+
+        return True
+
+    @staticmethod
+    def train(instance, tracker):
+
+        import nemoa.model.morphisms
+
+        # runs on a worker thread
+        optimizer = nemoa.model.morphisms.new(instance)
+        return tracker.attach(optimizer).optimize()
+
+    def stopOptimize(self):
+        if not self.trainer: return False
+        self.tracker.stop()
+        self.actStopOptimize.setEnabled(False)
+        return True
+
+    def optimizeFinished(self, result = None):
+        self.dashboard.unsubscribe()
+        self.trainer = None
+        self.actOptimize.setEnabled(True)
+        self.actStopOptimize.setEnabled(False)
+        self.setModified(True)
+        self.documentWasModified()
+        self.updateWeights()
+        self.applyRecovery()
+
+    def optimizeFailed(self, message):
+        self.optimizeFinished()
+        QtGui.QMessageBox.warning(self, "MDI",
+            "Cannot optimize model '%s':\n%s." % (self.getName(), message))
+
+    def closeEvent(self, event):
+
+        # the optimizer finishes its epoch before the model is closed
+        if self.trainer:
+            ret = QtGui.QMessageBox.question(self, "MDI",
+                "Model '%s' is being optimized.\nDo you want to stop the "
+                "optimization?" % self.getName(),
+                QtGui.QMessageBox.Yes | QtGui.QMessageBox.No)
+            if ret == QtGui.QMessageBox.Yes: self.stopOptimize()
+            return event.ignore()
+        super(Editor, self).closeEvent(event)
+
+class Comparison(QtGui.QWidget):
+    """Side by side comparison of the parameters of several models.
+
+    Models, which are loaded in editors, are reused and the others are
+    opened by the workers of a small thread pool. Models with equal
+    datasets share one dataset instance, such that the copy of a freshly
+    opened model is released by its worker and at most one copy per
+    worker is held at a time. Weights are copied by the workers. Metrics
+    of the weight matrices of all links are shown in bar plots with a
+    common axis and the difference of the weights of a model to the
+    first model as a heatmap.
+
+    """
+
+    def __init__(self, names, instances = None, parent = None):
+        super(Comparison, self).__init__(parent)
+
+        import pyqtgraph
+
+        self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        self.setWindowTitle("Comparison of %d models" % len(names))
+        self.names = list(names)
+        self.models = {}
+        self.weights = {}
+        self.datasets = {}
+        self.errors = []
+        self.workers = {}
+        self.differ = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+        self.statusLabel = QtGui.QLabel()
+        self.tabs = QtGui.QTabWidget()
+        self.tabs.setDocumentMode(True)
+
+        # metrics of all models are plotted against the same link axis
+        self.canvas = pyqtgraph.GraphicsLayoutWidget()
+        self.normPlot = self.canvas.addPlot(title = "RMS of weights")
+        self.normPlot.addLegend()
+        self.canvas.nextRow()
+        self.diffPlot = self.canvas.addPlot(
+            title = "RMS of differences to '%s'" % self.names[0])
+        self.diffPlot.setXLink(self.normPlot)
+        self.tabs.addTab(self.canvas, "Metrics")
+
+        widget = QtGui.QWidget()
+        self.linkBox = QtGui.QComboBox()
+        self.modelBox = QtGui.QComboBox()
+        self.heatmap = Heatmap()
+        self.diffLabel = QtGui.QLabel()
+        boxes = QtGui.QHBoxLayout()
+        boxes.addWidget(self.linkBox)
+        boxes.addWidget(self.modelBox)
+        layout = QtGui.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(boxes)
+        layout.addWidget(self.heatmap)
+        layout.addWidget(self.diffLabel)
+        widget.setLayout(layout)
+        self.tabs.addTab(widget, "Weight differences")
+
+        layout = QtGui.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.statusLabel)
+        layout.addWidget(self.tabs)
+        self.setLayout(layout)
+
+        self.linkBox.currentIndexChanged.connect(self.showDifference)
+        self.modelBox.currentIndexChanged.connect(self.showDifference)
+
+        # datasets of the instances of editors are hashed first, such
+        # that they are shared with the opened models
+        instances = dict((name, instances[name])
+            for name in self.names if name in (instances or {}))
+        self.models.update(instances)
+        if instances:
+            worker = qdeep.common.worker.Worker(self.prepareModels,
+                instances)
+            worker.signals.finished.connect(self.prepareFinished)
+            worker.signals.failed.connect(self.prepareFailed)
+            for name in instances: self.workers[name] = worker
+            worker.start(getLoaders())
+        else: self.loadModels()
+        self.updateStatus()
+
+    def prepareModels(self, instances):
+
+        # runs on a worker thread
+        weights = {}
+        for name, instance in instances.items():
+            self.shareDataset(instance, replace = False)
+            weights[name] = getWeights(instance)
+        return weights
+
+    def prepareFinished(self, weights):
+        if self.closed: return
+        self.weights.update(weights)
+        for name in weights: self.workers.pop(name, None)
+        self.loadModels()
+        self.updateStatus()
+
+    def prepareFailed(self, message):
+        if self.closed: return
+
+        # the models of the editors are opened again
+        for name in self.workers: self.models.pop(name, None)
+        self.workers = {}
+        self.loadModels()
+        self.updateStatus()
+
+    def loadModels(self):
+        for name in self.names:
+            if name in self.models: continue
+            worker = qdeep.common.worker.Worker(self.loadModel, name)
+            worker.signals.finished.connect(
+                functools.partial(self.loadFinished, name))
+            worker.signals.failed.connect(
+                functools.partial(self.loadFailed, name))
+            self.workers[name] = worker
+            worker.start(getLoaders())
+
+    def loadModel(self, name):
+
+        # runs on a worker thread
+        instance = nemoa.open('model', name)
+        if not instance: return None
+        self.shareDataset(instance)
+        return instance, getWeights(instance)
+
+    def shareDataset(self, instance, replace = True):
+        dataset = getattr(instance, 'dataset', None)
+        if dataset is None: return False
+        key = qdeep.common.getHash(dataset)
+        with self.lock:
+            shared = self.datasets.get(key, None)
+            if shared is None or not replace:
+                self.datasets[key] = dataset
+                return False
+        instance.dataset = shared
+
+        return True
+
+    def loadFinished(self, name, result):
+
+        # queued results of a closed comparison are dropped
+        if self.closed: return
+        self.workers.pop(name, None)
+        if result: self.models[name], self.weights[name] = result
+        else: self.errors.append((name, 'nemoa returned no instance'))
+        self.updateStatus()
+
+    def loadFailed(self, name, message):
+        if self.closed: return
+        self.workers.pop(name, None)
+        self.errors.append((name, message))
+        self.updateStatus()
+
+    def updateStatus(self):
+        if self.workers:
+            self.statusLabel.setText("Loading %d of %d models ..." % (
+                len(self.workers), len(self.names)))
+            return
+        text = "%d models, %d shared datasets" % (len(self.models),
+            len(self.datasets))
+        if self.errors: text += "; cannot open %s" % ', '.join(
+            "'%s' (%s)" % error for error in self.errors)
+        self.statusLabel.setText(text)
+        self.updateMetrics()
+
+    def getNames(self):
+        return [name for name in self.names if name in self.weights]
+
+    def updateMetrics(self):
+
+        import numpy
+        import pyqtgraph
+
+        names = self.getNames()
+        if not names: return
+        keys = sorted(set(key for name in names
+            for key in self.weights[name]), key = str)
+        reference = self.weights[names[0]]
+
+        # root mean squares of weights and of differences to reference
+        norms = numpy.zeros((len(names), len(keys)))
+        diffs = numpy.zeros((len(names), len(keys)))
+        for i, name in enumerate(names):
+            for j, key in enumerate(keys):
+                weights = self.weights[name].get(key, None)
+                if weights is None or not weights.size: continue
+                norms[i, j] = numpy.sqrt(numpy.mean(
+                    numpy.square(weights)))
+                base = reference.get(key, None)
+                if base is None or base.shape != weights.shape: continue
+                diffs[i, j] = numpy.sqrt(numpy.mean(
+                    numpy.square(numpy.subtract(weights, base))))
+
+        width = .8 / len(names)
+        ticks = [[(j, str(key)) for j, key in enumerate(keys)]]
+        for plot, values in [(self.normPlot, norms),
+            (self.diffPlot, diffs)]:
+            plot.clear()
+            plot.getAxis('bottom').setTicks(ticks)
+            for i, name in enumerate(names):
+                color = Dashboard.colors[i % len(Dashboard.colors)]
+                plot.addItem(pyqtgraph.BarGraphItem(
+                    x = numpy.arange(len(keys)) - .4 + (i + .5) * width,
+                    height = values[i], width = width,
+                    brush = pyqtgraph.mkBrush(color)))
+                if plot is self.normPlot:
+                    plot.plot([], [], pen = None, symbol = 's',
+                        symbolBrush = pyqtgraph.mkBrush(color),
+                        name = name)
+
+        self.linkBox.blockSignals(True)
+        self.modelBox.blockSignals(True)
+        self.linkBox.clear()
+        for key in keys: self.linkBox.addItem(str(key), key)
+        self.modelBox.clear()
+        for name in names[1:]: self.modelBox.addItem(name)
+        self.linkBox.blockSignals(False)
+        self.modelBox.blockSignals(False)
+        self.showDifference()
+
+    @staticmethod
+    def getDifference(weights, base):
+
+        import numpy
+
+        # runs on a worker thread
+        return Pyramid(numpy.subtract(weights, base, dtype = 'float32'))
+
+    def showDifference(self, *args):
+        names = self.getNames()
+        key = self.linkBox.itemData(self.linkBox.currentIndex())
+        name = self.modelBox.currentText()
+        if len(names) < 2 or key is None or not name:
+            self.heatmap.setPyramid(None)
+            self.diffLabel.setText("Two models are required.")
+            return False
+        weights = self.weights[name].get(key, None)
+        base = self.weights[names[0]].get(key, None)
+        if weights is None or base is None \
+            or weights.shape != base.shape:
+            self.heatmap.setPyramid(None)
+            self.diffLabel.setText("Link %s differs in its shape." % (
+                str(key), ))
+            return False
+
+        self.diffLabel.setText("Computing differences ...")
+        if self.differ: self.differ.cancel()
+        self.differ = qdeep.common.worker.Worker(self.getDifference,
+            weights, base)
+        self.differ.signals.finished.connect(functools.partial(
+            self.differenceFinished, self.differ, key, name))
+        self.differ.signals.failed.connect(functools.partial(
+            self.differenceFailed, self.differ))
+        self.differ.start()
+
+        return True
+
+    def differenceFinished(self, worker, key, name, pyramid):
+
+        # results of replaced workers may still be queued
+        if self.closed or worker is not self.differ: return
+        self.differ = None
+        self.heatmap.setPyramid(pyramid)
+        self.diffLabel.setText("'%s' - '%s' at link %s" % (
+            name, self.getNames()[0], str(key)))
+
+    def differenceFailed(self, worker, message):
+        if self.closed or worker is not self.differ: return
+        self.differ = None
+        self.diffLabel.setText("Cannot compute differences: %s" % message)
+
+    def closeEvent(self, event):
+
+        # results, which are queued for the deleted widgets, are dropped
+        self.closed = True
+        for worker in list(self.workers.values()) + [self.differ]:
+            if worker: worker.cancel()
+        self.workers = {}
+        self.differ = None
+        event.accept()
@@ -4,12 +4,421 @@ __author__  = 'Patrick Michl'
 __email__   = 'patrick.michl@gmail.com'
 __license__ = 'GPLv3'
 
-import nemoa
 import qdeep.objects.common
 from PySide import QtGui, QtCore
 
+class Layout(object):
+    """Layout service for network graphs.
+
+    Layered networks are drawn top down by their layer ids, other
+    networks by a force directed layout. Force directed layouts are
+    cached in the cache directory, keyed by a hash of the nodes and edges
+    and additionally as the latest layout of the network name. If the
+    content of a network changed, the latest layout is relaxed
+    incrementally instead of computing a new layout. The least recently
+    used layouts are evicted, if the cache exceeds maxBytes.
+
+    Networks with more than exactCount nodes approximate the repulsion
+    on a grid, which is exact for nodes in neighbouring cells and uses
+    the centroids of all other cells, such that an iteration grows about
+    linearly with the number of nodes. Intermediate arrays are bounded
+    by maxBlockBytes.
+
+    """
+
+    iterations = 50
+    relaxIterations = 10
+    exactCount = 2000
+    cellNodes = 16
+    maxGrid = 96
+    maxBlockBytes = 67108864
+    maxBytes = 268435456
+
+    def get(self, graph):
+        if graph.layers: return self.getLayered(graph)
+
+        key = self.getHash(graph)
+        positions = self.readCache(key, graph.nodes)
+        if positions is not None: return positions
+
+        latest = self.getLatestKey(graph)
+        positions = self.readCache(latest, graph.nodes, partial = True)
+        if positions is None:
+            positions = self.getForceDirected(graph)
+        else:
+            positions = self.getForceDirected(graph, positions,
+                iterations = self.relaxIterations, temperature = .02)
+
+        self.writeCache(key, graph.nodes, positions)
+        self.writeCache(latest, graph.nodes, positions)
+
+        return positions
+
+    def getHash(self, graph):
+
+        import hashlib
+
+        nodes = [str(node) for node in graph.nodes]
+        edges = sorted('%s\t%s' % (nodes[u], nodes[v])
+            for u, v in graph.edges)
+        content = '\n'.join(sorted(nodes) + [''] + edges)
+
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def getLatestKey(self, graph):
+
+        import hashlib
+
+        name = 'latest:%s' % graph.name
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def getPath(self, key):
+        return qdeep.common.getPath('cache', 'layouts', '%s.npz' % key)
+
+    def readCache(self, key, nodes, partial = False):
+
+        import numpy
+        import os
+
+        path = self.getPath(key)
+        if not os.path.isfile(path): return None
+        try:
+            with numpy.load(path) as data:
+                cached = dict(zip(data['nodes'].tolist(),
+                    data['positions']))
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+        names = [str(node) for node in nodes]
+        if not partial:
+            if set(names) != set(cached): return None
+            return numpy.array([cached[name] for name in names])
+
+        # positions of new nodes are marked as not a number
+        positions = numpy.empty((len(names), 2))
+        positions.fill(numpy.nan)
+        for i, name in enumerate(names):
+            if name in cached: positions[i] = cached[name]
+        if numpy.isnan(positions).all(): return None
+
+        return positions
+
+    def writeCache(self, key, nodes, positions):
+
+        import numpy
+        import os
+
+        path = self.getPath(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        names = numpy.array([str(node) for node in nodes])
+        with open(path + '.part', 'wb') as file_handler:
+            numpy.savez(file_handler, nodes = names,
+                positions = positions)
+        if os.path.isfile(path): os.remove(path)
+        os.rename(path + '.part', path)
+        qdeep.common.pruneCache(os.path.dirname(path), self.maxBytes,
+            keep = [path])
+
+        return True
+
+    def getLayered(self, graph):
+
+        import numpy
+
+        positions = numpy.zeros((len(graph.nodes), 2))
+        layers = numpy.array(graph.layers)
+        for layer in numpy.unique(layers):
+            ids = numpy.flatnonzero(layers == layer)
+            positions[ids, 0] = numpy.linspace(-1., 1., len(ids) + 2)[1:-1]
+            positions[ids, 1] = -float(layer)
+
+        return positions
+
+    def getForceDirected(self, graph, positions = None,
+        iterations = None, temperature = .1):
+
+        import numpy
+
+        count = len(graph.nodes)
+        if not count: return numpy.zeros((0, 2))
+        iterations = iterations or self.iterations
+        random = numpy.random.RandomState(0)
+        edges = graph.edges
+
+        if positions is None:
+            positions = random.uniform(-1., 1., (count, 2))
+        else:
+
+            # place new nodes at the center of their placed neighbours
+            positions = positions.copy()
+            new = numpy.isnan(positions[:, 0])
+            center = numpy.nanmean(positions, axis = 0)
+            for i in numpy.flatnonzero(new):
+                neighbours = numpy.concatenate([
+                    edges[edges[:, 0] == i, 1],
+                    edges[edges[:, 1] == i, 0]])
+                neighbours = neighbours[~new[neighbours]]
+                positions[i] = positions[neighbours].mean(axis = 0) \
+                    if len(neighbours) else center
+            positions[new] += random.normal(0., .01, (new.sum(), 2))
+
+        # Fruchterman-Reingold with exact or grid approximated repulsion
+        k2 = 4. / count
+        k = numpy.sqrt(k2)
+        for iteration in range(iterations):
+            if count <= self.exactCount:
+                displacement = self.getRepulsion(positions, positions, k2)
+            else: displacement = self.getGridRepulsion(positions, k2)
+            if len(edges):
+                delta = positions[edges[:, 0]] - positions[edges[:, 1]]
+                distance = numpy.sqrt((delta ** 2).sum(axis = 1))
+                force = delta * (distance / k)[:, None]
+                numpy.add.at(displacement, edges[:, 0], -force)
+                numpy.add.at(displacement, edges[:, 1], force)
+            length = numpy.maximum(numpy.sqrt(
+                (displacement ** 2).sum(axis = 1)), 1e-9)
+            step = temperature * (1. - float(iteration) / iterations)
+            positions += displacement \
+                * (numpy.minimum(length, step) / length)[:, None]
+
+        return positions
+
+    def getRepulsion(self, positions, sources, k2, masses = None):
+
+        import numpy
+
+        # rows are processed in blocks of bounded memory
+        rows = max(1, self.maxBlockBytes // (48 * max(len(sources), 1)))
+        displacement = numpy.zeros((len(positions), 2))
+        for start in range(0, len(positions), rows):
+            stop = start + rows
+            delta = positions[start:stop, None, :] - sources[None, :, :]
+            factor = k2 / numpy.maximum((delta ** 2).sum(axis = 2), 1e-9)
+            if masses is not None: factor *= masses[None, :]
+            displacement[start:stop] = \
+                (delta * factor[:, :, None]).sum(axis = 1)
+
+        return displacement
+
+    def getGridRepulsion(self, positions, k2):
+
+        import numpy
+
+        # assign nodes to the cells of a square grid
+        count = len(positions)
+        size = int(min(self.maxGrid,
+            numpy.ceil(numpy.sqrt(count / float(self.cellNodes)))))
+        lower = positions.min(axis = 0)
+        scale = size / numpy.maximum(positions.max(axis = 0) - lower, 1e-9)
+        cells = numpy.minimum(((positions - lower) * scale).astype(int),
+            size - 1)
+        cellIds = cells[:, 0] * size + cells[:, 1]
+        order = numpy.argsort(cellIds, kind = 'mergesort')
+        counts = numpy.bincount(cellIds, minlength = size * size)
+        starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+
+        # the far field of a cell is given by the centroids of the
+        # cells, which are not its neighbours
+        occupied = numpy.flatnonzero(counts)
+        masses = counts[occupied].astype(float)
+        centroids = numpy.zeros((len(occupied), 2))
+        index = numpy.searchsorted(occupied, cellIds)
+        numpy.add.at(centroids, index, positions)
+        centroids /= masses[:, None]
+        grid = numpy.column_stack([occupied // size, occupied % size])
+        far = numpy.zeros((len(occupied), 2))
+        rows = max(1, self.maxBlockBytes // (64 * len(occupied)))
+        for start in range(0, len(occupied), rows):
+            stop = start + rows
+            delta = centroids[start:stop, None, :] - centroids[None, :, :]
+            factor = k2 * masses[None, :] \
+                / numpy.maximum((delta ** 2).sum(axis = 2), 1e-9)
+            near = (numpy.abs(grid[start:stop, None, :]
+                - grid[None, :, :]) <= 1).all(axis = 2)
+            factor[near] = 0.
+            far[start:stop] = (delta * factor[:, :, None]).sum(axis = 1)
+        displacement = far[index]
+
+        # the near field is summed over all pairs of nodes in
+        # neighbouring cells, in chunks of bounded memory
+        sortedCells = cells[order]
+        maxPairs = max(1, self.maxBlockBytes // 64)
+        for dx in [-1, 0, 1]:
+            for dy in [-1, 0, 1]:
+                x = sortedCells[:, 0] + dx
+                y = sortedCells[:, 1] + dy
+                valid = (x >= 0) & (x < size) & (y >= 0) & (y < size)
+                target = numpy.where(valid, x * size + y, 0)
+                pairs = numpy.where(valid, counts[target], 0)
+                bounds = numpy.searchsorted(numpy.cumsum(pairs),
+                    numpy.arange(maxPairs, pairs.sum(), maxPairs))
+                for nodes in numpy.split(numpy.arange(count),
+                    numpy.unique(bounds)):
+                    if not len(nodes): continue
+                    num = pairs[nodes]
+                    total = num.sum()
+                    if not total: continue
+                    first = numpy.repeat(nodes, num)
+                    offset = numpy.arange(total) - numpy.repeat(
+                        numpy.cumsum(num) - num, num)
+                    second = numpy.repeat(starts[target[nodes]], num) \
+                        + offset
+                    keep = first != second
+                    first, second = first[keep], second[keep]
+                    delta = positions[order[first]] \
+                        - positions[order[second]]
+                    factor = k2 / numpy.maximum(
+                        (delta ** 2).sum(axis = 1), 1e-9)
+                    numpy.add.at(displacement, order[first],
+                        delta * factor[:, None])
+
+        return displacement
+
+class Graph(object):
+    """Node positions and edge indices of a network as numpy arrays."""
+
+    def __init__(self, instance):
+
+        import numpy
+
+        self.name = instance.name
+        self.nodes = list(instance.get('nodes'))
+        nodeIds = dict((node, i) for i, node in enumerate(self.nodes))
+        self.edges = numpy.array([(nodeIds[u], nodeIds[v])
+            for u, v in [edge[:2] for edge in instance.get('edges')]
+            if u in nodeIds and v in nodeIds], dtype = 'int64')
+        self.edges = self.edges.reshape((-1, 2))
+
+        layers = []
+        for node in self.nodes:
+            params = instance.get('node', node) or {}
+            layers.append(params.get('layer_id', None))
+        self.layers = layers if None not in layers else None
+
+        self.positions = Layout().get(self)
+
+class Plot(QtGui.QWidget):
+    """Embedded network plot with viewport culling and edge aggregation.
+
+    Nodes are drawn by one scatter item and edges by one curve item with
+    pairwise connected vertices. Only nodes and edges, which intersect
+    the view range are passed to the items. If more than maxEdges edges
+    are visible, edges are aggregated to edges between the cells of a
+    grid over the view range.
+
+    """
+
+    maxEdges = 20000
+    gridSize = 64
+    delay = 50
+
+    def __init__(self, graph, parent = None):
+        super(Plot, self).__init__(parent)
+
+        import pyqtgraph
+
+        self.graph = graph
+
+        self.canvas = pyqtgraph.GraphicsLayoutWidget()
+        self.view = self.canvas.addViewBox()
+        self.view.setAspectLocked(True)
+        self.edgeItem = pyqtgraph.PlotCurveItem(
+            pen = pyqtgraph.mkPen((120, 120, 120, 120)))
+        self.nodeItem = pyqtgraph.ScatterPlotItem(size = 8,
+            pen = pyqtgraph.mkPen(None),
+            brush = pyqtgraph.mkBrush(30, 90, 200))
+        self.view.addItem(self.edgeItem)
+        self.view.addItem(self.nodeItem)
+
+        layout = QtGui.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas)
+        self.setLayout(layout)
+
+        # collect range changes and redraw after a short delay
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.updateItems)
+        self.view.sigRangeChanged.connect(self.rangeChanged)
+
+        self.setGraph(graph)
+
+    def setGraph(self, graph):
+        self.graph = graph
+        self.resetView()
+
+    def resetView(self):
+
+        positions = self.graph.positions
+        if not len(positions): return self.updateItems()
+        (xmin, ymin), (xmax, ymax) = \
+            positions.min(axis = 0), positions.max(axis = 0)
+        self.view.setRange(xRange = (xmin, xmax), yRange = (ymin, ymax))
+        self.updateItems()
+
+    def rangeChanged(self, *args):
+        self.timer.start(self.delay)
+
+    def updateItems(self):
+
+        import numpy
+
+        positions = self.graph.positions
+        edges = self.graph.edges
+        (xmin, xmax), (ymin, ymax) = self.view.viewRange()
+
+        # cull nodes outside of the view range
+        x, y = positions[:, 0], positions[:, 1]
+        visible = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        self.nodeItem.setData(x = x[visible], y = y[visible])
+
+        if not len(edges):
+            self.edgeItem.setData(x = numpy.zeros(0), y = numpy.zeros(0))
+            return
+
+        # cull edges, which bounding box does not intersect the view
+        x0, y0 = x[edges[:, 0]], y[edges[:, 0]]
+        x1, y1 = x[edges[:, 1]], y[edges[:, 1]]
+        visible = (numpy.maximum(x0, x1) >= xmin) \
+            & (numpy.minimum(x0, x1) <= xmax) \
+            & (numpy.maximum(y0, y1) >= ymin) \
+            & (numpy.minimum(y0, y1) <= ymax)
+        x0, y0, x1, y1 = x0[visible], y0[visible], x1[visible], y1[visible]
+
+        # aggregate edges between grid cells if there are too many
+        if len(x0) > self.maxEdges:
+            size = self.gridSize
+            dx = (xmax - xmin) / size or 1.
+            dy = (ymax - ymin) / size or 1.
+            def getCell(px, py):
+                cx = numpy.clip(((px - xmin) / dx).astype('int64'),
+                    -1, size)
+                cy = numpy.clip(((py - ymin) / dy).astype('int64'),
+                    -1, size)
+                return (cx + 1) * (size + 2) + (cy + 1)
+            keys = getCell(x0, y0) * (size + 2) ** 2 + getCell(x1, y1)
+            keys = numpy.unique(keys)
+            cell0, cell1 = numpy.divmod(keys, (size + 2) ** 2)
+            def getCenter(cell):
+                cx, cy = numpy.divmod(cell, size + 2)
+                return xmin + (cx - .5) * dx, ymin + (cy - .5) * dy
+            (x0, y0), (x1, y1) = getCenter(cell0), getCenter(cell1)
+
+        # draw all edges as one curve of pairwise connected vertices
+        count = len(x0)
+        ex = numpy.empty(2 * count)
+        ey = numpy.empty(2 * count)
+        ex[0::2], ex[1::2] = x0, x1
+        ey[0::2], ey[1::2] = y0, y1
+        connect = numpy.zeros(2 * count, dtype = 'bool')
+        connect[0::2] = True
+        self.edgeItem.setData(x = ex, y = ey, connect = connect)
+
 class Editor(qdeep.objects.common.Editor):
     objType = 'network'
+    graph = None
 
     def createActions(self):
         self.actPlotNetwork = QtGui.QAction(
@@ -19,9 +428,21 @@ class Editor(qdeep.objects.common.Editor):
             statusTip = "Plot network",
             triggered = self.plotNetwork)
 
+    def loadInstance(self, objName):
+
+        # the layout is computed on the worker thread
+        instance = super(Editor, self).loadInstance(objName)
+        if instance: self.graph = Graph(instance)
+        return instance
+
+    def createCentralWidget(self):
+        if not self.graph:
+            return super(Editor, self).createCentralWidget()
+        self.plot = Plot(self.graph)
+        self.setCentralWidget(self.plot)
+
     def plotNetwork(self):
-        if self.objInstance:
-            self.objInstance.show()
+        if self.graph: self.plot.resetView()
 
     def createToolBars(self):
         self.tbar = self.addToolBar("Network")
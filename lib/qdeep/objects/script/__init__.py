@@ -4,15 +4,27 @@ __author__  = 'Patrick Michl'
 __email__   = 'patrick.michl@gmail.com'
 __license__ = 'GPLv3'
 
-import nemoa
+import qdeep.common.runner
 import qdeep.objects.common
 from PySide import QtGui, QtCore
 
 class Editor(qdeep.objects.common.Editor):
     objType = 'script'
+    loadInBackground = False
+    watchInstance = False
+    job = None
+
+    # large files are streamed into the document in chunks of
+    # chunkSize characters, one chunk per event loop iteration
+    chunkSize = 65536
+    loader = None
+
+    # highlighting of loaded files proceeds by highlightBlocks blocks
+    # per event loop iteration
+    highlightBlocks = 1000
 
     def createCentralWidget(self):
-        self.textArea = QtGui.QTextEdit()
+        self.textArea = QtGui.QPlainTextEdit()
         self.textArea.setHorizontalScrollBarPolicy(
             QtCore.Qt.ScrollBarAsNeeded)
         self.textArea.setVerticalScrollBarPolicy(
@@ -27,6 +39,25 @@ class Editor(qdeep.objects.common.Editor):
         self.textArea.setAcceptDrops(True)
         self.highlighter = Highlighter(self.textArea.document())
         self.setCentralWidget(self.textArea)
+        self.createConsole()
+
+        self.loadTimer = QtCore.QTimer(self)
+        self.loadTimer.timeout.connect(self.loadNextChunk)
+        self.highlightTimer = QtCore.QTimer(self)
+        self.highlightTimer.timeout.connect(self.highlightNextBlocks)
+
+    def createConsole(self):
+        dock = QtGui.QDockWidget("Output", self)
+        dock.setAllowedAreas(QtCore.Qt.BottomDockWidgetArea \
+            | QtCore.Qt.TopDockWidgetArea)
+        self.console = QtGui.QPlainTextEdit(dock)
+        self.console.setReadOnly(True)
+        self.console.setMaximumBlockCount(10000)
+        self.console.setFont(self.textArea.font())
+        dock.setWidget(self.console)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock)
+        dock.hide()
+        self.dockConsole = dock
 
     def createActions(self):
         self.actRunScript = QtGui.QAction(
@@ -35,14 +66,46 @@ class Editor(qdeep.objects.common.Editor):
             shortcut = "F5",
             statusTip = "Run python script",
             triggered = self.runScript)
+        self.actStopScript = QtGui.QAction(
+            qdeep.common.getIcon('actions', 'process-stop.png'),
+            "Stop Script", self,
+            shortcut = "Shift+F5",
+            statusTip = "Stop running python script",
+            triggered = self.stopScript,
+            enabled = False)
 
     def createToolBars(self):
         self.scriptToolBar = self.addToolBar("Script")
         self.scriptToolBar.addAction(self.actRunScript)
+        self.scriptToolBar.addAction(self.actStopScript)
 
     def getModified(self):
+        if self.loader: return False
         return self.textArea.document().isModified()
 
+    def documentWasModified(self):
+        if self.loader: return
+        super(Editor, self).documentWasModified()
+
+    def getGeneration(self):
+        return self.textArea.document().revision()
+
+    def getSnapshot(self):
+        if self.loader: return None
+        return self.textArea.toPlainText()
+
+    def setRecovery(self, state):
+        if self.loader:
+            self.recoveryState = state
+            return True
+        return self.applySnapshot(state)
+
+    def applySnapshot(self, state):
+        self.textArea.setPlainText(state)
+        self.setModified(True)
+        self.documentWasModified()
+        return True
+
     def setModified(self, value = True):
         self.textArea.document().setModified(value)
 
@@ -54,14 +117,80 @@ class Editor(qdeep.objects.common.Editor):
                 fileName, file.errorString()))
             return False
 
-        instr = QtCore.QTextStream(file)
-        self.textArea.setPlainText(instr.readAll())
-        self.textArea.document().contentsChanged.connect(
-            self.documentWasModified)
+        # detach highlighter and undo stack until the file is loaded
+        document = self.textArea.document()
+        self.highlightTimer.stop()
+        self.highlighter.setDocument(None)
+        document.setUndoRedoEnabled(False)
+        self.textArea.clear()
+        self.textArea.setReadOnly(True)
+
+        self.loader = self.readChunks(file)
+        self.loadTimer.start(0)
 
         return True
 
+    def readChunks(self, file):
+        instr = QtCore.QTextStream(file)
+        cursor = QtGui.QTextCursor(self.textArea.document())
+        while not instr.atEnd():
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.insertText(instr.read(self.chunkSize))
+            yield
+        file.close()
+
+    def loadNextChunk(self):
+        try:
+            next(self.loader)
+            return
+        except StopIteration:
+            pass
+
+        self.loadTimer.stop()
+        self.loader = None
+
+        document = self.textArea.document()
+        document.setUndoRedoEnabled(True)
+        self.textArea.setReadOnly(False)
+        self.textArea.moveCursor(QtGui.QTextCursor.Start)
+        self.setModified(False)
+        self.setWindowModified(False)
+
+        # highlight when the event loop is idle
+        QtCore.QTimer.singleShot(0, self.attachHighlighter)
+
+        if self.recoveryState is not None:
+            state, self.recoveryState = self.recoveryState, None
+            self.applySnapshot(state)
+
+    def attachHighlighter(self):
+        if self.loader: return
+
+        # blocks are highlighted in chunks, such that large documents
+        # are not highlighted in one pass
+        self.highlighter.limit = -1
+        self.highlighter.setDocument(self.textArea.document())
+        self.highlightTimer.start(0)
+
+    def highlightNextBlocks(self):
+        first = self.highlighter.limit + 1
+        self.highlighter.limit = first + self.highlightBlocks - 1
+        block = self.textArea.document().findBlockByNumber(first)
+        while block.isValid() \
+            and block.blockNumber() <= self.highlighter.limit:
+            self.highlighter.rehighlightBlock(block)
+            block = block.next()
+        if block.isValid(): return
+        self.highlightTimer.stop()
+        self.highlighter.limit = None
+
     def saveFile(self, fileName):
+        if self.loader:
+            QtGui.QMessageBox.information(self, "MDI",
+                "Cannot write file %s:\nThe file is still loading." % (
+                fileName))
+            return False
+
         file = QtCore.QFile(fileName)
 
         if not file.open(QtCore.QFile.WriteOnly | QtCore.QFile.Text):
@@ -81,87 +210,179 @@ class Editor(qdeep.objects.common.Editor):
         return True
 
     def runScript(self):
-        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-        nemoa.run(self.getName())
-        QtGui.QApplication.restoreOverrideCursor()
+        if self.job and self.job.isActive(): return False
+
+        # the worker process runs the script file from the workspace
+        if self.getModified():
+            ret = QtGui.QMessageBox.question(self, "MDI",
+                "'%s' has been modified.\nDo you want to save it before "
+                "it is run?" % self.getTitle(),
+                QtGui.QMessageBox.Save | QtGui.QMessageBox.Cancel)
+            if ret != QtGui.QMessageBox.Save or not self.save():
+                return False
+
+        self.console.clear()
+        self.dockConsole.show()
+        self.job = qdeep.common.runner.Job(self.getName())
+        self.job.started.connect(self.scriptStarted)
+        self.job.output.connect(self.writeConsole)
+        self.job.finished.connect(self.scriptFinished)
+        self.actRunScript.setEnabled(False)
+        self.actStopScript.setEnabled(True)
+        qdeep.common.runner.getRunner().submit(self.job)
+
+        return True
+
+    def stopScript(self):
+        if self.job: self.job.cancel()
+
+    def closeEvent(self, event):
+
+        # a running script would remain as an orphaned process
+        if self.job and self.job.isActive():
+            ret = QtGui.QMessageBox.question(self, "MDI",
+                "Script '%s' is still running.\nDo you want to stop it?"
+                % self.getTitle(),
+                QtGui.QMessageBox.Yes | QtGui.QMessageBox.Cancel)
+            if ret != QtGui.QMessageBox.Yes: return event.ignore()
+        super(Editor, self).closeEvent(event)
+        if event.isAccepted() and self.job: self.job.cancel()
+
+    def scriptStarted(self):
+        self.writeConsole("running script '%s'\n" % self.job.script)
+
+    def scriptFinished(self):
+        self.writeConsole("\nscript %s (exit code %s)\n" % (
+            self.job.status, self.job.exitCode))
+        self.actRunScript.setEnabled(True)
+        self.actStopScript.setEnabled(False)
+
+    def writeConsole(self, text):
+        self.console.moveCursor(QtGui.QTextCursor.End)
+        self.console.insertPlainText(text)
+        self.console.ensureCursorVisible()
 
 class Highlighter(QtGui.QSyntaxHighlighter):
-    def __init__(self, parent=None):
+    """Syntax highlighter for python scripts.
+
+    All rules are merged into one precompiled expression, which is
+    shared by all instances and scanned once per block. Multiline
+    strings are tracked by the block state, such that changes are only
+    propagated to following blocks while their state changes.
+
+    """
+
+    NORMAL = 0
+    SINGLE = 1
+    DOUBLE = 2
+    delimiters = {SINGLE: "'''", DOUBLE: '"""'}
+    tokens = None
+
+    # blocks after limit are left to be highlighted later
+    limit = None
+
+    @classmethod
+    def compileRules(cls):
+
+        import keyword
+        import re
+
+        if cls.tokens: return cls.tokens
+
+        keywords = '|'.join(keyword.kwlist)
+        cls.tokens = re.compile('|'.join([
+            r'(?P<comment>#[^\n]*)',
+            r'(?P<triple>(?:\b[rRuUbB]{1,2})?(?:\'\'\'|"""))',
+            r'(?P<string>(?:\b[rRuUbB]{1,2})?(?:'
+                r'\'(?:[^\'\\\n]|\\.)*\'?|"(?:[^"\\\n]|\\.)*"?))',
+            r'(?P<decorator>@[\w.]+)',
+            r'\b(?P<define>def|class)\b\s*(?P<name>\w*)',
+            r'\b(?P<constant>True|False|None|self)\b',
+            r'\b(?P<keyword>%s)\b' % keywords,
+            r'\b(?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?[jJlL]?)\b',
+            r'\b(?P<function>[A-Za-z_]\w*)(?=\s*\()']))
+
+        return cls.tokens
+
+    def __init__(self, parent = None):
         super(Highlighter, self).__init__(parent)
 
+        self.compileRules()
+
         keywordFormat = QtGui.QTextCharFormat()
         keywordFormat.setForeground(QtCore.Qt.darkBlue)
         keywordFormat.setFontWeight(QtGui.QFont.Bold)
 
-        keywordPatterns = ["\\bchar\\b", "\\bclass\\b", "\\bconst\\b",
-            "\\bdouble\\b", "\\benum\\b", "\\bexplicit\\b", "\\bfriend\\b",
-            "\\binline\\b", "\\bint\\b", "\\blong\\b", "\\bnamespace\\b",
-            "\\boperator\\b", "\\bprivate\\b", "\\bprotected\\b",
-            "\\bpublic\\b", "\\bshort\\b", "\\bsignals\\b", "\\bsigned\\b",
-            "\\bslots\\b", "\\bstatic\\b", "\\bstruct\\b",
-            "\\btemplate\\b", "\\btypedef\\b", "\\btypename\\b",
-            "\\bunion\\b", "\\bunsigned\\b", "\\bvirtual\\b", "\\bvoid\\b",
-            "\\bvolatile\\b", "\\bimport\\b", "\\bdef\\b",
-            "\\bTrue\\b", "\\bFalse\\b", "\\breturn\\b"]
-
-        self.highlightingRules = [(QtCore.QRegExp(pattern), keywordFormat)
-            for pattern in keywordPatterns]
-
         classFormat = QtGui.QTextCharFormat()
         classFormat.setFontWeight(QtGui.QFont.Bold)
         classFormat.setForeground(QtCore.Qt.darkMagenta)
-        self.highlightingRules.append((QtCore.QRegExp("\\bQ[A-Za-z]+\\b"),
-            classFormat))
 
-        singleLineCommentFormat = QtGui.QTextCharFormat()
-        singleLineCommentFormat.setForeground(QtCore.Qt.red)
-        self.highlightingRules.append((QtCore.QRegExp("//[^\n]*"),
-            singleLineCommentFormat))
-
-        self.multiLineCommentFormat = QtGui.QTextCharFormat()
-        self.multiLineCommentFormat.setForeground(QtCore.Qt.red)
+        commentFormat = QtGui.QTextCharFormat()
+        commentFormat.setForeground(QtCore.Qt.red)
 
         quotationFormat = QtGui.QTextCharFormat()
         quotationFormat.setForeground(QtCore.Qt.darkGreen)
-        self.highlightingRules.append((QtCore.QRegExp("\".*\""),
-            quotationFormat))
-        self.highlightingRules.append((QtCore.QRegExp("'.*'"),
-            quotationFormat))
 
         functionFormat = QtGui.QTextCharFormat()
         functionFormat.setFontItalic(True)
         functionFormat.setForeground(QtCore.Qt.blue)
-        self.highlightingRules.append((QtCore.QRegExp("\\b[A-Za-z0-9_]+(?=\\()"),
-            functionFormat))
 
-        self.commentStartExpression = QtCore.QRegExp("/\\*")
-        self.commentEndExpression = QtCore.QRegExp("\\*/")
+        numberFormat = QtGui.QTextCharFormat()
+        numberFormat.setForeground(QtCore.Qt.darkCyan)
+
+        self.formats = {
+            'comment': commentFormat,
+            'string': quotationFormat,
+            'decorator': classFormat,
+            'define': keywordFormat,
+            'name': classFormat,
+            'constant': classFormat,
+            'keyword': keywordFormat,
+            'number': numberFormat,
+            'function': functionFormat}
 
     def highlightBlock(self, text):
-        for pattern, format in self.highlightingRules:
-            expression = QtCore.QRegExp(pattern)
-            index = expression.indexIn(text)
-            while index >= 0:
-                length = expression.matchedLength()
-                self.setFormat(index, length, format)
-                index = expression.indexIn(text, index + length)
-
-        self.setCurrentBlockState(0)
-
-        startIndex = 0
-        if self.previousBlockState() != 1:
-            startIndex = self.commentStartExpression.indexIn(text)
-
-        while startIndex >= 0:
-            endIndex = self.commentEndExpression.indexIn(text, startIndex)
-
-            if endIndex == -1:
-                self.setCurrentBlockState(1)
-                commentLength = len(text) - startIndex
+        if self.limit is not None \
+            and self.currentBlock().blockNumber() > self.limit: return
+
+        stringFormat = self.formats['string']
+        pos = 0
+
+        # continue multiline string of previous block
+        state = self.previousBlockState()
+        if state in self.delimiters:
+            end = text.find(self.delimiters[state])
+            if end == -1:
+                self.setFormat(0, len(text), stringFormat)
+                self.setCurrentBlockState(state)
+                return
+            pos = end + 3
+            self.setFormat(0, pos, stringFormat)
+
+        self.setCurrentBlockState(self.NORMAL)
+
+        while True:
+            match = self.tokens.search(text, pos)
+            if not match: break
+            start, pos = match.span()
+            kind = match.lastgroup
+
+            if kind == 'triple':
+                delimiter = match.group(kind)[-3:]
+                end = text.find(delimiter, pos)
+                if end == -1:
+                    self.setFormat(start, len(text) - start, stringFormat)
+                    self.setCurrentBlockState(self.SINGLE
+                        if delimiter == "'''" else self.DOUBLE)
+                    return
+                pos = end + 3
+                self.setFormat(start, pos - start, stringFormat)
+            elif kind == 'name':
+                self.setFormat(start, match.end('define') - start,
+                    self.formats['define'])
+                self.setFormat(match.start('name'),
+                    pos - match.start('name'), self.formats['name'])
             else:
-                commentLength = endIndex - startIndex + self.commentEndExpression.matchedLength()
+                self.setFormat(start, pos - start, self.formats[kind])
 
-            self.setFormat(startIndex, commentLength,
-                    self.multiLineCommentFormat)
-            startIndex = self.commentStartExpression.indexIn(text,
-                    startIndex + commentLength)
+            if pos == start: pos += 1
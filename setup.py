@@ -160,6 +160,35 @@ def postinstall():
 
         return True
 
+    def compileicons(path):
+
+        import glob
+        import os
+        import subprocess
+
+        print('compiling icon bundle %s' % path)
+
+        # write qt resource collection of all icons
+        files = []
+        for filepath in sorted(glob.glob(os.path.join(path, '*', '*.png'))):
+            files.append('<file>%s</file>' % '/'.join(
+                os.path.relpath(filepath, path).split(os.path.sep)))
+        qrcfile = os.path.join(path, 'icons.qrc')
+        with open(qrcfile, 'w') as file_handler:
+            file_handler.write('<!DOCTYPE RCC><RCC version="1.0">\n'
+                '<qresource prefix="/icons">\n%s\n'
+                '</qresource>\n</RCC>\n' % '\n'.join(files))
+
+        # compile binary resource with qt resource compiler
+        try:
+            subprocess.check_call(['rcc', '-binary', 'icons.qrc',
+                '-o', 'icons.rcc'], cwd = path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print('icon bundle not compiled. Error: %s' % e)
+            return False
+
+        return True
+
     print('running postinstall')
 
     # copy application data
@@ -169,6 +198,9 @@ def postinstall():
     site_tgt_base = getpath(site_tgt_base)
     copytree(site_src_base, site_tgt_base)
 
+    # compile icon bundle
+    compileicons(getpath((site_tgt_base, 'images', 'icons')))
+
 if __name__ == '__main__':
 
     import sys